@@ -0,0 +1,130 @@
+"""
+Debounced per-device alert state for the MQTT alert topics.
+
+Each device moves between ok -> warning -> critical on its risk
+probability. Escalation is immediate; stepping down needs the probability
+to fall ALERT_HYSTERESIS below the level's threshold and the level to have
+been held for ALERT_MIN_HOLD_SECS. An alert is published only when the
+level changes, or every ALERT_HEARTBEAT_SECS while the device keeps
+reporting, so devices and subscribers still learn the current state.
+All times are reading (event) times, not wall-clock.
+"""
+import os
+import threading
+
+ALERT_WARNING_AT = float(os.getenv("ALERT_WARNING_AT", 0.5))
+ALERT_CRITICAL_AT = float(os.getenv("ALERT_CRITICAL_AT", 0.8))
+ALERT_HYSTERESIS = float(os.getenv("ALERT_HYSTERESIS", 0.1))
+ALERT_MIN_HOLD_SECS = float(os.getenv("ALERT_MIN_HOLD_SECS", 60))
+ALERT_HEARTBEAT_SECS = float(os.getenv("ALERT_HEARTBEAT_SECS", 300))
+
+OK, WARNING, CRITICAL = "ok", "warning", "critical"
+RANK = {OK: 0, WARNING: 1, CRITICAL: 2}
+
+
+class Alert:
+    __slots__ = ("device_id", "level", "previous", "probability", "reasons", "timestamp", "heartbeat")
+
+    def __init__(self, device_id, level, previous, probability, reasons, timestamp, heartbeat=False):
+        self.device_id = device_id
+        self.level = level
+        self.previous = previous  # None for the first alert after startup
+        self.probability = probability
+        self.reasons = reasons
+        self.timestamp = timestamp
+        self.heartbeat = heartbeat
+
+    def payload(self):
+        """Alert topic message; the firmware only reads `probability`."""
+        return {
+            "probability": float(self.probability),
+            "level": self.level,
+            "previous": self.previous,
+            "reasons": self.reasons,
+            "timestamp": self.timestamp.isoformat(),
+            "heartbeat": self.heartbeat,
+        }
+
+
+class AlertState:
+    __slots__ = ("level", "since", "published_at")
+
+    def __init__(self, level=None, since=None, published_at=None):
+        self.level = level
+        self.since = since
+        self.published_at = published_at
+
+
+class AlertEngine:
+    """Per-device alert state machines; thread-safe."""
+
+    def __init__(self, warning_at=ALERT_WARNING_AT, critical_at=ALERT_CRITICAL_AT,
+                 hysteresis=ALERT_HYSTERESIS, min_hold_secs=ALERT_MIN_HOLD_SECS,
+                 heartbeat_secs=ALERT_HEARTBEAT_SECS):
+        self.thresholds = {WARNING: warning_at, CRITICAL: critical_at}
+        self.hysteresis = hysteresis
+        self.min_hold_secs = min_hold_secs
+        self.heartbeat_secs = heartbeat_secs
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def classify(self, probability, current=OK):
+        """Level for `probability`, given the level the device is in now."""
+        if probability >= self.thresholds[CRITICAL]:
+            return CRITICAL
+        if probability >= self.thresholds[WARNING]:
+            target = WARNING
+        else:
+            target = OK
+        # Stepping down: a level is kept until the probability is `hysteresis` below its threshold
+        for level in (CRITICAL, WARNING):
+            if RANK[target] < RANK[level] <= RANK[current] \
+                    and probability >= self.thresholds[level] - self.hysteresis:
+                return level
+        return target
+
+    def evaluate(self, device_id, probability, reasons, timestamp):
+        """Advances the device's state; returns the Alert to publish, or None."""
+        with self._lock:
+            state = self._states.get(device_id)
+            if state is None:
+                state = self._states[device_id] = AlertState()
+            current = state.level or OK
+            level = self.classify(probability, current)
+            if state.level is not None and RANK[level] < RANK[current] \
+                    and (timestamp - state.since).total_seconds() < self.min_hold_secs:
+                level = current
+
+            previous = state.level
+            if level != state.level:
+                state.level, state.since = level, timestamp
+            elif (timestamp - state.published_at).total_seconds() < self.heartbeat_secs:
+                return None
+            state.published_at = timestamp
+            return Alert(device_id, level, previous, probability, reasons, timestamp,
+                         heartbeat=level == previous)
+
+    def evaluate_batch(self, readings):
+        """
+        readings: (device_id, probability, reasons, timestamp) in time order.
+        Returns every level change in order (a store-and-forward batch can
+        hold several per device), then at most one heartbeat per device that
+        had no level change in the batch.
+        """
+        changes, heartbeats = [], {}
+        for device_id, probability, reasons, timestamp in readings:
+            alert = self.evaluate(device_id, probability, reasons, timestamp)
+            if alert is None:
+                continue
+            if alert.heartbeat:
+                heartbeats[device_id] = alert
+            else:
+                changes.append(alert)
+        changed = {alert.device_id for alert in changes}
+        return changes + [alert for device_id, alert in heartbeats.items() if device_id not in changed]
+
+    def snapshot(self):
+        """Returns {device_id: {level, since}}."""
+        with self._lock:
+            return {device_id: {"level": state.level, "since": state.since}
+                    for device_id, state in self._states.items()}
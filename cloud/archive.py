@@ -0,0 +1,290 @@
+"""
+On-disk archive of raw readings moved out of sensor_data by retention.py.
+
+Layout: one file per UTC day and device,
+
+    ARCHIVE_DIR/date=2026-01-31/device=reefer-042.csv.gz   (or .parquet)
+
+each holding the joined sensor_data + risk_assessments rows of that day in
+(timestamp, id) order. Parquet is used when pyarrow is installed (or
+ARCHIVE_FORMAT=parquet); otherwise gzip CSV. Both formats are read back
+regardless of the current setting.
+
+history_api merges read_range() with the live tables for any range that
+starts before covered_until(). Parsed partitions are kept in a small LRU
+keyed on file mtime, so paging through archived days does not re-read them.
+"""
+import os
+import csv
+import gzip
+import heapq
+import threading
+import importlib.util
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+from urllib.parse import quote, unquote
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# pyarrow is optional (gzip CSV only without it) and imported on first use:
+# the ingest and API processes import this module but rarely touch Parquet
+HAS_PYARROW = importlib.util.find_spec("pyarrow") is not None
+
+ARCHIVE_DIR = os.getenv("ARCHIVE_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "archive"))
+ARCHIVE_FORMAT = os.getenv("ARCHIVE_FORMAT", "parquet" if HAS_PYARROW else "csv.gz")
+ARCHIVE_CACHE_PARTITIONS = int(os.getenv("ARCHIVE_CACHE_PARTITIONS", 64))
+
+FORMATS = ("parquet", "csv.gz")
+FIELDS = ("id", "device_id", "shipment_id", "seq", "timestamp", "temperature",
+          "vibration", "rpm", "risk_probability", "risk_reasons")
+
+# NULL marker in CSV files (as in PostgreSQL COPY), so '' stays an empty string
+CSV_NULL = r"\N"
+
+# Same attribute names as history_api.row_columns(), so rows serialize alike
+ArchiveRow = namedtuple("ArchiveRow", FIELDS)
+
+
+def _pyarrow():
+    """(pyarrow, pyarrow.parquet, schema), imported on first call."""
+    if not HAS_PYARROW:
+        raise RuntimeError("Parquet archives require pyarrow")
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = pa.schema([
+        ("id", pa.int64()),
+        ("device_id", pa.string()),
+        ("shipment_id", pa.string()),
+        ("seq", pa.int64()),
+        ("timestamp", pa.timestamp("us")),
+        ("temperature", pa.float64()),
+        ("vibration", pa.float64()),
+        ("rpm", pa.int64()),
+        ("risk_probability", pa.float64()),
+        ("risk_reasons", pa.string()),
+    ])
+    return pa, pq, schema
+
+
+def sort_key(row):
+    return (row.timestamp, row.id)
+
+
+def day_start(ts):
+    return datetime(ts.year, ts.month, ts.day)
+
+
+def partition_dir(day, root=ARCHIVE_DIR):
+    return os.path.join(root, f"date={day:%Y-%m-%d}")
+
+
+def partition_path(day, device_id, fmt=ARCHIVE_FORMAT, root=ARCHIVE_DIR):
+    # Device ids are free-form strings from the topic payload
+    return os.path.join(partition_dir(day, root), f"device={quote(device_id, safe='')}.{fmt}")
+
+
+def _format_of(path):
+    for fmt in FORMATS:
+        if path.endswith("." + fmt):
+            return fmt
+    return None
+
+
+def days(root=ARCHIVE_DIR):
+    """Archived days, oldest first."""
+    try:
+        names = os.listdir(root)
+    except FileNotFoundError:
+        return []
+    found = []
+    for name in names:
+        if name.startswith("date="):
+            try:
+                found.append(datetime.strptime(name[5:], "%Y-%m-%d"))
+            except ValueError:
+                continue
+    return sorted(found)
+
+
+def covered_until(root=ARCHIVE_DIR):
+    """End of the newest archived day (exclusive), or None if nothing is archived."""
+    archived = days(root)
+    return archived[-1] + timedelta(days=1) if archived else None
+
+
+def partitions(day, device_id=None, root=ARCHIVE_DIR):
+    """[(device_id, path)] for one day, optionally a single device."""
+    directory = partition_dir(day, root)
+    try:
+        names = sorted(os.listdir(directory))
+    except FileNotFoundError:
+        return []
+    found = []
+    for name in names:
+        fmt = _format_of(name)
+        if not name.startswith("device=") or fmt is None:
+            continue
+        device = unquote(name[len("device="):-len(fmt) - 1])
+        if device_id is None or device == device_id:
+            found.append((device, os.path.join(directory, name)))
+    return found
+
+
+# Readers / writers
+def _parse(value, cast):
+    return None if value == CSV_NULL else cast(value)
+
+
+def _read_csv(path):
+    with gzip.open(path, "rt", newline="") as f:
+        reader = csv.reader(f)
+        next(reader, None)
+        return [ArchiveRow(
+            int(row[0]), row[1], _parse(row[2], str), _parse(row[3], int),
+            datetime.fromisoformat(row[4]), _parse(row[5], float), _parse(row[6], float),
+            _parse(row[7], int), _parse(row[8], float), _parse(row[9], str),
+        ) for row in reader]
+
+
+def _write_csv(path, rows):
+    with gzip.open(path, "wt", newline="", compresslevel=6) as f:
+        writer = csv.writer(f)
+        writer.writerow(FIELDS)
+        for row in rows:
+            writer.writerow([
+                CSV_NULL if value is None else value.isoformat() if isinstance(value, datetime) else value
+                for value in row
+            ])
+
+
+def _read_parquet(path):
+    _, pq, _ = _pyarrow()
+    return [ArchiveRow(**record) for record in pq.read_table(path).to_pylist()]
+
+
+def _write_parquet(path, rows):
+    pa, pq, schema = _pyarrow()
+    columns = {field: [getattr(row, field) for row in rows] for field in FIELDS}
+    pq.write_table(pa.Table.from_pydict(columns, schema=schema), path, compression="zstd")
+
+
+class PartitionCache:
+    """LRU of parsed partitions, keyed on (path, mtime, size)."""
+
+    def __init__(self, max_entries=ARCHIVE_CACHE_PARTITIONS):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, path):
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return []
+        key = (path, stat.st_mtime_ns, stat.st_size)
+        with self._lock:
+            rows = self._entries.get(key)
+            if rows is not None:
+                self._entries.move_to_end(key)
+                return rows
+        rows = _read_parquet(path) if _format_of(path) == "parquet" else _read_csv(path)
+        with self._lock:
+            self._entries[key] = rows
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+        return rows
+
+
+partition_cache = PartitionCache()
+
+
+def read_partition(path):
+    return partition_cache.get(path)
+
+
+def read_device_day(day, device_id, root=ARCHIVE_DIR):
+    """Archived rows of one device-day (any format), in (timestamp, id) order."""
+    rows = []
+    for _, path in partitions(day, device_id, root):
+        rows.extend(read_partition(path))
+    return sorted(rows, key=sort_key)
+
+
+def write_partition(day, device_id, rows, fmt=ARCHIVE_FORMAT, root=ARCHIVE_DIR):
+    """
+    Writes (replaces) one device-day file atomically: temp file, fsync,
+    rename. Files of that device-day in the other format are removed, so
+    switching ARCHIVE_FORMAT never leaves two copies of a row behind.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unknown ARCHIVE_FORMAT: {fmt}")
+    directory = partition_dir(day, root)
+    os.makedirs(directory, exist_ok=True)
+    path = partition_path(day, device_id, fmt, root)
+    tmp = path + ".tmp"
+    if fmt == "parquet":
+        _write_parquet(tmp, rows)
+    else:
+        _write_csv(tmp, rows)
+    with open(tmp, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    for _, other in partitions(day, device_id, root):
+        if other != path:
+            os.remove(other)
+    return path
+
+
+def read_range(start, end=None, device_id=None, shipment_id=None, newest_first=False, root=ARCHIVE_DIR):
+    """
+    Yields archived rows with start <= timestamp < end in (timestamp, id)
+    order (descending with newest_first). Reads only the day partitions the
+    range touches, one day at a time.
+    """
+    archived = [day for day in days(root)
+                if day + timedelta(days=1) > start and (end is None or day < end)]
+    if newest_first:
+        archived.reverse()
+    for day in archived:
+        files = [read_partition(path) for _, path in partitions(day, device_id, root)]
+        rows = heapq.merge(*[reversed(rows) for rows in files] if newest_first else files,
+                           key=sort_key, reverse=newest_first)
+        for row in rows:
+            if row.timestamp < start or (end is not None and row.timestamp >= end):
+                continue
+            if shipment_id and row.shipment_id != shipment_id:
+                continue
+            yield row
+
+
+def merge_rows(live, archived, newest_first=False):
+    """
+    Merges two (timestamp, id)-ordered row streams lazily. A row present in
+    both (archived, not yet deleted by a running retention job) is yielded once.
+    """
+    previous = None
+    for row in heapq.merge(live, archived, key=sort_key, reverse=newest_first):
+        key = sort_key(row)
+        if key != previous:
+            yield row
+        previous = key
+
+
+def summary(root=ARCHIVE_DIR):
+    """Partition count, size and day range of the archive."""
+    archived = days(root)
+    files, size = 0, 0
+    for day in archived:
+        for _, path in partitions(day, root=root):
+            files += 1
+            size += os.path.getsize(path)
+    return {
+        "dir": root,
+        "format": ARCHIVE_FORMAT,
+        "days": len(archived),
+        "first_day": archived[0].date().isoformat() if archived else None,
+        "last_day": archived[-1].date().isoformat() if archived else None,
+        "files": files,
+        "bytes": size,
+    }
@@ -0,0 +1,386 @@
+"""
+Asyncio ingest service (alternative to mqtt_subscriber's blocking loop).
+
+Pipeline per message:
+    parse -> score (in-memory, micro-batched, per-device order) -> persist
+    (batched, async pooled DB) -> alert publish (level changes / heartbeats,
+    see alerts.py)
+
+The MQTT reader never waits on storage: persistence runs in a separate
+writer task with up to DB_CONCURRENCY batches in flight, and a per-device
+semaphore bounds how many of one device's readings are in flight at once.
+A batch waits for the earlier in-flight batches of its devices, so each
+device's rollups are folded and its late readings re-scored in order, and
+the scorer folds late readings into the excursion tracker itself (no DB
+rebuild that would drop the device's scored but uncommitted readings). A
+failed batch rolls back its rollup gaps, and the excursion / ML state of
+its devices to before their oldest uncommitted reading.
+
+Usage:
+    python async_ingest.py
+"""
+import os
+import json
+import time
+IMPORT_STARTED = time.perf_counter()
+import asyncio
+from collections import defaultdict
+import aiomqtt
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from db import DB_URL, DB_POOL_SIZE, DB_POOL_RECYCLE, SensorData, RiskAssessment
+from mqtt_subscriber import (
+    MQTT_BROKER, MQTT_PORT, MQTT_TOPIC, MQTT_BINARY_TOPIC, MQTT_LEGACY_TOPIC,
+    BATCH_MAX_SIZE, BATCH_MAX_LATENCY_MS,
+    score_sensor_batch, parse_message, alert_topic, warm_up,
+    excursions, rollup_accumulator, risk_model, insert_sensor_rows, is_late, rescore_late_readings, rebuild_late_rollups,
+    alert_engine, alert_published, notifier, compliance_tracker,
+)
+from rollups import upsert_rollups
+from cache import data_version
+from live import MQTT_LIVE_TOPIC, LIVE_LATE_TOPIC, live_row
+from logs import get_logger
+import metrics
+
+DB_CONCURRENCY = int(os.getenv("DB_CONCURRENCY", 4))
+DEVICE_CONCURRENCY = int(os.getenv("DEVICE_CONCURRENCY", 8))
+MAX_IN_FLIGHT = int(os.getenv("MAX_IN_FLIGHT", 10000))
+SCORE_BATCH_MAX = int(os.getenv("SCORE_BATCH_MAX", 1000))
+
+log = get_logger("async_ingest")
+
+_ASYNC_DRIVERS = {
+    "postgresql://": "postgresql+asyncpg://",
+    "postgres://": "postgresql+asyncpg://",
+    "sqlite:///": "sqlite+aiosqlite:///",
+}
+
+
+def async_db_url(url):
+    """Maps the sync DATABASE_URL onto its asyncio driver (asyncpg / aiosqlite)."""
+    for prefix, replacement in _ASYNC_DRIVERS.items():
+        if url.startswith(prefix):
+            return replacement + url[len(prefix):]
+    return url
+
+
+def make_engine(url=DB_URL):
+    url = async_db_url(url)
+    if url.startswith("sqlite"):
+        return create_async_engine(url)
+    return create_async_engine(url, pool_size=DB_POOL_SIZE, max_overflow=DB_CONCURRENCY,
+                               pool_recycle=DB_POOL_RECYCLE, pool_pre_ping=True)
+
+
+class AsyncBatchWriter:
+    """
+    Persist stage. Collects scored readings into batches (size or latency
+    trigger) and writes each batch - both tables - in one transaction.
+    Callers await the returned future to learn when their row is committed
+    (result False: a duplicate, or a late reading scored by the writer).
+    """
+
+    def __init__(self, session_factory, max_size=BATCH_MAX_SIZE,
+                 max_latency_ms=BATCH_MAX_LATENCY_MS, concurrency=DB_CONCURRENCY, on_commit=None):
+        self.session_factory = session_factory
+        self.on_commit = on_commit  # async callback([(scored, sensor_id)], late device ids) after each commit
+        self.max_size = max_size
+        self.max_latency = max_latency_ms / 1000.0
+        self.queue = asyncio.Queue(maxsize=max_size * concurrency * 4)
+        self.slots = asyncio.Semaphore(concurrency)
+        # Compliance rows are overwritten, not merged: update + commit in one order
+        self.compliance_lock = asyncio.Lock()
+        self.flushes = {}  # in-flight flush task -> device ids in its batch
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run(), name="async-batch-writer")
+
+    async def submit(self, scored):
+        future = asyncio.get_running_loop().create_future()
+        await self.queue.put((scored, future))
+        return future
+
+    async def _run(self):
+        while True:
+            batch = [await self.queue.get()]
+            if batch[0] is None:
+                return
+            deadline = time.monotonic() + self.max_latency
+            stop = False
+            while len(batch) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(self.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if item is None:
+                    stop = True
+                    break
+                batch.append(item)
+
+            await self.slots.acquire()
+            devices = {data['device_id'] for (data, _, _), _ in batch}
+            # One device's batches commit in order: rollup gaps are folded in reading
+            # order, and late re-scoring reads the rows of the earlier ones
+            earlier = [flush for flush, flushing in self.flushes.items() if flushing & devices]
+            flush = asyncio.create_task(self._flush(batch, earlier))
+            self.flushes[flush] = devices
+            flush.add_done_callback(lambda task: self.flushes.pop(task, None))
+            if stop:
+                return
+
+    async def _flush(self, batch, earlier=()):
+        if earlier:
+            await asyncio.wait(earlier)
+        metrics.batch_size.observe(len(batch))
+        write_start = time.perf_counter()
+        saved = rollup_accumulator.checkpoint({data['device_id'] for (data, _, _), _ in batch})
+        try:
+            async with self.session_factory() as session:
+                readings = [data for (data, _, _), _ in batch]
+                ids = await session.run_sync(lambda sync_session: insert_sensor_rows(sync_session, readings))
+                # prob is None for late readings: they are scored against the DB below
+                on_time = [(scored, sensor_id) for (scored, _), sensor_id in zip(batch, ids)
+                           if sensor_id is not None and scored[1] is not None]
+                late = {}
+                for ((data, prob, _), _), sensor_id in zip(batch, ids):
+                    if sensor_id is not None and prob is None:
+                        late.setdefault(data['device_id'], []).append((data, sensor_id))
+
+                session.add_all([
+                    RiskAssessment(
+                        device_id=data['device_id'],
+                        sensor_data_id=sensor_id,
+                        risk_probability=float(prob),
+                        risk_reasons=reasons,
+                        timestamp=data['received_at'],
+                    )
+                    for (data, prob, reasons), sensor_id in on_time
+                ])
+                for (data, prob, _), _ in on_time:
+                    rollup_accumulator.add(data['device_id'], data['received_at'], data['temperature'],
+                                           data['vibration'], data['rpm'], prob)
+                rows = rollup_accumulator.drain()
+                await session.run_sync(lambda sync_session: upsert_rollups(sync_session, rows))
+                late_ranges = {}
+                if late:
+                    await session.flush()
+                    late_ranges = await session.run_sync(
+                        lambda sync_session: rescore_late_readings(sync_session, late, rebuild=False))
+                    await session.run_sync(lambda sync_session: rebuild_late_rollups(sync_session, late_ranges))
+                stored = sorted((data for data, sensor_id in zip(readings, ids) if sensor_id is not None),
+                                key=lambda data: data['received_at'])
+                async with self.compliance_lock:
+                    recomputed = await session.run_sync(
+                        lambda sync_session: compliance_tracker.update(sync_session, SensorData, stored))
+                    await session.commit()
+                metrics.compliance_recomputed_total.inc(recomputed)
+            data_version.bump()
+            metrics.db_commit_seconds.observe(time.perf_counter() - write_start)
+            metrics.batches_total.inc(result="ok")
+            if self.on_commit and (on_time or late_ranges):
+                try:
+                    await self.on_commit(on_time, sorted(late_ranges))
+                except Exception as e:
+                    # Already committed: a failed notification must not fail the rows
+                    log.warning("⚠️ Post-commit callback failed", readings=len(batch), error=e)
+            # True = stored and scored on arrival (duplicates / late readings get no alert)
+            for ((_, prob, _), future), sensor_id in zip(batch, ids):
+                if not future.done():
+                    future.set_result(sensor_id is not None and prob is not None)
+        except Exception as e:
+            metrics.batches_total.inc(result="error")
+            log.error("❌ Error persisting batch", readings=len(batch), error=e)
+            rollup_accumulator.restore(saved)
+            compliance_tracker.invalidate()
+            for _, future in batch:
+                if not future.done():
+                    future.set_exception(e)
+        finally:
+            self.slots.release()
+
+    async def stop(self):
+        """Flushes everything submitted so far and waits for in-flight writes."""
+        await self.queue.put(None)
+        await self._task
+        if self.flushes:
+            await asyncio.gather(*list(self.flushes), return_exceptions=True)
+
+
+class AsyncIngestService:
+    def __init__(self, engine=None):
+        self.engine = engine or make_engine()
+        self.writer = AsyncBatchWriter(async_sessionmaker(self.engine, expire_on_commit=False),
+                                       on_commit=self.publish_live)
+        self.in_flight = asyncio.Semaphore(MAX_IN_FLIGHT)
+        self.device_slots = defaultdict(lambda: asyncio.Semaphore(DEVICE_CONCURRENCY))
+        self.pending = asyncio.Queue()  # parsed, not yet scored (bounded by in_flight)
+        self.scorer = None
+        # Excursion / ML state of each device before its oldest uncommitted reading
+        self.uncommitted = defaultdict(int)
+        self.saved = {}
+        self.tasks = set()
+        self.client = None
+
+    def parse(self, message):
+        """JSON or binary (per topic, see uplink.py) -> list of readings."""
+        parse_start = time.perf_counter()
+        readings = parse_message(str(message.topic), message.payload)
+        metrics.parse_seconds.observe(time.perf_counter() - parse_start)
+        return readings
+
+    async def publish_live(self, scored, late_devices):
+        """One live-stream message per committed batch (see live.py), plus the devices late readings rewrote."""
+        if self.client is None:
+            return
+        if scored:
+            await self.client.publish(MQTT_LIVE_TOPIC, json.dumps([
+                live_row(data['device_id'], data['received_at'], data['temperature'],
+                         data['vibration'], data['rpm'], float(prob), reasons, sensor_id)
+                for (data, prob, reasons), sensor_id in scored
+            ]))
+        if late_devices:
+            await self.client.publish(LIVE_LATE_TOPIC, json.dumps(late_devices))
+
+    async def score(self):
+        """
+        Scoring stage: everything queued since the previous pass is scored in
+        one call (one predict_proba call with RISK_SCORER=model), oldest
+        first. A single task does all scoring, so the excursion tracker and
+        alert states see each device's readings in order. Late readings are
+        left unscored; the writer re-scores them from the DB.
+        """
+        while True:
+            batch = [await self.pending.get()]
+            stop = batch[0] is None
+            while not stop and len(batch) < SCORE_BATCH_MAX:
+                try:
+                    item = self.pending.get_nowait()
+                except asyncio.QueueEmpty:
+                    break
+                stop = item is None
+                batch.append(item)
+            batch = sorted((data for data in batch if data is not None), key=lambda data: data['received_at'])
+
+            for device_id in {data['device_id'] for data in batch}:
+                if not self.uncommitted[device_id]:
+                    self.saved[device_id] = self.checkpoint(device_id)
+            late = [is_late(data) for data in batch]
+            on_time = [data for data, is_late_reading in zip(batch, late) if not is_late_reading]
+            scores = iter(())
+            if on_time:
+                with metrics.risk_eval_seconds.time():
+                    scores = iter(score_sensor_batch(on_time))
+            for data, is_late_reading in zip(batch, late):
+                prob, reasons, alert = None, None, None
+                if is_late_reading:
+                    metrics.late_readings_total.inc()
+                    excursions.update_late(data['device_id'], data['temperature'], data['received_at'])
+                else:
+                    prob, reasons = next(scores)
+                    alert = alert_engine.evaluate(data['device_id'], prob, reasons, data['received_at'])
+                self.uncommitted[data['device_id']] += 1
+                task = asyncio.create_task(self.handle(data, prob, reasons, alert))
+                self.tasks.add(task)
+                task.add_done_callback(self.tasks.discard)
+            if stop:
+                return
+
+    def checkpoint(self, device_id):
+        return (excursions.checkpoint([device_id]),
+                risk_model.checkpoint([device_id]) if risk_model is not None else None)
+
+    def rollback(self, device_id):
+        """A write failed: the device's state goes back to before its oldest uncommitted reading."""
+        excursion_state, model_state = self.saved[device_id]
+        excursions.restore(excursion_state)
+        if model_state is not None:
+            risk_model.restore(model_state)
+
+    async def handle(self, data, prob, reasons, alert):
+        device_id = data['device_id']
+        try:
+            async with self.device_slots[device_id]:
+                try:
+                    future = await self.writer.submit((data, prob, reasons))
+                    stored = await future
+                except Exception:
+                    self.rollback(device_id)
+                    raise
+                finally:
+                    self.uncommitted[device_id] -= 1
+                    if not self.uncommitted[device_id]:
+                        del self.uncommitted[device_id]
+                        self.saved.pop(device_id, None)
+                if not stored or alert is None:
+                    return
+            # Level changes and heartbeats only (see alerts.py)
+            with metrics.alert_publish_seconds.time():
+                await self.client.publish(alert_topic(alert.device_id), json.dumps(alert.payload()))
+            alert_published(alert)
+        except Exception as e:
+            log.error("❌ Error processing message", device_id=data.get('device_id'), error=e)
+        finally:
+            self.in_flight.release()
+
+    async def consume(self):
+        async for message in self.client.messages:
+            try:
+                readings = self.parse(message)
+            except (ValueError, UnicodeDecodeError) as e:
+                metrics.messages_total.inc(result="invalid")
+                log.warning("⚠️ Received malformed message", topic=str(message.topic), error=e)
+                continue
+            metrics.messages_total.inc(result="ok")
+            for data in readings:
+                await self.in_flight.acquire()
+                self.pending.put_nowait(data)
+
+    async def run(self):
+        import_secs = time.perf_counter() - IMPORT_STARTED
+        metrics.startup_seconds.set(import_secs, phase="import")
+        warm_start = time.perf_counter()
+        await asyncio.to_thread(warm_up)  # INIT_SCHEMA, excursion state, model
+        warm_secs = time.perf_counter() - warm_start
+        metrics.startup_seconds.set(warm_secs, phase="warm_up")
+
+        self.writer.start()
+        self.scorer = asyncio.create_task(self.score(), name="async-scorer")
+        if notifier.enabled:
+            notifier.start()
+        metrics.queue_depth.set_function(lambda: self.pending.qsize() + len(self.tasks))
+        metrics.start_metrics_server()
+        log.info("🚀 Connecting to broker (asyncio mode)", broker=f"{MQTT_BROKER}:{MQTT_PORT}",
+                 metrics=f"http://{metrics.METRICS_HOST}:{metrics.METRICS_PORT}/metrics")
+        try:
+            async with aiomqtt.Client(MQTT_BROKER, MQTT_PORT, keepalive=60) as client:
+                self.client = client
+                await client.subscribe([(MQTT_TOPIC, 0), (MQTT_BINARY_TOPIC, 0), (MQTT_LEGACY_TOPIC, 0)])
+                log.info("📡 Subscribed", topic=MQTT_TOPIC,
+                         startup_ms=round((time.perf_counter() - IMPORT_STARTED) * 1000),
+                         import_ms=round(import_secs * 1000), warm_up_ms=round(warm_secs * 1000))
+                try:
+                    await self.consume()
+                finally:
+                    await self.drain()
+        finally:
+            await asyncio.to_thread(notifier.stop, 10)
+            await self.engine.dispose()
+
+    async def drain(self):
+        """Lets in-flight readings finish (persist + alert) and stops the writer."""
+        log.info("🛑 Draining in-flight readings", in_flight=self.pending.qsize() + len(self.tasks))
+        self.pending.put_nowait(None)
+        await self.scorer
+        if self.tasks:
+            await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.writer.stop()
+
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(AsyncIngestService().run())
+    except KeyboardInterrupt:
+        pass
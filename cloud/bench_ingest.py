@@ -0,0 +1,256 @@
+"""
+Offline ingest throughput benchmark.
+
+Runs the real mqtt_subscriber pipeline (on_message -> BatchWriter -> SQL ->
+live / alert publish) against an in-process broker stand-in and a scratch
+SQLite database (or DATABASE_URL), driven by a simulated fleet.
+
+Reports end-to-end latency percentiles (publish -> DB commit, publish ->
+live-stream row), sustained messages/s, alert messages published (level
+changes and heartbeats only) and peak memory.
+
+--spool writes every batch through a scratch spool (spool.py, fsync per
+batch); --outage N additionally fails every commit for N seconds a third
+of the way in, and reports how fast the spooled backlog is replayed.
+
+Usage:
+    python bench_ingest.py --devices 200 --rate 2 --duration 30
+    python bench_ingest.py --devices 200 --rate 5 --duration 30 --spool --outage 10
+    python bench_ingest.py --devices 1000 --rate 1 --url postgresql://user:pw@localhost/bench
+"""
+import os
+import re
+import sys
+import json
+import time
+import queue
+import random
+import argparse
+import resource
+import tempfile
+import threading
+import tracemalloc
+from collections import defaultdict, deque
+from simulate_device import make_reading
+
+
+class LocalMessage:
+    __slots__ = ("topic", "payload")
+
+    def __init__(self, topic, payload):
+        self.topic = topic
+        self.payload = payload
+
+
+class LocalBroker:
+    """
+    Minimal in-process MQTT stand-in: topic filters with '+' / '#', and a
+    single delivery thread that invokes subscriber callbacks like paho's
+    network loop does (so a blocking on_message applies backpressure).
+    """
+
+    def __init__(self):
+        self._subs = []
+        self._inbox = queue.Queue()
+        self._thread = threading.Thread(target=self._deliver, name="local-broker", daemon=True)
+        self._thread.start()
+
+    @staticmethod
+    def _compile(topic_filter):
+        pattern = re.escape(topic_filter).replace(r"\+", "[^/]+").replace(r"\#", ".*")
+        return re.compile(f"^{pattern}$")
+
+    def subscribe(self, topic_filter, callback):
+        self._subs.append((self._compile(topic_filter), callback))
+
+    def publish(self, topic, payload):
+        if isinstance(payload, str):
+            payload = payload.encode()
+        self._inbox.put(LocalMessage(topic, payload))
+
+    def _deliver(self):
+        while True:
+            msg = self._inbox.get()
+            if msg is None:
+                return
+            for pattern, callback in self._subs:
+                if pattern.match(msg.topic):
+                    callback(msg)
+
+    def close(self):
+        self._inbox.put(None)
+        self._thread.join()
+
+
+class FleetDevice:
+    """One container: normal readings with sustained excursion episodes
+    (failure profile from simulate_device.make_reading)."""
+
+    def __init__(self, device_id, excursion_rate):
+        self.device_id = device_id
+        self.excursion_rate = excursion_rate
+        self.excursion_left = 0
+
+    def next_reading(self):
+        if self.excursion_left == 0 and random.random() < self.excursion_rate:
+            self.excursion_left = random.randint(3, 30)
+        if self.excursion_left:
+            self.excursion_left -= 1
+            return make_reading(failure_rate=1.0)
+        return make_reading(failure_rate=0.0)
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    values = sorted(values)
+    pick = lambda p: values[min(int(p / 100 * len(values)), len(values) - 1)] * 1000
+    return {"p50": pick(50), "p90": pick(90), "p99": pick(99), "max": values[-1] * 1000}
+
+
+def run(args):
+    if args.url.startswith("sqlite:///"):
+        path = args.url[len("sqlite:///"):]
+        if os.path.exists(path):
+            os.remove(path)
+    os.environ["DATABASE_URL"] = args.url
+    os.environ.setdefault("BATCH_MAX_SIZE", str(args.batch_size))
+    os.environ.setdefault("BATCH_MAX_LATENCY_MS", str(args.batch_latency_ms))
+
+    tracemalloc.start()
+    import mqtt_subscriber as sub
+    sub.init_schema()
+
+    broker = LocalBroker()
+    sent = defaultdict(deque)
+    commit_latency, live_latency = [], []
+    alerts = defaultdict(int)
+    lock = threading.Lock()
+
+    # Probes: the subscriber bumps data_version right after each commit
+    class CommitProbe:
+        def __init__(self, inner):
+            self.inner = inner
+            self.committed_at = None
+
+        def bump(self):
+            self.committed_at = time.perf_counter()
+            return self.inner.bump()
+
+    probe = sub.data_version = CommitProbe(sub.data_version)
+    process_batch = sub.process_sensor_batch
+    outage = [float("inf"), float("inf")]  # [start, end) perf_counter, set once publishing starts
+
+    def timed_batch(batch):
+        if outage[0] <= time.perf_counter() < outage[1]:
+            return "unavailable"
+        probe.committed_at = None
+        result = process_batch(batch)
+        if probe.committed_at is not None:
+            with lock:
+                # Batches replayed from disk no longer carry the _sent probe
+                commit_latency.extend(probe.committed_at - data["_sent"] for data in batch if "_sent" in data)
+        return result
+
+    sub.process_sensor_batch = timed_batch
+
+    class BrokerClient:
+        def publish(self, topic, payload):
+            broker.publish(topic, payload)
+
+    sub.client = BrokerClient()
+    broker.subscribe(sub.MQTT_TOPIC, lambda msg: sub.on_message(sub.client, None, msg))
+
+    # Every scored reading appears once on the live topic
+    def on_live(msg):
+        now = time.perf_counter()
+        with lock:
+            for row in json.loads(msg.payload):
+                if sent[row[0]]:
+                    live_latency.append(now - sent[row[0]].popleft())
+    broker.subscribe(sub.MQTT_LIVE_TOPIC, on_live)
+
+    def on_alert(msg):
+        with lock:
+            alerts[json.loads(msg.payload)["level"]] += 1
+    broker.subscribe("cargo/coldchain/+/alert", on_alert)
+
+    if sub.risk_model is not None:
+        sub.risk_model.model  # RISK_SCORER=model: load up front, as the service does
+    spool = None
+    if args.spool or args.outage:
+        from spool import Spool
+        spool = Spool(tempfile.mkdtemp(prefix="coldchain-spool-"), retry_secs=1)
+    writer = sub.BatchWriter(sub.ingest_queue, spool=spool)
+    writer.start()
+
+    fleet = [FleetDevice(f"bench-{i:04d}", args.excursion_rate) for i in range(args.devices)]
+    interval = 1.0 / (args.devices * args.rate)
+    total = int(args.devices * args.rate * args.duration)
+    print(f"🚀 {args.devices} devices x {args.rate} msg/s for {args.duration}s ({total:,} messages)")
+
+    t0 = time.perf_counter()
+    if args.outage:
+        outage[:] = [t0 + args.duration / 3, t0 + args.duration / 3 + args.outage]
+    peak_backlog, drained_at = 0, None
+    for i in range(total):
+        target = t0 + i * interval
+        delay = target - time.perf_counter()
+        if delay > 0:
+            time.sleep(delay)
+        device = fleet[i % len(fleet)]
+        reading = device.next_reading()
+        reading["_sent"] = time.perf_counter()
+        with lock:
+            sent[device.device_id].append(reading["_sent"])
+        broker.publish(f"cargo/coldchain/{device.device_id}/data", json.dumps(reading))
+        if spool is not None and i % 100 == 0:
+            peak_backlog = max(peak_backlog, spool.pending_readings)
+            if drained_at is None and time.perf_counter() > outage[1] and not spool.replaying:
+                drained_at = time.perf_counter()
+    publish_done = time.perf_counter()
+
+    # Wait for the pipeline to catch up
+    while len(live_latency) < total and time.perf_counter() - publish_done < args.drain_timeout:
+        time.sleep(0.05)
+        if spool is not None and drained_at is None and not spool.replaying:
+            drained_at = time.perf_counter()
+    elapsed = time.perf_counter() - t0
+    writer.stop()
+    broker.close()
+
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    rss_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+    print(f"\n📊 Results ({len(live_latency):,}/{total:,} readings scored)")
+    print(f"   offered rate:   {total / (publish_done - t0):,.0f} msg/s")
+    print(f"   sustained rate: {len(live_latency) / elapsed:,.0f} msg/s")
+    print(f"   alerts published: {sum(alerts.values()):,} "
+          f"({', '.join(f'{level}={count:,}' for level, count in sorted(alerts.items()))})")
+    for name, values in (("publish -> commit", commit_latency), ("publish -> live", live_latency)):
+        stats = percentiles(values)
+        if stats:
+            print(f"   {name:<18} " + "  ".join(f"{k}={v:.1f}ms" for k, v in stats.items()))
+    print(f"   peak traced memory: {peak / 1e6:.1f} MB, max RSS: {rss_mb:.0f} MB")
+    if args.outage and drained_at is not None:
+        print(f"   spool: {peak_backlog:,} readings backlogged during a {args.outage:.0f}s outage, "
+              f"caught up {drained_at - outage[1]:.1f}s after it ended")
+    return len(live_latency) == total
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Offline ingest throughput benchmark")
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--rate", type=float, default=1.0, help="messages/s per device")
+    parser.add_argument("--duration", type=float, default=20.0, help="seconds of publishing")
+    parser.add_argument("--excursion-rate", type=float, default=0.01,
+                        help="chance per reading that a device starts an excursion episode")
+    parser.add_argument("--batch-size", type=int, default=200)
+    parser.add_argument("--batch-latency-ms", type=int, default=250)
+    parser.add_argument("--drain-timeout", type=float, default=30.0)
+    parser.add_argument("--url", default="sqlite:///./bench_ingest.db")
+    parser.add_argument("--spool", action="store_true", help="write batches through a scratch spool")
+    parser.add_argument("--outage", type=float, default=0.0,
+                        help="seconds of simulated DB outage (implies --spool)")
+    sys.exit(0 if run(parser.parse_args()) else 1)
@@ -0,0 +1,126 @@
+"""
+Query latency benchmark for the sensor_data / risk_assessments index plan.
+
+Loads N synthetic readings into a scratch database, times the API's hot
+queries without indexes (migrations 0001-0002), applies migration 0003 and
+times them again.
+
+Usage:
+    python bench_queries.py --rows 1000000 10000000
+    python bench_queries.py --rows 1000000 --url postgresql://user:pw@localhost/bench
+
+Defaults to a scratch SQLite file (bench_queries.db), which is recreated.
+"""
+import os
+import time
+import random
+import argparse
+import statistics
+from datetime import datetime, timedelta
+from sqlalchemy import create_engine, text
+from migrate import MIGRATIONS, _ensure_version_table
+
+DEVICES = 100
+SPAN = timedelta(days=30)
+
+QUERIES = {
+    "history 60 min (join, limit 1000)": """
+        SELECT s.id, s.temperature, s.vibration, s.rpm, s.timestamp, r.risk_probability, r.risk_reasons
+        FROM sensor_data s JOIN risk_assessments r ON s.id = r.sensor_data_id
+        WHERE s.timestamp >= :since
+        ORDER BY s.timestamp DESC LIMIT 1000
+    """,
+    "history 60 min, one device": """
+        SELECT s.id, s.temperature, s.timestamp, r.risk_probability
+        FROM sensor_data s JOIN risk_assessments r ON s.id = r.sensor_data_id
+        WHERE s.device_id = :device AND s.timestamp >= :since
+        ORDER BY s.timestamp DESC LIMIT 1000
+    """,
+    "latest, one device": """
+        SELECT s.id, s.temperature, s.timestamp, r.risk_probability
+        FROM sensor_data s JOIN risk_assessments r ON s.id = r.sensor_data_id
+        WHERE s.device_id = :device
+        ORDER BY s.timestamp DESC LIMIT 1
+    """,
+    "last compliant reading, one device": """
+        SELECT max(timestamp) FROM sensor_data
+        WHERE device_id = :device AND temperature >= 2.0 AND temperature <= 8.0
+    """,
+}
+
+
+def load(engine, rows, chunk=50000):
+    """Bulk-loads `rows` readings spread evenly over SPAN across DEVICES."""
+    end = datetime.utcnow()
+    step = SPAN / rows
+    with engine.begin() as conn:
+        for start in range(0, rows, chunk):
+            sensors, risks = [], []
+            for i in range(start, min(start + chunk, rows)):
+                temp = random.uniform(3.0, 7.0) if random.random() > 0.1 else random.uniform(9.0, 15.0)
+                ts = end - SPAN + step * i
+                sensors.append({"id": i + 1, "device": f"reefer-{i % DEVICES:03d}", "temp": temp,
+                                "vib": random.uniform(0.1, 0.5), "rpm": random.randint(1400, 1600), "ts": ts})
+                risks.append({"id": i + 1, "sid": i + 1, "device": f"reefer-{i % DEVICES:03d}",
+                              "risk": 0.0 if temp <= 8.0 else 0.5, "ts": ts})
+            conn.execute(text(
+                "INSERT INTO sensor_data (id, device_id, temperature, vibration, rpm, timestamp) "
+                "VALUES (:id, :device, :temp, :vib, :rpm, :ts)"), sensors)
+            conn.execute(text(
+                "INSERT INTO risk_assessments (id, device_id, sensor_data_id, risk_probability, risk_reasons, timestamp) "
+                "VALUES (:id, :device, :sid, :risk, '', :ts)"), risks)
+
+
+def time_queries(engine, repeat):
+    params = {"since": datetime.utcnow() - timedelta(minutes=60), "device": "reefer-042"}
+    results = {}
+    with engine.connect() as conn:
+        for name, sql in QUERIES.items():
+            timings = []
+            for _ in range(repeat):
+                t0 = time.perf_counter()
+                conn.execute(text(sql), params).fetchall()
+                timings.append((time.perf_counter() - t0) * 1000)
+            results[name] = statistics.median(timings)
+    return results
+
+
+def run(url, rows, repeat):
+    if url.startswith("sqlite:///"):
+        path = url[len("sqlite:///"):]
+        if os.path.exists(path):
+            os.remove(path)
+    engine = create_engine(url)
+    with engine.begin() as conn:
+        if engine.dialect.name == "postgresql":
+            conn.execute(text("DROP TABLE IF EXISTS risk_assessments, sensor_data, schema_migrations CASCADE"))
+        _ensure_version_table(conn)
+        for version, _, apply in MIGRATIONS[:2]:
+            apply(conn, engine.dialect.name)
+
+    t0 = time.perf_counter()
+    load(engine, rows)
+    print(f"\n📦 {rows:,} rows loaded in {time.perf_counter() - t0:.1f}s")
+
+    before = time_queries(engine, repeat)
+    t0 = time.perf_counter()
+    with engine.begin() as conn:
+        MIGRATIONS[2][2](conn, engine.dialect.name)
+    print(f"🔧 Indexes built in {time.perf_counter() - t0:.1f}s")
+    after = time_queries(engine, repeat)
+
+    print(f"{'query':<40}{'no index (ms)':>16}{'indexed (ms)':>16}")
+    for name in QUERIES:
+        print(f"{name:<40}{before[name]:>16.2f}{after[name]:>16.2f}")
+    engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark history query latency vs. table size")
+    parser.add_argument("--rows", type=int, nargs="+", default=[1_000_000, 10_000_000])
+    parser.add_argument("--url", default="sqlite:///./bench_queries.db")
+    parser.add_argument("--repeat", type=int, default=5)
+    args = parser.parse_args()
+
+    for n in args.rows:
+        run(args.url, n, args.repeat)
@@ -0,0 +1,113 @@
+"""
+Risk scoring throughput: rule engine vs. ML model (ml-model/motor_model.pkl).
+
+Scores the same synthetic readings (simulate_device.py profile) with
+- rules, one reading at a time (RiskEngine.score_one) and batched (score_batch);
+- the model, the legacy way (predict_proba on one 1x3 array per reading)
+  and micro-batched (RiskModel.score_batch, one predict_proba per batch).
+Also reports the model's cold load time (scikit-learn import + unpickle).
+
+Usage:
+    python bench_scoring.py --readings 20000 --batch-sizes 10 100 1000
+"""
+import time
+import random
+import argparse
+import numpy as np
+from simulate_device import make_reading
+from risk_engine import RiskEngine
+import risk_model
+from risk_model import RiskModel
+
+
+def make_readings(count, devices):
+    readings = []
+    for i in range(count):
+        data = make_reading()
+        data["device_id"] = f"bench-{i % devices:04d}"
+        readings.append(data)
+    return readings
+
+
+def columns(readings):
+    return (
+        [data["temperature"] for data in readings],
+        [data["vibration"] for data in readings],
+        [data["rpm"] for data in readings],
+    )
+
+
+def rate(count, seconds):
+    return count / max(seconds, 1e-9)
+
+
+def bench_rules(readings, batch_sizes):
+    engine = RiskEngine()
+    # Excursion durations come from the tracker in the pipeline; a fixed mix here
+    durations = [random.choice((np.nan, 120.0, 900.0)) for _ in readings]
+    results = {}
+
+    t0 = time.perf_counter()
+    for data, duration in zip(readings, durations):
+        engine.score_one(data["temperature"], data["vibration"], data["rpm"],
+                         None if np.isnan(duration) else duration)
+    results["rules, per reading"] = rate(len(readings), time.perf_counter() - t0)
+
+    for size in batch_sizes:
+        t0 = time.perf_counter()
+        for i in range(0, len(readings), size):
+            chunk = readings[i:i + size]
+            engine.score_batch(*columns(chunk), durations[i:i + size])
+        results[f"rules, batch {size}"] = rate(len(readings), time.perf_counter() - t0)
+    return results
+
+
+def bench_model(readings, batch_sizes, legacy_limit):
+    t0 = time.perf_counter()
+    import sklearn.ensemble  # noqa: F401  (what unpickling the forest imports first)
+    imported = time.perf_counter() - t0
+    model = RiskModel()
+    model.model
+    _, unpickle = risk_model.load_model(model.path)
+    results = {}
+
+    legacy = readings[:legacy_limit]
+    t0 = time.perf_counter()
+    for data in legacy:
+        model.model.predict_proba(np.array([[data["temperature"], data["vibration"], data["rpm"]]]))
+    results["model, per reading (legacy)"] = rate(len(legacy), time.perf_counter() - t0)
+
+    for size in batch_sizes:
+        model.reset()
+        t0 = time.perf_counter()
+        for i in range(0, len(readings), size):
+            chunk = readings[i:i + size]
+            model.score_batch([data["device_id"] for data in chunk], *columns(chunk))
+        results[f"model, batch {size}"] = rate(len(readings), time.perf_counter() - t0)
+    return results, imported, unpickle
+
+
+def run(args):
+    random.seed(args.seed)
+    readings = make_readings(args.readings, args.devices)
+    print(f"🚀 {len(readings):,} readings, {args.devices} devices")
+
+    results = bench_rules(readings, args.batch_sizes)
+    model_results, imported, unpickle = bench_model(readings, args.batch_sizes, args.legacy_limit)
+    results.update(model_results)
+
+    print(f"\n🧠 Model load: scikit-learn import {imported * 1000:.0f} ms + unpickle {unpickle * 1000:.0f} ms")
+    print(f"\n{'scorer':<32}{'readings/s':>14}")
+    for name, value in results.items():
+        print(f"{name:<32}{value:>14,.0f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark rule engine vs. ML model scoring throughput")
+    parser.add_argument("--readings", type=int, default=20000)
+    parser.add_argument("--devices", type=int, default=100)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[10, 100, 1000])
+    parser.add_argument("--legacy-limit", type=int, default=500,
+                        help="readings for the slow one-row-per-call model run")
+    parser.add_argument("--seed", type=int, default=42)
+    run(parser.parse_args())
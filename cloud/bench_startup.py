@@ -0,0 +1,113 @@
+"""
+Cold-start budget for the services: import time of mqtt_subscriber,
+async_ingest and history_api, each in a fresh interpreter, plus the
+subscriber's DB warm-up (excursion state) before it consumes.
+
+Imports run offline against an unreachable broker and a database path
+that does not exist; an import that creates the database file or fails
+counts as a side effect. Exits non-zero when a median is over budget or
+an import has side effects, so it can gate CI.
+
+Usage:
+    python bench_startup.py --runs 5 --budget-ms 1000
+    python bench_startup.py --url sqlite:///coldchain.db    # also time warm_up() on a real DB
+"""
+import os
+import sys
+import json
+import argparse
+import tempfile
+import statistics
+import subprocess
+
+MODULES = ("mqtt_subscriber", "async_ingest", "history_api")
+
+CHILD = """
+import sys, json, time
+started = time.perf_counter()
+import {module} as service
+result = {{"import": time.perf_counter() - started}}
+if {warm_up}:
+    warm_start = time.perf_counter()
+    service.warm_up()
+    result["warm_up"] = time.perf_counter() - warm_start
+print(json.dumps(result))
+"""
+
+
+def run_child(module, env, warm_up=False):
+    """One fresh interpreter: ({phase: secs}, top-level imports by cumulative µs) or (None, error)."""
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", CHILD.format(module=module, warm_up=warm_up)],
+        env=env, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if proc.returncode != 0:
+        return None, proc.stderr.strip().splitlines()[-1:]
+    imports = {}
+    for line in proc.stderr.splitlines():
+        # "import time: self [us] | cumulative | <indent>name"
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|")
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        if depth == 1:  # imported by the service module itself
+            imports[name.strip()] = int(cumulative)
+    return json.loads(proc.stdout.strip().splitlines()[-1]), imports
+
+
+def bench(args):
+    scratch = tempfile.mkdtemp(prefix="coldchain-startup-")
+    missing_db = os.path.join(scratch, "never-created.db")
+    env = dict(os.environ, DATABASE_URL=f"sqlite:///{missing_db}", MQTT_BROKER="192.0.2.1",
+               INIT_SCHEMA="0", PYTHONDONTWRITEBYTECODE="1")
+    failed = False
+
+    print(f"{'module':<18}{'median ms':>10}{'max ms':>9}   heaviest imports (ms)")
+    for module in args.modules:
+        times, heaviest = [], {}
+        for _ in range(args.runs):
+            result, imports = run_child(module, env)
+            if result is None:
+                print(f"{module:<18}  ❌ import failed: {' '.join(imports)}")
+                failed = True
+                break
+            times.append(result["import"] * 1000)
+            for name, us in imports.items():
+                heaviest[name] = max(heaviest.get(name, 0), us)
+        if not times:
+            continue
+        median = statistics.median(times)
+        top = ", ".join(f"{name} {us / 1000:.0f}"
+                        for name, us in sorted(heaviest.items(), key=lambda item: -item[1])[:4])
+        over = median > args.budget_ms
+        failed |= over
+        print(f"{module:<18}{median:>10.0f}{max(times):>9.0f}   {top}{'  ⚠️ over budget' if over else ''}")
+
+    if os.path.exists(missing_db):
+        print(f"❌ Importing created {missing_db}: imports must not touch the database")
+        failed = True
+
+    if args.url:
+        result, error = run_child("mqtt_subscriber", dict(env, DATABASE_URL=args.url), warm_up=True)
+        if result is None:
+            print(f"❌ warm_up failed: {' '.join(error)}")
+            failed = True
+        else:
+            total = (result["import"] + result["warm_up"]) * 1000
+            over = total > args.budget_ms
+            failed |= over
+            print(f"\n⏱️ mqtt_subscriber import {result['import'] * 1000:.0f} ms + warm_up "
+                  f"{result['warm_up'] * 1000:.0f} ms = {total:.0f} ms before consuming"
+                  f"{'  ⚠️ over budget' if over else ''}")
+
+    print(f"\n{'❌ Over budget or side effects' if failed else '✅ Within'} {args.budget_ms:.0f} ms budget")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure service import / warm-up time against a budget")
+    parser.add_argument("--modules", nargs="+", default=list(MODULES))
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("STARTUP_BUDGET_MS", 1000)))
+    parser.add_argument("--url", help="database for timing the subscriber's warm_up() (e.g. a production copy)")
+    sys.exit(bench(parser.parse_args()))
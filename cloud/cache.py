@@ -0,0 +1,102 @@
+import os
+import mmap
+import time
+import struct
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Shared between mqtt_subscriber (writer) and history_api (readers)
+CACHE_VERSION_FILE = os.getenv(
+    "CACHE_VERSION_FILE", os.path.join(tempfile.gettempdir(), "coldchain-data.version")
+)
+# Bumped by batch jobs that rewrite rows already served (rescore.py), so
+# history_api's hot store (hot.py) re-reads them
+REWRITE_VERSION_FILE = os.getenv(
+    "REWRITE_VERSION_FILE", os.path.join(tempfile.gettempdir(), "coldchain-rewrite.version")
+)
+CACHE_TTL_SECONDS = float(os.getenv("CACHE_TTL_SECONDS", 30))
+CACHE_MAX_ENTRIES = int(os.getenv("CACHE_MAX_ENTRIES", 512))
+
+_COUNTER = struct.Struct("<Q")
+
+
+class DataVersion:
+    """
+    Cross-process data version counter in a memory-mapped file. The subscriber
+    bumps it after every committed batch; the API folds it into cache keys, so
+    a new reading invalidates every cached response without any messaging.
+    """
+
+    def __init__(self, path=CACHE_VERSION_FILE):
+        self.path = path
+        self._map = None
+        self._lock = threading.Lock()
+
+    def _mapped(self):
+        if self._map is None:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                if os.fstat(fd).st_size < _COUNTER.size:
+                    os.ftruncate(fd, _COUNTER.size)
+                self._map = mmap.mmap(fd, _COUNTER.size)
+            finally:
+                os.close(fd)
+        return self._map
+
+    def current(self):
+        try:
+            return _COUNTER.unpack_from(self._mapped())[0]
+        except OSError:
+            return 0
+
+    def bump(self):
+        with self._lock:
+            try:
+                mapped = self._mapped()
+                version = _COUNTER.unpack_from(mapped)[0] + 1
+                _COUNTER.pack_into(mapped, 0, version)
+                return version
+            except OSError:
+                return 0
+
+
+class ResponseCache:
+    """Thread-safe LRU of rendered responses with a per-entry TTL."""
+
+    def __init__(self, max_entries=CACHE_MAX_ENTRIES, ttl=CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] < time.monotonic():
+                if entry is not None:
+                    del self._entries[key]
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key, value, ttl=None):
+        with self._lock:
+            self._entries[key] = (time.monotonic() + (ttl or self.ttl), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+
+data_version = DataVersion()
+rewrite_version = DataVersion(REWRITE_VERSION_FILE)
+response_cache = ResponseCache()
+
@@ -0,0 +1,412 @@
+"""
+Per-shipment cold chain compliance, updated incrementally at ingest.
+
+For every (shipment_id, device_id) the subscriber keeps one fixed-size
+row in `shipment_compliance`, written in the same transaction as the
+readings:
+- time below / above the 2-8 °C band: the gap before each out-of-range
+  reading, as in the rollups' excursion_secs (gaps longer than
+  COMPLIANCE_MAX_GAP_SECS count as unmonitored time instead);
+- excursions: count, the longest one and the one still open;
+- mean kinetic temperature (USP <1079.2>, one term per reading): the sum
+  of exp(-ΔH/RT) is carried with Neumaier compensation, so it matches a
+  full recomputation to the last bit or two however long the shipment.
+
+Readings older than the state's last reading are not folded in; the
+(shipment, device) is replayed from sensor_data plus the archive instead,
+starting at the newest in-memory checkpoint before the late reading (one
+per COMPLIANCE_CHECKPOINT_SECS period, the last COMPLIANCE_CHECKPOINTS
+kept) rather than at its first reading. Readings without a shipment are
+tracked under shipment_id ''. The ingest process keeps at most
+COMPLIANCE_MAX_STATES states in memory, least recently updated evicted
+first (they are re-read from the table when needed).
+
+Backfill (e.g. data ingested before this table existed):
+
+    python compliance.py rebuild [--shipment SHP-1] [--device reefer-042]
+"""
+import os
+import math
+import argparse
+import threading
+from collections import OrderedDict, deque
+from datetime import datetime
+from dotenv import load_dotenv
+from sqlalchemy import (
+    Column, MetaData, Table, String, Integer, DateTime, Float, Boolean,
+    select, tuple_,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+import archive
+from excursion import TEMP_MIN, TEMP_MAX
+from rollups import ROLLUP_MAX_GAP_SECS, bucket_start
+
+load_dotenv()
+
+COMPLIANCE_MAX_GAP_SECS = float(os.getenv("COMPLIANCE_MAX_GAP_SECS", ROLLUP_MAX_GAP_SECS))
+# Late readings replay from the newest checkpoint before them, not the whole shipment
+COMPLIANCE_CHECKPOINT_SECS = int(os.getenv("COMPLIANCE_CHECKPOINT_SECS", 3600))
+COMPLIANCE_CHECKPOINTS = int(os.getenv("COMPLIANCE_CHECKPOINTS", 24))
+COMPLIANCE_MAX_STATES = int(os.getenv("COMPLIANCE_MAX_STATES", 5000))
+# Activation energy for MKT; 83.144 kJ/mol is the USP / ICH default
+MKT_DELTA_H_KJ = float(os.getenv("MKT_DELTA_H_KJ", 83.144))
+GAS_CONSTANT_KJ = 8.314462618e-3
+KELVIN = 273.15
+
+NO_SHIPMENT = ""
+
+metadata = MetaData()
+shipment_compliance = Table(
+    "shipment_compliance", metadata,
+    Column("shipment_id", String, primary_key=True),  # '' = readings without a shipment
+    Column("device_id", String, primary_key=True),
+    Column("first_seen", DateTime),
+    Column("last_seen", DateTime),
+    Column("last_temperature", Float),
+    Column("readings", Integer, nullable=False),
+    Column("out_of_range_readings", Integer, nullable=False),
+    Column("secs_below", Float, nullable=False),
+    Column("secs_above", Float, nullable=False),
+    Column("secs_unmonitored", Float, nullable=False),
+    Column("excursions", Integer, nullable=False),
+    Column("in_excursion", Boolean, nullable=False),
+    Column("excursion_start", DateTime),  # open excursion, if any
+    Column("excursion_secs", Float, nullable=False),
+    Column("longest_excursion_start", DateTime),
+    Column("longest_excursion_secs", Float, nullable=False),
+    Column("temp_min", Float),
+    Column("temp_max", Float),
+    Column("mkt_sum", Float, nullable=False),
+    Column("mkt_comp", Float, nullable=False),
+)
+STATE_FIELDS = tuple(column.name for column in shipment_compliance.columns)[2:]
+
+
+def mkt_celsius(weight_sum, count, delta_h_kj=MKT_DELTA_H_KJ):
+    """MKT from the sum of exp(-ΔH/RT) over `count` readings."""
+    if not count or weight_sum <= 0:
+        return None
+    return (delta_h_kj / GAS_CONSTANT_KJ) / -math.log(weight_sum / count) - KELVIN
+
+
+class ComplianceState:
+    __slots__ = STATE_FIELDS
+
+    def __init__(self, **values):
+        for field in STATE_FIELDS:
+            setattr(self, field, values.get(field))
+        if self.readings is None:
+            self.reset()
+
+    def reset(self):
+        self.first_seen = self.last_seen = self.last_temperature = None
+        self.readings = self.out_of_range_readings = self.excursions = 0
+        self.secs_below = self.secs_above = self.secs_unmonitored = 0.0
+        self.in_excursion = False
+        self.excursion_start = self.longest_excursion_start = None
+        self.excursion_secs = self.longest_excursion_secs = 0.0
+        self.temp_min = self.temp_max = None
+        self.mkt_sum = self.mkt_comp = 0.0
+
+    def add(self, timestamp, temperature, temp_min=TEMP_MIN, temp_max=TEMP_MAX,
+            max_gap_secs=COMPLIANCE_MAX_GAP_SECS, delta_h_kj=MKT_DELTA_H_KJ):
+        """Folds in one reading no older than last_seen."""
+        previous = self.last_seen
+        gap = (timestamp - previous).total_seconds() if previous is not None else 0.0
+        monitored = gap <= max_gap_secs
+        if not monitored:
+            self.secs_unmonitored += gap
+
+        if temp_min <= temperature <= temp_max:
+            self.in_excursion = False
+            self.excursion_start = None
+            self.excursion_secs = 0.0
+        else:
+            self.out_of_range_readings += 1
+            if not self.in_excursion:
+                self.in_excursion = True
+                self.excursions += 1
+                # Measured from the last in-range reading, like the excursion tracker
+                self.excursion_start = previous if previous is not None and monitored else timestamp
+                self.excursion_secs = 0.0
+            if monitored:
+                if temperature < temp_min:
+                    self.secs_below += gap
+                else:
+                    self.secs_above += gap
+                self.excursion_secs += gap
+            if self.excursion_secs > self.longest_excursion_secs or self.longest_excursion_start is None:
+                self.longest_excursion_secs = self.excursion_secs
+                self.longest_excursion_start = self.excursion_start
+
+        # Neumaier-compensated running sum of exp(-ΔH/RT)
+        weight = math.exp(-(delta_h_kj / GAS_CONSTANT_KJ) / (temperature + KELVIN))
+        total = self.mkt_sum + weight
+        if abs(self.mkt_sum) >= abs(weight):
+            self.mkt_comp += (self.mkt_sum - total) + weight
+        else:
+            self.mkt_comp += (weight - total) + self.mkt_sum
+        self.mkt_sum = total
+
+        self.readings += 1
+        self.temp_min = temperature if self.temp_min is None else min(self.temp_min, temperature)
+        self.temp_max = temperature if self.temp_max is None else max(self.temp_max, temperature)
+        if self.first_seen is None:
+            self.first_seen = timestamp
+        self.last_seen = timestamp
+        self.last_temperature = temperature
+
+    def copy(self):
+        return ComplianceState(**{field: getattr(self, field) for field in STATE_FIELDS})
+
+    def row(self, shipment_id, device_id):
+        values = {field: getattr(self, field) for field in STATE_FIELDS}
+        values.update(shipment_id=shipment_id, device_id=device_id)
+        return values
+
+
+def report(state, delta_h_kj=MKT_DELTA_H_KJ):
+    """JSON-ready statistics for one (shipment, device) state or row."""
+    def iso(value):
+        return value.isoformat() if value is not None else None
+
+    return {
+        "first_seen": iso(state.first_seen),
+        "last_seen": iso(state.last_seen),
+        "readings": state.readings,
+        "out_of_range_readings": state.out_of_range_readings,
+        "time_out_of_range_secs": state.secs_below + state.secs_above,
+        "time_below_secs": state.secs_below,
+        "time_above_secs": state.secs_above,
+        "unmonitored_secs": state.secs_unmonitored,
+        "excursions": state.excursions,
+        "longest_excursion_secs": state.longest_excursion_secs,
+        "longest_excursion_start": iso(state.longest_excursion_start),
+        "in_excursion": state.in_excursion,
+        "current_excursion_secs": state.excursion_secs if state.in_excursion else 0.0,
+        "temp_min": state.temp_min,
+        "temp_max": state.temp_max,
+        "mkt_c": mkt_celsius(state.mkt_sum + state.mkt_comp, state.readings, delta_h_kj),
+    }
+
+
+def combine(states, delta_h_kj=MKT_DELTA_H_KJ):
+    """
+    Shipment-level figures over its devices: time and excursion figures are
+    the worst device's (loggers in one shipment overlap in time), MKT is over
+    all readings.
+    """
+    states = list(states)
+    if not states:
+        return None
+    worst = max(states, key=lambda s: s.secs_below + s.secs_above)
+    longest = max(states, key=lambda s: s.longest_excursion_secs)
+    readings = sum(s.readings for s in states)
+    return {
+        "devices": len(states),
+        "first_seen": min(s.first_seen for s in states).isoformat(),
+        "last_seen": max(s.last_seen for s in states).isoformat(),
+        "readings": readings,
+        "out_of_range_readings": sum(s.out_of_range_readings for s in states),
+        "time_out_of_range_secs": worst.secs_below + worst.secs_above,
+        "excursions": max(s.excursions for s in states),
+        "longest_excursion_secs": longest.longest_excursion_secs,
+        "longest_excursion_start": longest.longest_excursion_start.isoformat()
+        if longest.longest_excursion_start else None,
+        "in_excursion": any(s.in_excursion for s in states),
+        "temp_min": min(s.temp_min for s in states),
+        "temp_max": max(s.temp_max for s in states),
+        "mkt_c": mkt_celsius(math.fsum(s.mkt_sum + s.mkt_comp for s in states), readings, delta_h_kj),
+    }
+
+
+def upsert_states(conn, rows):
+    """Replaces the given shipment_compliance rows (INSERT ... ON CONFLICT)."""
+    if not rows:
+        return
+    bind = conn.get_bind() if hasattr(conn, "get_bind") else conn
+    insert = postgresql.insert if bind.dialect.name == "postgresql" else sqlite.insert
+    stmt = insert(shipment_compliance)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["shipment_id", "device_id"],
+        set_={field: getattr(stmt.excluded, field) for field in STATE_FIELDS},
+    )
+    conn.execute(stmt, rows)
+
+
+class ComplianceTracker:
+    """
+    In-memory cache of shipment_compliance rows for the ingest process.
+    States are loaded on first use and written back with every batch;
+    call invalidate() when a batch rolls back.
+
+    Alongside each state it keeps checkpoints: (period start, copy of the
+    state before the period's first reading), so a late reading replays
+    only from the period it falls in.
+    """
+
+    def __init__(self, temp_min=TEMP_MIN, temp_max=TEMP_MAX,
+                 max_gap_secs=COMPLIANCE_MAX_GAP_SECS, delta_h_kj=MKT_DELTA_H_KJ,
+                 checkpoint_secs=COMPLIANCE_CHECKPOINT_SECS, checkpoints=COMPLIANCE_CHECKPOINTS,
+                 max_states=COMPLIANCE_MAX_STATES):
+        self.temp_min = temp_min
+        self.temp_max = temp_max
+        self.max_gap_secs = max_gap_secs
+        self.delta_h_kj = delta_h_kj
+        self.checkpoint_secs = checkpoint_secs
+        self.max_checkpoints = checkpoints
+        self.max_states = max_states
+        self._states = OrderedDict()  # least recently updated first
+        self._checkpoints = {}  # key -> deque of (period start, state before it), oldest first
+        self._lock = threading.Lock()
+
+    def _load(self, session, keys):
+        missing = [key for key in keys if key not in self._states]
+        for i in range(0, len(missing), 500):
+            chunk = missing[i:i + 500]
+            c = shipment_compliance.c
+            rows = session.execute(
+                select(shipment_compliance).where(tuple_(c.shipment_id, c.device_id).in_(chunk))
+            ).mappings()
+            for row in rows:
+                self._states[(row["shipment_id"], row["device_id"])] = \
+                    ComplianceState(**{field: row[field] for field in STATE_FIELDS})
+        for key in missing:
+            self._states.setdefault(key, ComplianceState())
+
+    def _fold(self, state, timestamp, temperature, checkpoints=None):
+        if checkpoints is not None and state.last_seen is not None:
+            period = bucket_start(timestamp, self.checkpoint_secs)
+            if state.last_seen < period:
+                checkpoints.append((period, state.copy()))
+        state.add(timestamp, temperature, self.temp_min, self.temp_max,
+                  self.max_gap_secs, self.delta_h_kj)
+
+    def _restart_point(self, key, since):
+        """(start, state before start) to replay a late reading at `since` from."""
+        checkpoints = self._checkpoints.get(key)
+        while checkpoints and checkpoints[-1][0] > since:
+            checkpoints.pop()  # recreated by the replay
+        if checkpoints:
+            start, state = checkpoints[-1]
+            return start, state.copy()
+        # Older than every checkpoint: the whole (shipment, device), from its first reading
+        first_seen = self._states[key].first_seen
+        return min(since, first_seen) if first_seen is not None else None, None
+
+    def update(self, session, sensor_model, readings):
+        """
+        Folds stored readings (dicts, in event-time order) into their
+        (shipment, device) states and writes the touched rows. Keys that
+        received a reading older than their last one are replayed from the
+        checkpoint before it. Returns the number of recomputed keys.
+        """
+        with self._lock:
+            keys = {(data.get('shipment_id') or NO_SHIPMENT, data['device_id']) for data in readings}
+            self._load(session, list(keys))
+            late = {}
+            for data in readings:
+                key = (data.get('shipment_id') or NO_SHIPMENT, data['device_id'])
+                state = self._states[key]
+                if key in late or (state.last_seen is not None and data['received_at'] < state.last_seen):
+                    late[key] = min(late.get(key, data['received_at']), data['received_at'])
+                    continue
+                self._fold(state, data['received_at'], data['temperature'], self._checkpoints_of(key))
+            for key, since in late.items():
+                start, state = self._restart_point(key, since)
+                self._states[key] = self.recompute(session, sensor_model, key, start, state,
+                                                   self._checkpoints_of(key))
+            upsert_states(session, [self._states[key].row(*key) for key in keys])
+            for key in keys:
+                self._states.move_to_end(key)
+            while len(self._states) > self.max_states:
+                evicted, _ = self._states.popitem(last=False)
+                self._checkpoints.pop(evicted, None)
+            return len(late)
+
+    def _checkpoints_of(self, key):
+        checkpoints = self._checkpoints.get(key)
+        if checkpoints is None:
+            checkpoints = self._checkpoints[key] = deque(maxlen=self.max_checkpoints)
+        return checkpoints
+
+    def recompute(self, session, sensor_model, key, since=None, state=None, checkpoints=None):
+        """
+        Replays the readings of a (shipment, device) from `since` (all of
+        them when None) onto `state`, the state of everything before
+        `since`: archived days first, then sensor_data. `checkpoints`
+        (a deque) collects period checkpoints along the way.
+        """
+        SensorData = sensor_model
+        shipment_id, device_id = key
+        query = select(SensorData.id, SensorData.timestamp, SensorData.temperature)\
+            .where(SensorData.device_id == device_id)
+        if shipment_id == NO_SHIPMENT:
+            query = query.where(SensorData.shipment_id.is_(None))
+        else:
+            query = query.where(SensorData.shipment_id == shipment_id)
+        if since is not None:
+            query = query.where(SensorData.timestamp >= since)
+        live = session.execute(query.order_by(SensorData.timestamp, SensorData.id))
+
+        covered = archive.covered_until()
+        archived = ()
+        if covered is not None and (since is None or since < covered):
+            archived = (row for row in archive.read_range(since or datetime.min, covered, device_id)
+                        if (row.shipment_id or NO_SHIPMENT) == shipment_id)
+
+        state = state or ComplianceState()
+        for row in archive.merge_rows(live, archived):
+            if row.temperature is not None:
+                self._fold(state, row.timestamp, row.temperature, checkpoints)
+        return state
+
+    def invalidate(self):
+        """Drops cached states; they are re-read from the table on next use."""
+        with self._lock:
+            self._states.clear()
+            self._checkpoints.clear()
+
+
+def rebuild(engine, sensor_model, shipment_id=None, device_id=None,
+            temp_min=TEMP_MIN, temp_max=TEMP_MAX):
+    """Recomputes shipment_compliance rows from raw + archived readings. Returns the key count."""
+    SensorData = sensor_model
+    c = shipment_compliance.c
+    tracker = ComplianceTracker(temp_min, temp_max)
+    with Session(engine) as session:
+        raw = select(SensorData.shipment_id, SensorData.device_id).distinct()
+        stored = select(c.shipment_id, c.device_id)
+        if shipment_id is not None:
+            raw = raw.where(SensorData.shipment_id == shipment_id)
+            stored = stored.where(c.shipment_id == shipment_id)
+        if device_id is not None:
+            raw = raw.where(SensorData.device_id == device_id)
+            stored = stored.where(c.device_id == device_id)
+        keys = {(shipment or NO_SHIPMENT, device) for shipment, device in session.execute(raw)}
+        keys.update(tuple(row) for row in session.execute(stored))
+    for key in sorted(keys):
+        with Session(engine) as session, session.begin():
+            state = tracker.recompute(session, SensorData, key)
+            upsert_states(session, [state.row(*key)])
+    return len(keys)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain shipment_compliance")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rb = sub.add_parser("rebuild", help="recompute compliance from raw and archived readings")
+    rb.add_argument("--shipment")
+    rb.add_argument("--device")
+    args = parser.parse_args()
+
+    from db import engine as db, SensorData
+    from risk_engine import RiskEngine
+    from cache import data_version
+
+    metadata.create_all(db)
+    rules = RiskEngine()
+    count = rebuild(db, SensorData, args.shipment, args.device, rules.temp_min, rules.temp_max)
+    data_version.bump()
+    print(f"✅ Rebuilt compliance for {count:,} shipment/device pairs")
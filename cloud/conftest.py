@@ -0,0 +1,59 @@
+"""
+pytest setup for the cloud services: `python -m pytest cloud`.
+
+Tests import the service modules from this directory against a scratch
+SQLite database and spool directory, set up before any module reads its
+environment.
+"""
+import os
+import tempfile
+import pytest
+
+SCRATCH = tempfile.mkdtemp(prefix="coldchain-tests-")
+os.environ["DATABASE_URL"] = f"sqlite:///{os.path.join(SCRATCH, 'coldchain.db')}"
+os.environ["SPOOL_DIR"] = os.path.join(SCRATCH, "spool")
+os.environ["ARCHIVE_DIR"] = os.path.join(SCRATCH, "archive")
+os.environ["LOG_LEVEL"] = "WARNING"
+# history_api subscribes at import otherwise
+os.environ["LIVE_FEED"] = "0"
+
+# Scripts that talk to a live broker / server on import, not tests
+collect_ignore = ["test_mqtt_publisher.py", "htpp_old_code"]
+
+
+class RecordingClient:
+    """Stands in for the paho client: keeps (topic, payload) of every publish."""
+
+    def __init__(self):
+        self.published = []
+
+    def publish(self, topic, payload, *args, **kwargs):
+        self.published.append((topic, payload))
+
+
+@pytest.fixture
+def subscriber():
+    """
+    mqtt_subscriber against an empty scratch database, with fresh in-memory
+    state (excursions, alerts, boot times, rollups, compliance) and a
+    RecordingClient.
+    """
+    import mqtt_subscriber as sub
+    from db import get_engine, init_schema, Base
+    from rollups import metadata as rollups_metadata
+    from compliance import metadata as compliance_metadata
+
+    engine = get_engine()
+    init_schema(engine)
+    with engine.begin() as conn:
+        for metadata in (Base.metadata, rollups_metadata, compliance_metadata):
+            for table in reversed(metadata.sorted_tables):
+                conn.execute(table.delete())
+    sub.excursions._states = {}
+    sub.alert_engine._states = {}
+    sub.boot_clock.boots.clear()
+    sub.rollup_accumulator.drain()
+    sub.compliance_tracker.invalidate()
+    sub.client = RecordingClient()
+    yield sub
+    sub.SessionLocal.remove()
@@ -0,0 +1,213 @@
+"""
+Shared data access for mqtt_subscriber, history_api and the batch tools:
+one pooled engine per process, thread-scoped sessions, the ORM models, and
+connection pool metrics.
+
+Importing this module has no side effects: the engine (and with it the
+DB driver) is created on first use by get_engine() or a session, and
+tables are only created by init_schema() (`python migrate.py init`).
+
+Pool settings (env):
+    DB_POOL_SIZE (5), DB_MAX_OVERFLOW (10), DB_POOL_TIMEOUT (30 s),
+    DB_POOL_RECYCLE (1800 s), DB_POOL_PRE_PING (1)
+"""
+import os
+import time
+import threading
+from datetime import datetime
+from dotenv import load_dotenv
+from sqlalchemy import Column, Integer, BigInteger, Float, String, DateTime, ForeignKey, Index, create_engine, text
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.declarative import declarative_base
+from sqlalchemy.orm import Session, sessionmaker, scoped_session
+from sqlalchemy.pool import QueuePool
+
+load_dotenv()
+
+# SQL Configuration
+DB_URL = os.getenv("DATABASE_URL", "sqlite:///./coldchain.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 5))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 10))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+DB_POOL_PRE_PING = os.getenv("DB_POOL_PRE_PING", "1") not in ("0", "false", "False")
+
+# Acquisitions slower than this count as a "wait" for a free connection
+POOL_WAIT_THRESHOLD_SECS = 0.001
+
+
+class PoolMetrics:
+    """Counters for connection acquisition; read with pool_status()."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.acquisitions = 0
+        self.waits = 0
+        self.wait_time_total = 0.0
+        self.wait_time_max = 0.0
+        self.timeouts = 0
+
+    def record(self, elapsed, timed_out=False):
+        with self._lock:
+            if timed_out:
+                self.timeouts += 1
+            else:
+                self.acquisitions += 1
+            if elapsed >= POOL_WAIT_THRESHOLD_SECS:
+                self.waits += 1
+                self.wait_time_total += elapsed
+                self.wait_time_max = max(self.wait_time_max, elapsed)
+
+    def snapshot(self):
+        with self._lock:
+            return {
+                "acquisitions": self.acquisitions,
+                "waits": self.waits,
+                "wait_time_total_secs": round(self.wait_time_total, 6),
+                "wait_time_max_secs": round(self.wait_time_max, 6),
+                "timeouts": self.timeouts,
+            }
+
+
+pool_metrics = PoolMetrics()
+
+
+class MeteredQueuePool(QueuePool):
+    """QueuePool that times every connection checkout into pool_metrics."""
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            connection = super()._do_get()
+        except PoolTimeoutError:
+            pool_metrics.record(time.perf_counter() - start, timed_out=True)
+            raise
+        pool_metrics.record(time.perf_counter() - start)
+        return connection
+
+
+def make_engine(url=DB_URL):
+    if url.startswith("sqlite") and ":memory:" in url:
+        # In-memory SQLite must stay on a single connection
+        return create_engine(url)
+    return create_engine(
+        url,
+        poolclass=MeteredQueuePool,
+        pool_size=DB_POOL_SIZE,
+        max_overflow=DB_MAX_OVERFLOW,
+        pool_timeout=DB_POOL_TIMEOUT,
+        pool_recycle=DB_POOL_RECYCLE,
+        pool_pre_ping=DB_POOL_PRE_PING,
+    )
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """The process-wide engine, created on first call."""
+    global _engine
+    if _engine is None:
+        with _engine_lock:
+            if _engine is None:
+                _engine = make_engine()
+    return _engine
+
+
+def _forget_pool_after_fork():
+    # A forked child (gunicorn --preload) must not share the parent's connections
+    if _engine is not None:
+        _engine.dispose(close=False)
+
+
+os.register_at_fork(after_in_child=_forget_pool_after_fork)
+
+
+def __getattr__(name):
+    # `from db import engine` keeps working for the CLI tools (creates it then)
+    if name == "engine":
+        return get_engine()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+
+
+class LazySession(Session):
+    """Session that binds to get_engine() when it first needs a connection."""
+
+    def get_bind(self, *args, **kwargs):
+        if self.bind is None:
+            self.bind = get_engine()
+        return super().get_bind(*args, **kwargs)
+
+
+# Thread-scoped: each thread reuses one Session; close() returns its
+# connection to the pool, remove() discards the session (end of request).
+SessionLocal = scoped_session(sessionmaker(class_=LazySession, autocommit=False, autoflush=False))
+Base = declarative_base()
+
+
+def init_schema(engine=None):
+    """Creates missing tables (ORM models, rollups, compliance); existing ones are left alone."""
+    from rollups import metadata as rollups_metadata
+    from compliance import metadata as compliance_metadata
+    engine = engine or get_engine()
+    Base.metadata.create_all(bind=engine)
+    rollups_metadata.create_all(bind=engine)
+    compliance_metadata.create_all(bind=engine)
+
+
+def pool_status():
+    """Current pool occupancy plus acquisition counters."""
+    status = pool_metrics.snapshot()
+    if _engine is None:
+        return status
+    pool = _engine.pool
+    if isinstance(pool, QueuePool):
+        status.update({
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": max(pool.overflow(), 0),
+            "max_overflow": DB_MAX_OVERFLOW,
+        })
+    return status
+
+
+# Partial index predicate for compliant (2-8 °C) readings, see migrate.py
+COMPLIANT_CLAUSE = text("temperature >= 2.0 AND temperature <= 8.0")
+# Dedupe key for store-and-forward uplinks: (device_id, seq, timestamp), since
+# device counters restart at 0 on every boot; migrate.SEQ_DEDUPE_INDEX is the
+# same index for migrated / partitioned databases. Readings without a seq stay NULL.
+HAS_SEQ_CLAUSE = text("seq IS NOT NULL")
+
+# Define SQL Models
+class SensorData(Base):
+    __tablename__ = "sensor_data"
+    __table_args__ = (
+        Index("ix_sensor_data_device_timestamp", "device_id", "timestamp"),
+        Index("ix_sensor_data_compliant", "device_id", "timestamp",
+              sqlite_where=COMPLIANT_CLAUSE, postgresql_where=COMPLIANT_CLAUSE),
+        Index("ux_sensor_data_device_seq", "device_id", "seq", "timestamp", unique=True,
+              sqlite_where=HAS_SEQ_CLAUSE, postgresql_where=HAS_SEQ_CLAUSE),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(String, nullable=False, default="default", server_default="default")
+    shipment_id = Column(String, nullable=True)
+    # Device sequence number, or the sample's epoch ms when a batch sends none
+    seq = Column(BigInteger, nullable=True)
+    temperature = Column(Float)
+    vibration = Column(Float)
+    rpm = Column(Integer)
+    timestamp = Column(DateTime, default=datetime.utcnow, index=True)
+
+class RiskAssessment(Base):
+    __tablename__ = "risk_assessments"
+    __table_args__ = (
+        Index("ix_risk_assessments_device_timestamp", "device_id", "timestamp"),
+    )
+    id = Column(Integer, primary_key=True, index=True)
+    device_id = Column(String, nullable=False, default="default", server_default="default")
+    sensor_data_id = Column(Integer, ForeignKey("sensor_data.id"), index=True)
+    risk_probability = Column(Float)
+    risk_reasons = Column(String)
+    timestamp = Column(DateTime, default=datetime.utcnow)
@@ -0,0 +1,184 @@
+import threading
+import numpy as np
+from sqlalchemy import func
+
+# Cold chain compliance band (°C)
+TEMP_MIN = 2.0
+TEMP_MAX = 8.0
+
+DEFAULT_DEVICE = "default"
+
+
+def replay_durations(epoch_secs, temperature, last_compliant=None,
+                     temp_min=TEMP_MIN, temp_max=TEMP_MAX):
+    """
+    Vectorized ExcursionTracker.update over one device's readings in time
+    order. `last_compliant` (epoch seconds or None) carries state in from the
+    previous chunk. Returns (durations float64[N] with NaN where the tracker
+    returns None, new last_compliant).
+    """
+    epoch_secs = np.asarray(epoch_secs, dtype=np.float64)
+    temperature = np.asarray(temperature, dtype=np.float64)
+    compliant = (temperature >= temp_min) & (temperature <= temp_max)
+
+    seed = -np.inf if last_compliant is None else float(last_compliant)
+    last = np.maximum.accumulate(np.where(compliant, epoch_secs, -np.inf))
+    last = np.maximum(last, seed)
+    durations = np.where(compliant | np.isinf(last), np.nan, epoch_secs - last)
+
+    carry = last[-1] if len(last) else seed
+    return durations, (None if np.isinf(carry) else float(carry))
+
+
+class ExcursionState:
+    __slots__ = ("last_compliant", "excursion_start", "last_seen")
+
+    def __init__(self, last_compliant=None, excursion_start=None, last_seen=None):
+        self.last_compliant = last_compliant
+        self.excursion_start = excursion_start
+        self.last_seen = last_seen
+
+
+class ExcursionTracker:
+    """
+    Per-device temperature excursion state, kept in memory so risk evaluation
+    never has to query sensor_data for the last compliant reading.
+
+    Rebuilt once from the database at startup, then updated with every
+    reading in arrival order.
+    """
+
+    def __init__(self, temp_min=TEMP_MIN, temp_max=TEMP_MAX):
+        self.temp_min = temp_min
+        self.temp_max = temp_max
+        self._states = {}
+        self._lock = threading.Lock()
+
+    def rebuild(self, session, sensor_model, device_ids=None):
+        """Seeds state from the DB: per device, the last compliant reading and,
+        if the device is currently out of range, the first reading of the
+        ongoing excursion. Two grouped queries, both served by the
+        (device_id, timestamp) index. With `device_ids`, only those devices
+        are re-read (e.g. after late readings were inserted)."""
+        def per_device(query):
+            if device_ids is not None:
+                query = query.filter(sensor_model.device_id.in_(device_ids))
+            return dict(query.group_by(sensor_model.device_id).all())
+
+        last_compliant = per_device(
+            session.query(sensor_model.device_id, func.max(sensor_model.timestamp))
+            .filter(sensor_model.temperature >= self.temp_min, sensor_model.temperature <= self.temp_max)
+        )
+        last_seen = per_device(
+            session.query(sensor_model.device_id, func.max(sensor_model.timestamp))
+        )
+
+        states = {}
+        for device_id, seen in last_seen.items():
+            compliant_at = last_compliant.get(device_id)
+            excursion_start = None
+            if compliant_at is None or seen > compliant_at:
+                excursion_query = session.query(func.min(sensor_model.timestamp))\
+                    .filter(sensor_model.device_id == device_id)
+                if compliant_at is not None:
+                    excursion_query = excursion_query.filter(sensor_model.timestamp > compliant_at)
+                excursion_start = excursion_query.scalar()
+            states[device_id] = ExcursionState(
+                last_compliant=compliant_at,
+                excursion_start=excursion_start,
+                last_seen=seen,
+            )
+
+        with self._lock:
+            if device_ids is None:
+                self._states = states
+            else:
+                self._states.update(states)
+
+    def update(self, device_id, temperature, timestamp):
+        """
+        Records a reading and returns the current excursion duration in seconds,
+        measured from the last compliant reading. Returns None while compliant
+        or when the device has never been compliant.
+        """
+        device_id = device_id or DEFAULT_DEVICE
+        with self._lock:
+            state = self._states.get(device_id)
+            if state is None:
+                state = self._states[device_id] = ExcursionState()
+            state.last_seen = timestamp
+
+            if self.temp_min <= temperature <= self.temp_max:
+                state.last_compliant = timestamp
+                state.excursion_start = None
+                return None
+
+            if state.excursion_start is None:
+                state.excursion_start = timestamp
+            if state.last_compliant is None:
+                return None
+            return (timestamp - state.last_compliant).total_seconds()
+
+    def update_late(self, device_id, temperature, timestamp):
+        """
+        Folds in a reading older than the device's last one without a DB
+        read (for writers that cannot rebuild() while newer readings of the
+        device are still uncommitted). last_seen stays; a compliant reading
+        newer than last_compliant moves it forward, and an open excursion
+        then counts from this reading (its first out-of-range reading is at
+        most one sample later).
+        """
+        device_id = device_id or DEFAULT_DEVICE
+        with self._lock:
+            state = self._states.get(device_id)
+            if state is None:
+                return
+            if self.temp_min <= temperature <= self.temp_max:
+                if state.last_compliant is None or timestamp > state.last_compliant:
+                    state.last_compliant = timestamp
+                    if state.excursion_start is not None and state.excursion_start < timestamp:
+                        state.excursion_start = timestamp
+            elif state.excursion_start is not None and \
+                    (state.last_compliant is None or timestamp > state.last_compliant) and \
+                    timestamp < state.excursion_start:
+                state.excursion_start = timestamp
+
+    def get(self, device_id):
+        return self._states.get(device_id or DEFAULT_DEVICE)
+
+    def checkpoint(self, device_ids):
+        """Copies the state of `device_ids` (None for unknown devices), so a
+        batch whose transaction fails can be undone with restore()."""
+        with self._lock:
+            return {
+                device_id: None if state is None else
+                ExcursionState(state.last_compliant, state.excursion_start, state.last_seen)
+                for device_id, state in ((d, self._states.get(d)) for d in device_ids)
+            }
+
+    def restore(self, checkpoint):
+        with self._lock:
+            for device_id, state in checkpoint.items():
+                if state is None:
+                    self._states.pop(device_id, None)
+                else:
+                    self._states[device_id] = state
+
+    def snapshot(self):
+        """Returns {device_id: {last_compliant, excursion_start, duration_secs}}."""
+        with self._lock:
+            return {
+                device_id: {
+                    "last_compliant": state.last_compliant,
+                    "excursion_start": state.excursion_start,
+                    "duration_secs": self._duration(state),
+                }
+                for device_id, state in self._states.items()
+            }
+
+    @staticmethod
+    def _duration(state):
+        if state.excursion_start is None or state.last_seen is None:
+            return 0.0
+        since = state.last_compliant or state.excursion_start
+        return (state.last_seen - since).total_seconds()
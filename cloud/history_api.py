@@ -1,91 +1,540 @@
 import os
-from flask import Flask, jsonify, request
-from sqlalchemy import create_engine, desc
-from sqlalchemy.orm import sessionmaker
+import io
+import time
+import csv
+import json
+import base64
+import hashlib
+import sys
+import binascii
+from itertools import islice
+from functools import wraps
+from flask import Flask, Response, g, jsonify, request, stream_with_context
+from sqlalchemy import Integer, desc, func, cast, or_, and_
 from datetime import datetime, timedelta
 from dotenv import load_dotenv
 from flask_cors import CORS
-
-# Reuse models from mqtt_subscriber or redefine here for independence
-from sqlalchemy import Column, Integer, Float, String, DateTime, ForeignKey
-from sqlalchemy.ext.declarative import declarative_base
+from downsample import lttb
+from cache import data_version, response_cache
+from rollups import sensor_rollups
+from compliance import shipment_compliance, ComplianceState, STATE_FIELDS, report, combine
+from db import get_engine, SessionLocal, SensorData, RiskAssessment, pool_status
+from logs import get_logger
+from live import LiveFeed, LIVE_BUFFER_SIZE, live_row, stream_events
+from hot import HotStore, hot_requests_total
+import archive
+import metrics
 
 load_dotenv()
 
 app = Flask(__name__)
 CORS(app) # Enable CORS for dashboard
 
-# SQL Configuration
-DB_URL = os.getenv("DATABASE_URL", "sqlite:///./coldchain.db")
-engine = create_engine(DB_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
-
-class SensorData(Base):
-    __tablename__ = "sensor_data"
-    id = Column(Integer, primary_key=True, index=True)
-    temperature = Column(Float)
-    vibration = Column(Float)
-    rpm = Column(Integer)
-    timestamp = Column(DateTime, default=datetime.utcnow)
-
-class RiskAssessment(Base):
-    __tablename__ = "risk_assessments"
-    id = Column(Integer, primary_key=True, index=True)
-    sensor_data_id = Column(Integer, ForeignKey("sensor_data.id"))
-    risk_probability = Column(Float)
-    risk_reasons = Column(String)
-    timestamp = Column(DateTime, default=datetime.utcnow)
+log = get_logger("api")
+
+# Slower requests are logged (rate-limited) with their arguments
+SLOW_REQUEST_MS = float(os.getenv("SLOW_REQUEST_MS", 500))
+# LIVE_FEED=0: no live subscription (no /api/stream, no hot store; everything from SQL)
+LIVE_FEED = os.getenv("LIVE_FEED", "1") not in ("0", "false", "False")
+
+metrics.registry.gauge("coldchain_db_pool_checked_out", "DB connections currently in use",
+                       function=lambda: pool_status().get("checked_out", 0))
+metrics.registry.gauge("coldchain_db_pool_waits", "Connection checkouts that had to wait (cumulative)",
+                       function=lambda: pool_status()["waits"])
+
+@app.before_request
+def start_timer():
+    g.request_start = time.perf_counter()
+
+@app.after_request
+def record_request(response):
+    endpoint = request.url_rule.rule if request.url_rule else "unmatched"
+    elapsed = time.perf_counter() - g.get("request_start", time.perf_counter())
+    metrics.api_request_seconds.observe(elapsed, endpoint=endpoint, method=request.method,
+                                        status=response.status_code)
+    if g.get("rows") is not None:
+        metrics.api_rows_returned.observe(g.rows, endpoint=endpoint)
+    if response.status_code >= 500:
+        log.error("❌ Request failed", endpoint=endpoint, status=response.status_code,
+                  args=request.query_string.decode())
+    elif elapsed * 1000 >= SLOW_REQUEST_MS:
+        log.warning("🐢 Slow request", endpoint=endpoint, status=response.status_code,
+                    ms=round(elapsed * 1000, 1), args=request.query_string.decode())
+    return response
+
+def rows_returned(rows):
+    """Records the row count of the current response and passes the rows through."""
+    g.rows = len(rows)
+    return rows
+
+@app.teardown_appcontext
+def remove_session(exc=None):
+    # Hand this thread's session (and its pooled connection) back
+    SessionLocal.remove()
+
+# Response caching (invalidated by the subscriber via the shared data version)
+def current_version():
+    """
+    Shared data version (bumped by the subscriber's commits) + the hot
+    store's own version: live rows reach the hot store after the commit, so
+    a response built from it in between must not outlive their arrival.
+    """
+    return (data_version.current(), hot_store.version)
+
+def cache_key(version):
+    """Path + data version + query args in a canonical order."""
+    args = tuple(sorted((k, tuple(sorted(v))) for k, v in request.args.lists()))
+    return (request.path, version, args)
+
+def cached_response(ttl=None):
+    """
+    Caches a JSON view's successful responses and answers If-None-Match with
+    304. Entries are keyed on current_version(), so they are replaced as
+    soon as the subscriber commits new readings. A response whose data
+    changed while it was computed is served but not cached.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapper(*args, **kwargs):
+            version = current_version()
+            key = cache_key(version)
+            entry = response_cache.get(key)
+            if entry is None:
+                response = view(*args, **kwargs)
+                if isinstance(response, tuple) or response.status_code != 200:
+                    return response
+                body = response.get_data()
+                etag = hashlib.md5(body).hexdigest()
+                entry = (body, response.mimetype, etag)
+                if current_version() == version:
+                    response_cache.put(key, entry, ttl)
+
+            body, mimetype, etag = entry
+            if etag in request.if_none_match:
+                return Response(status=304, headers={"ETag": f'"{etag}"'})
+            return Response(body, mimetype=mimetype, headers={"ETag": f'"{etag}"'})
+        return wrapper
+    return decorator
+
+# Downsampling / aggregation modes for /api/history
+AGGREGATES = {"min": func.min, "max": func.max, "avg": func.avg}
+BUCKET_UNITS = {"s": 1, "m": 60, "h": 3600, "d": 86400}
+LTTB_FIELDS = ("temperature", "vibration", "rpm", "risk_probability")
+ROLLUP_MIN_MINUTES = int(os.getenv("ROLLUP_MIN_MINUTES", 360))
+
+def parse_bucket(value):
+    """'300' / '30s' / '5m' / '1h' / '1d' -> bucket width in seconds."""
+    value = value.strip().lower()
+    if not value:
+        raise ValueError("bucket is empty")
+    if value[-1] in BUCKET_UNITS:
+        secs = int(value[:-1]) * BUCKET_UNITS[value[-1]]
+    else:
+        secs = int(value)
+    if secs <= 0:
+        raise ValueError("bucket must be positive")
+    return secs
+
+def int_arg(name, default):
+    """Integer query parameter; ValueError naming it on bad input (a 400)."""
+    value = request.args.get(name, default)
+    try:
+        return int(value)
+    except ValueError:
+        raise ValueError(f"Invalid {name}: {value}") from None
+
+def bucket_expression(bucket_secs):
+    """Bucket number (epoch seconds // bucket_secs), computed in SQL."""
+    if get_engine().dialect.name == "postgresql":
+        return func.floor(func.extract("epoch", SensorData.timestamp) / bucket_secs)
+    return cast(func.strftime("%s", SensorData.timestamp), Integer) // bucket_secs
+
+def history_query(session, columns, start_time, device_id):
+    query = session.query(*columns)\
+        .join(RiskAssessment, SensorData.id == RiskAssessment.sensor_data_id)\
+        .filter(SensorData.timestamp >= start_time)
+    if device_id:
+        query = query.filter(SensorData.device_id == device_id)
+    return query
+
+def archived_rows(start, end, device_id, shipment_id=None, newest_first=False):
+    """
+    Rows moved to the archive by retention.py for [start, end), in
+    (timestamp, id) order; empty when the range is newer than the archive.
+    """
+    covered = archive.covered_until()
+    if covered is None or start >= covered:
+        return iter(())
+    end = min(end, covered) if end else covered
+    return archive.read_range(start, end, device_id, shipment_id, newest_first)
+
+def bucketed_history(session, start_time, device_id, bucket_secs, agg, limit):
+    bucket = bucket_expression(bucket_secs).label("bucket")
+
+    if agg == "last":
+        # Latest reading in each bucket
+        row_number = func.row_number().over(
+            partition_by=bucket, order_by=(desc(SensorData.timestamp), desc(SensorData.id))
+        ).label("rn")
+        sub = history_query(session, (
+            bucket,
+            SensorData.temperature,
+            SensorData.vibration,
+            SensorData.rpm,
+            RiskAssessment.risk_probability,
+            RiskAssessment.risk_reasons,
+            row_number,
+        ), start_time, device_id).subquery()
+        rows = session.query(sub)\
+            .filter(sub.c.rn == 1)\
+            .order_by(desc(sub.c.bucket))\
+            .limit(limit)\
+            .all()
+        return [{
+            "timestamp": datetime.utcfromtimestamp(int(row.bucket) * bucket_secs).isoformat(),
+            "temperature": row.temperature,
+            "vibration": row.vibration,
+            "rpm": row.rpm,
+            "risk_probability": row.risk_probability,
+            "risk_reasons": row.risk_reasons,
+        } for row in rows]
+
+    agg_fn = AGGREGATES[agg]
+    rows = history_query(session, (
+        bucket,
+        agg_fn(SensorData.temperature),
+        agg_fn(SensorData.vibration),
+        agg_fn(SensorData.rpm),
+        agg_fn(RiskAssessment.risk_probability),
+        func.count(SensorData.id),
+    ), start_time, device_id)\
+        .group_by(bucket)\
+        .order_by(desc(bucket))\
+        .limit(limit)\
+        .all()
+    return [{
+        "timestamp": datetime.utcfromtimestamp(int(b) * bucket_secs).isoformat(),
+        "temperature": temperature,
+        "vibration": vibration,
+        "rpm": rpm,
+        "risk_probability": risk,
+        "count": count,
+    } for b, temperature, vibration, rpm, risk, count in rows]
+
+def row_columns():
+    """Flat column tuple for one joined reading (no ORM object construction)."""
+    return (
+        SensorData.id,
+        SensorData.device_id,
+        SensorData.shipment_id,
+        SensorData.temperature,
+        SensorData.vibration,
+        SensorData.rpm,
+        SensorData.timestamp,
+        RiskAssessment.risk_probability,
+        RiskAssessment.risk_reasons,
+    )
+
+def rollup_history(session, start_time, device_id, bucket_secs, agg, limit):
+    """
+    Same shape as bucketed_history, read from sensor_rollups (1-hour rows when
+    the bucket is whole hours, else 1-minute rows). `temperature` follows
+    `agg`; vibration/rpm/risk are the bucket's worst case (max vibration,
+    min RPM, max risk) and `excursion_secs` is included.
+    """
+    resolution = 3600 if bucket_secs % 3600 == 0 else 60
+    r = sensor_rollups.c
+    if get_engine().dialect.name == "postgresql":
+        bucket = func.floor(func.extract("epoch", r.bucket_start) / bucket_secs)
+    else:
+        bucket = cast(func.strftime("%s", r.bucket_start), Integer) // bucket_secs
+    bucket = bucket.label("bucket")
+
+    temperature = {
+        "min": func.min(r.temp_min),
+        "max": func.max(r.temp_max),
+        "avg": func.sum(r.temp_sum) / func.sum(r.count),
+    }[agg]
+    query = session.query(
+        bucket, temperature, func.max(r.vib_max), func.min(r.rpm_min), func.max(r.risk_max),
+        func.sum(r.count), func.sum(r.excursion_secs),
+    ).filter(r.resolution == resolution, r.bucket_start >= start_time)
+    if device_id:
+        query = query.filter(r.device_id == device_id)
+    rows = query.group_by(bucket).order_by(desc(bucket)).limit(limit).all()
+    return [{
+        "timestamp": datetime.utcfromtimestamp(int(b) * bucket_secs).isoformat(),
+        "temperature": temp,
+        "vibration": vibration,
+        "rpm": rpm,
+        "risk_probability": risk,
+        "count": count,
+        "excursion_secs": excursion,
+    } for b, temp, vibration, rpm, risk, count, excursion in rows]
+
+def lttb_history(session, start_time, device_id, points, field):
+    rows = history_query(session, row_columns(), start_time, device_id)\
+        .order_by(SensorData.timestamp, SensorData.id)\
+        .all()
+    rows = list(archive.merge_rows(rows, archived_rows(start_time, None, device_id)))
+
+    xs = [row.timestamp.timestamp() for row in rows]
+    ys = [getattr(row, field) or 0.0 for row in rows]
+    keep = lttb(xs, ys, points)
+    return [serialize_row(rows[i]) for i in reversed(keep)]
+
+def serialize_row(row):
+    return {
+        "id": row.id,
+        "device_id": row.device_id,
+        "shipment_id": row.shipment_id,
+        "temperature": row.temperature,
+        "vibration": row.vibration,
+        "rpm": row.rpm,
+        "timestamp": row.timestamp.isoformat(),
+        "risk_probability": row.risk_probability,
+        "risk_reasons": row.risk_reasons
+    }
 
 @app.route('/api/history', methods=['GET'])
+@cached_response()
 def get_history():
-    minutes = int(request.args.get('minutes', 60))
-    limit = int(request.args.get('limit', 1000))
+    """
+    Raw joined rows by default. Optional reduction modes:
+    - bucket=5m&agg=min|max|avg|last : time-bucket aggregation in SQL
+      (served from sensor_rollups for windows >= ROLLUP_MIN_MINUTES)
+    - downsample=lttb&points=500[&field=temperature] : LTTB point selection
+    Raw and LTTB modes include archived readings (retention.py); bucketed
+    windows reaching into the archive are served from sensor_rollups.
+    """
+    device_id = request.args.get('device_id')
+    bucket = request.args.get('bucket')
+    agg = request.args.get('agg', 'avg')
+    downsample = request.args.get('downsample')
+    source = request.args.get('source')  # raw | rollup (default: rollup for long windows)
+
+    try:
+        minutes, limit, points = int_arg('minutes', 60), int_arg('limit', 1000), int_arg('points', 1000)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    try:
+        bucket_secs = parse_bucket(bucket) if bucket is not None else None
+    except ValueError:
+        return jsonify({"error": f"Invalid bucket: {bucket}"}), 400
+    if bucket_secs and agg not in AGGREGATES and agg != "last":
+        return jsonify({"error": f"Invalid agg: {agg}"}), 400
+    if downsample and downsample != "lttb":
+        return jsonify({"error": f"Invalid downsample: {downsample}"}), 400
+    field = request.args.get('field', 'temperature')
+    if field not in LTTB_FIELDS:
+        return jsonify({"error": f"Invalid field: {field}"}), 400
     
     session = SessionLocal()
     try:
         start_time = datetime.utcnow() - timedelta(minutes=minutes)
+
+        covered = archive.covered_until()
+        use_rollups = source == "rollup" or (source is None and (
+            minutes >= ROLLUP_MIN_MINUTES or (covered is not None and start_time < covered)))
+        if bucket_secs and use_rollups and agg in AGGREGATES and bucket_secs % 60 == 0:
+            return jsonify(rows_returned(rollup_history(session, start_time, device_id, bucket_secs, agg, limit)))
+        if bucket_secs:
+            rows = from_hot("/api/history", hot_store.buckets, start_time, device_id, bucket_secs, agg, limit)
+            if rows is None:
+                rows = bucketed_history(session, start_time, device_id, bucket_secs, agg, limit)
+            return jsonify(rows_returned(rows))
+        if downsample:
+            return jsonify(rows_returned(lttb_history(session, start_time, device_id, points, field)))
         
-        # Join sensor_data and risk_assessments
-        results = session.query(SensorData, RiskAssessment)\
-            .join(RiskAssessment, SensorData.id == RiskAssessment.sensor_data_id)\
-            .filter(SensorData.timestamp >= start_time)\
-            .order_by(desc(SensorData.timestamp))\
+        rows = from_hot("/api/history", hot_store.history, start_time, device_id, limit)
+        if rows is not None:
+            return jsonify(rows_returned(rows))
+
+        # Join sensor_data and risk_assessments (plus archived rows for old windows)
+        results = history_query(session, row_columns(), start_time, device_id)\
+            .order_by(desc(SensorData.timestamp), desc(SensorData.id))\
             .limit(limit)\
             .all()
-            
+        results = islice(archive.merge_rows(
+            results, archived_rows(start_time, None, device_id, newest_first=True), newest_first=True
+        ), limit)
+
         history = []
-        for sensor, risk in results:
+        for row in results:
             history.append({
-                "id": sensor.id,
-                "temperature": sensor.temperature,
-                "vibration": sensor.vibration,
-                "rpm": sensor.rpm,
-                "timestamp": sensor.timestamp.isoformat(),
-                "risk_probability": risk.risk_probability,
-                "risk_reasons": risk.risk_reasons
+                "id": row.id,
+                "device_id": row.device_id,
+                "temperature": row.temperature,
+                "vibration": row.vibration,
+                "rpm": row.rpm,
+                "timestamp": row.timestamp.isoformat(),
+                "risk_probability": row.risk_probability,
+                "risk_reasons": row.risk_reasons
             })
             
-        return jsonify(history)
+        return jsonify(rows_returned(history))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        session.close()
+
+# Keyset pagination and streaming export
+EXPORT_CHUNK_SIZE = int(os.getenv("EXPORT_CHUNK_SIZE", 1000))
+EXPORT_FIELDS = ("id", "device_id", "shipment_id", "timestamp", "temperature",
+                 "vibration", "rpm", "risk_probability", "risk_reasons")
+
+def encode_cursor(row):
+    raw = f"{row.timestamp.isoformat()}|{row.id}"
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    timestamp, row_id = base64.urlsafe_b64decode(cursor.encode()).decode().split("|")
+    return datetime.fromisoformat(timestamp), int(row_id)
+
+def parse_time_range(args, default_minutes=60):
+    """start/end as ISO-8601 (UTC), falling back to the last `minutes`."""
+    end = datetime.fromisoformat(args['end']) if args.get('end') else None
+    if args.get('start'):
+        start = datetime.fromisoformat(args['start'])
+    else:
+        start = datetime.utcnow() - timedelta(minutes=int(args.get('minutes', default_minutes)))
+    return start, end
+
+def range_query(session, start, end, device_id, shipment_id):
+    query = history_query(session, row_columns(), start, device_id)
+    if end:
+        query = query.filter(SensorData.timestamp < end)
+    if shipment_id:
+        query = query.filter(SensorData.shipment_id == shipment_id)
+    return query
+
+@app.route('/api/history/page', methods=['GET'])
+def get_history_page():
+    """
+    Keyset-paginated history, newest first. Pass `next_cursor` from the
+    previous page as `cursor`; each page costs one index range scan
+    regardless of depth. Archived days are merged in transparently.
+    """
+    try:
+        limit = min(int_arg('limit', 500), 5000)
+        start, end = parse_time_range(request.args)
+        cursor = decode_cursor(request.args['cursor']) if request.args.get('cursor') else None
+    except (ValueError, binascii.Error):
+        return jsonify({"error": "Invalid limit, time range or cursor"}), 400
+
+    device_id, shipment_id = request.args.get('device_id'), request.args.get('shipment_id')
+    session = SessionLocal()
+    try:
+        query = range_query(session, start, end, device_id, shipment_id)
+        archive_end = end
+        if cursor:
+            cursor_ts, cursor_id = cursor
+            query = query.filter(or_(
+                SensorData.timestamp < cursor_ts,
+                and_(SensorData.timestamp == cursor_ts, SensorData.id < cursor_id),
+            ))
+            cursor_end = cursor_ts + timedelta(microseconds=1)
+            archive_end = min(end, cursor_end) if end else cursor_end
+        rows = query.order_by(desc(SensorData.timestamp), desc(SensorData.id))\
+            .limit(limit + 1)\
+            .all()
+        archived = archived_rows(start, archive_end, device_id, shipment_id, newest_first=True)
+        if cursor:
+            archived = (row for row in archived if archive.sort_key(row) < cursor)
+        rows = list(islice(archive.merge_rows(rows, archived, newest_first=True), limit + 1))
+
+        has_more = len(rows) > limit
+        rows = rows[:limit]
+        return jsonify({
+            "items": rows_returned([serialize_row(row) for row in rows]),
+            "next_cursor": encode_cursor(rows[-1]) if has_more else None,
+        })
     except Exception as e:
         return jsonify({"error": str(e)}), 500
     finally:
         session.close()
 
+@app.route('/api/history/export', methods=['GET'])
+def export_history():
+    """
+    Streams every reading in the range, oldest first, as NDJSON (default) or
+    CSV. Rows come from a server-side cursor in EXPORT_CHUNK_SIZE chunks, so
+    memory stays constant however long the range is; archived days are read
+    one partition at a time ahead of them.
+    """
+    fmt = request.args.get('format', 'ndjson')
+    if fmt not in ("ndjson", "csv"):
+        return jsonify({"error": f"Invalid format: {fmt}"}), 400
+    try:
+        start, end = parse_time_range(request.args, default_minutes=1440)
+    except ValueError:
+        return jsonify({"error": "Invalid time range"}), 400
+    device_id = request.args.get('device_id')
+    shipment_id = request.args.get('shipment_id')
+
+    def generate():
+        session = SessionLocal()
+        count = 0
+        try:
+            rows = range_query(session, start, end, device_id, shipment_id)\
+                .order_by(SensorData.timestamp, SensorData.id)\
+                .execution_options(stream_results=True, yield_per=EXPORT_CHUNK_SIZE)
+            rows = archive.merge_rows(rows, archived_rows(start, end, device_id, shipment_id))
+
+            if fmt == "csv":
+                buffer = io.StringIO()
+                writer = csv.writer(buffer)
+                writer.writerow(EXPORT_FIELDS)
+                for row in rows:
+                    record = serialize_row(row)
+                    writer.writerow([record[field] for field in EXPORT_FIELDS])
+                    count += 1
+                    if buffer.tell() >= 64 * 1024:
+                        yield buffer.getvalue()
+                        buffer.seek(0)
+                        buffer.truncate()
+                yield buffer.getvalue()
+            else:
+                for row in rows:
+                    yield json.dumps(serialize_row(row)) + "\n"
+                    count += 1
+        finally:
+            # Streaming outlives after_request, so the row count is recorded here
+            metrics.api_rows_returned.observe(count, endpoint="/api/history/export")
+            session.close()
+
+    mimetype = "text/csv" if fmt == "csv" else "application/x-ndjson"
+    filename = f"history-{device_id or 'all'}-{start:%Y%m%d%H%M}.{fmt}"
+    return Response(stream_with_context(generate()), mimetype=mimetype, headers={
+        "Content-Disposition": f"attachment; filename={filename}"
+    })
+
 @app.route('/api/latest', methods=['GET'])
+@cached_response()
 def get_latest():
+    device_id = request.args.get('device_id')
+
+    row = from_hot("/api/latest", hot_store.latest, device_id)
+    if row is not None:
+        g.rows = 1
+        row.pop("id")
+        return jsonify(row)
+
     session = SessionLocal()
     try:
-        result = session.query(SensorData, RiskAssessment)\
-            .join(RiskAssessment, SensorData.id == RiskAssessment.sensor_data_id)\
-            .order_by(desc(SensorData.timestamp))\
-            .first()
+        query = session.query(SensorData, RiskAssessment)\
+            .join(RiskAssessment, SensorData.id == RiskAssessment.sensor_data_id)
+        if device_id:
+            query = query.filter(SensorData.device_id == device_id)
+        result = query.order_by(desc(SensorData.timestamp)).first()
             
         if not result:
             return jsonify({"message": "No data found"}), 404
             
         sensor, risk = result
+        g.rows = 1
         return jsonify({
+            "device_id": sensor.device_id,
             "temperature": sensor.temperature,
             "vibration": sensor.vibration,
             "rpm": sensor.rpm,
@@ -98,6 +547,187 @@ def get_latest():
     finally:
         session.close()
 
+@app.route('/api/compliance', methods=['GET'])
+@cached_response()
+def get_compliance():
+    """
+    Shipment compliance (time outside 2-8 °C, excursions, MKT) from the
+    shipment_compliance rows the subscriber keeps current; one indexed read,
+    also for shipments whose raw rows are archived.
+    - shipment_id=SHP-1[&device_id=...] : combined summary + per-device figures
+      (shipment_id= with an empty value: readings sent without a shipment)
+    - otherwise: shipment summaries, most recently active first
+      (optional device_id, limit)
+    """
+    device_id = request.args.get('device_id')
+    try:
+        limit = int_arg('limit', 100)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    session = SessionLocal()
+    try:
+        query = session.query(shipment_compliance)
+        if 'shipment_id' in request.args:
+            query = query.filter(shipment_compliance.c.shipment_id == request.args['shipment_id'])
+        if device_id:
+            query = query.filter(shipment_compliance.c.device_id == device_id)
+
+        shipments = {}
+        for row in query.all():
+            state = ComplianceState(**{field: getattr(row, field) for field in STATE_FIELDS})
+            shipments.setdefault(row.shipment_id, []).append((row.device_id, state))
+
+        if 'shipment_id' in request.args:
+            if not shipments:
+                return jsonify({"message": "No data found"}), 404
+            shipment_id, devices = next(iter(shipments.items()))
+            g.rows = len(devices)
+            return jsonify({
+                "shipment_id": shipment_id,
+                "summary": combine(state for _, state in devices),
+                "devices": [dict(report(state), device_id=device)
+                            for device, state in sorted(devices, key=lambda item: item[0])],
+            })
+
+        ordered = sorted(shipments.items(), key=lambda item: max(s.last_seen for _, s in item[1]), reverse=True)
+        return jsonify(rows_returned([
+            dict(combine(state for _, state in devices), shipment_id=shipment_id)
+            for shipment_id, devices in ordered[:limit]
+        ]))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        session.close()
+
+@app.route('/api/devices', methods=['GET'])
+@cached_response()
+def get_devices():
+    session = SessionLocal()
+    try:
+        results = session.query(SensorData.device_id, func.max(SensorData.timestamp))\
+            .group_by(SensorData.device_id)\
+            .all()
+
+        return jsonify(rows_returned([
+            {"device_id": device_id, "last_seen": last_seen.isoformat()}
+            for device_id, last_seen in results
+        ]))
+    except Exception as e:
+        return jsonify({"error": str(e)}), 500
+    finally:
+        session.close()
+
+# Live stream: one MQTT subscription fanned out to every dashboard
+def recent_live_rows(limit):
+    """Seeds the live buffer with the newest `limit` readings, oldest first."""
+    session = SessionLocal()
+    try:
+        rows = history_query(session, row_columns(), datetime.min, None)\
+            .order_by(desc(SensorData.timestamp), desc(SensorData.id))\
+            .limit(limit)\
+            .all()
+        return [live_row(row.device_id, row.timestamp, row.temperature, row.vibration,
+                         row.rpm, row.risk_probability, row.risk_reasons, row.id)
+                for row in reversed(rows)]
+    finally:
+        session.close()
+
+def window_live_rows(since):
+    """Seeds the hot store with every reading since `since`, oldest first."""
+    session = SessionLocal()
+    try:
+        rows = history_query(session, row_columns(), since, None)\
+            .order_by(SensorData.timestamp, SensorData.id)\
+            .yield_per(EXPORT_CHUNK_SIZE)
+        return [live_row(row.device_id, row.timestamp, row.temperature, row.vibration,
+                         row.rpm, row.risk_probability, row.risk_reasons, row.id)
+                for row in rows]
+    finally:
+        session.close()
+
+# Recent readings in memory (hot.py), fed by the same subscription
+hot_store = HotStore(seed=window_live_rows)
+live_feed = LiveFeed(os.getenv("MQTT_BROKER", "test.mosquitto.org"), int(os.getenv("MQTT_PORT", 1883)),
+                     seed=recent_live_rows, sinks=[hot_store])
+
+def start_live_feed():
+    """
+    Subscribes the live feed (stream buffer + hot store) once per process,
+    unless LIVE_FEED=0. Request handlers only read what it has received.
+    """
+    if LIVE_FEED:
+        live_feed.start()
+
+def reloader_watcher():
+    """
+    True in the werkzeug reloader's parent (debug=True, `flask run --debug`):
+    it imports the app but only restarts the child that serves it.
+    """
+    if os.environ.get("WERKZEUG_RUN_MAIN") == "true":
+        return False
+    if __name__ == "__main__":
+        return True
+    return (os.environ.get("FLASK_RUN_FROM_CLI") == "true" and os.environ.get("FLASK_DEBUG") == "1"
+            and "--no-reload" not in sys.argv)
+
+def restart_live_feed():
+    """In a forked worker (gunicorn --preload): the feed's network thread stayed behind."""
+    live_feed.forked()
+    start_live_feed()
+
+def from_hot(endpoint, read, *args):
+    """Result of a hot store read, or None (counted as a miss) to query the DB."""
+    result = read(*args)
+    hot_requests_total.inc(endpoint=endpoint, result="miss" if result is None else "hit")
+    return result
+
+@app.route('/api/stream', methods=['GET'])
+def stream():
+    """
+    Server-Sent Events: a `fields` header, a `snapshot` of the newest rows
+    (`snapshot=500`, optional `device_id`), then `delta` frames as the
+    subscriber commits readings. Reconnects resume from Last-Event-ID.
+    """
+    device_id = request.args.get('device_id')
+    try:
+        snapshot_size = min(int(request.args.get('snapshot', 500)), LIVE_BUFFER_SIZE)
+        last_event_id = request.headers.get('Last-Event-ID')
+        last_event_id = int(last_event_id) if last_event_id else None
+    except ValueError:
+        return jsonify({"error": "Invalid snapshot or Last-Event-ID"}), 400
+
+    if not live_feed.running:
+        return jsonify({"error": "Live feed disabled"}), 503
+    events = stream_events(live_feed.buffer, device_id, snapshot_size, last_event_id)
+    # No request context needed inside: the stream must not pin one for hours
+    return Response(events, mimetype="text/event-stream", headers={
+        "Cache-Control": "no-cache",
+        "X-Accel-Buffering": "no",  # nginx: flush each event immediately
+    })
+
+@app.route('/api/pool', methods=['GET'])
+def get_pool():
+    """DB connection pool occupancy and wait statistics."""
+    return jsonify(pool_status())
+
+@app.route('/api/hot', methods=['GET'])
+def get_hot():
+    """Hot store coverage and memory."""
+    return jsonify(hot_store.stats())
+
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    """Prometheus text exposition of the API (and pool) metrics."""
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+# Startup, in every process that serves: gunicorn / uwsgi workers, `flask run`,
+# `python history_api.py` (its reloader child) or any other import of `app`
+if not reloader_watcher():
+    start_live_feed()
+os.register_at_fork(after_in_child=restart_live_feed)
+
 if __name__ == '__main__':
     port = int(os.getenv("PORT", 5000))
-    app.run(host='0.0.0.0', port=port, debug=True)
+    # threaded: every /api/stream client holds a worker thread
+    app.run(host='0.0.0.0', port=port, debug=True, threaded=True)
@@ -0,0 +1,416 @@
+"""
+Process-local hot store of recent readings for history_api.
+
+Fed by the same live-topic subscription as /api/stream (live.py): every
+row the subscriber commits lands here, per device, in preallocated NumPy
+ring buffers (epoch µs, temperature, vibration, rpm, risk, reason code,
+row id: 45 bytes a reading). /api/latest, recent raw history and bucketed
+aggregates are answered from these arrays when the store covers the
+requested range; anything older goes to the database as before.
+
+Coverage is tracked per device: `covered_from` is the time from which
+every committed reading of the device is in memory. It starts at the seed
+window (the last HOT_WINDOW_SECS, read from the DB once the subscription is
+acknowledged) and moves forward as the ring evicts. Late readings (which
+rewrite a device's recent assessments) and batch re-scoring drop the
+affected data; a broker disconnect drops everything until the next seed.
+
+Memory: HOT_CAPACITY readings per device (HOT_CAPACITY_OVERRIDES
+"reefer-042=20000,..." per device), at most HOT_MAX_DEVICES devices (the
+least recently updated one is evicted).
+"""
+import os
+import heapq
+import threading
+from itertools import islice, repeat
+from collections import OrderedDict
+from datetime import datetime, timedelta
+import numpy as np
+from cache import rewrite_version
+from logs import get_logger
+import metrics
+
+HOT_WINDOW_SECS = float(os.getenv("HOT_WINDOW_SECS", 3600))
+HOT_CAPACITY = int(os.getenv("HOT_CAPACITY", 4096))
+HOT_CAPACITY_OVERRIDES = os.getenv("HOT_CAPACITY_OVERRIDES", "")
+HOT_MAX_DEVICES = int(os.getenv("HOT_MAX_DEVICES", 1000))
+
+EPOCH = datetime(1970, 1, 1)
+AGGREGATES = ("min", "max", "avg", "last")
+
+log = get_logger("hot")
+
+hot_requests_total = metrics.registry.counter(
+    "coldchain_hot_store_requests_total", "Queries answered from the hot store (hit) or sent to the DB (miss)",
+    ("endpoint", "result"))
+hot_rows = metrics.registry.gauge(
+    "coldchain_hot_store_rows", "Readings held in the hot store")
+hot_bytes = metrics.registry.gauge(
+    "coldchain_hot_store_bytes", "Memory held by the hot store's arrays")
+
+
+def parse_capacities(spec):
+    """'reefer-042=20000,reefer-7=500' -> {device_id: capacity}."""
+    capacities = {}
+    for item in spec.split(","):
+        if "=" in item:
+            device_id, capacity = item.rsplit("=", 1)
+            capacities[device_id.strip()] = int(capacity)
+    return capacities
+
+
+def to_micros(dt):
+    return (dt - EPOCH) // timedelta(microseconds=1)
+
+
+def from_micros(us):
+    return EPOCH + timedelta(microseconds=int(us))
+
+
+def _number(value):
+    return np.nan if value is None else value
+
+
+def _value(x):
+    return None if np.isnan(x) else float(x)
+
+
+def _integer(x):
+    return None if np.isnan(x) else int(x)
+
+
+class DeviceSeries:
+    """
+    One device's readings in a fixed-capacity ring (insertion order) with a
+    lazily computed (timestamp, id) ordering, so the odd out-of-order commit
+    needs no shifting.
+    """
+
+    __slots__ = ("capacity", "ts", "temperature", "vibration", "rpm", "risk", "reason", "ids",
+                 "head", "count", "covered_from", "newest", "_order", "_in_order")
+
+    def __init__(self, capacity, covered_from):
+        self.capacity = capacity
+        self.ts = np.zeros(capacity, dtype=np.int64)
+        self.temperature = np.zeros(capacity, dtype=np.float64)
+        self.vibration = np.zeros(capacity, dtype=np.float64)
+        self.rpm = np.zeros(capacity, dtype=np.float64)  # NaN for a missing value
+        self.risk = np.zeros(capacity, dtype=np.float64)
+        self.reason = np.zeros(capacity, dtype=np.uint16)
+        self.ids = np.zeros(capacity, dtype=np.int64)
+        self.head = 0  # next slot to write
+        self.count = 0
+        self.covered_from = covered_from  # epoch µs
+        self.newest = None
+        self._order = None
+        self._in_order = True
+
+    @property
+    def nbytes(self):
+        return sum(a.nbytes for a in (self.ts, self.temperature, self.vibration, self.rpm,
+                                      self.risk, self.reason, self.ids))
+
+    def append(self, us, temperature, vibration, rpm, risk, reason, row_id):
+        i = self.head
+        if self.count == self.capacity:
+            # Evicting: everything from just after the evicted reading is still complete
+            self.covered_from = max(self.covered_from, int(self.ts[i]) + 1)
+        else:
+            self.count += 1
+        if self.newest is not None and (us, row_id) < self.newest:
+            self._in_order = False
+        else:
+            self.newest = (us, row_id)
+        self.ts[i], self.temperature[i], self.vibration[i] = us, temperature, vibration
+        self.rpm[i], self.risk[i], self.reason[i], self.ids[i] = rpm, risk, reason, row_id
+        self.head = (i + 1) % self.capacity
+        self._order = None
+
+    def clear(self, covered_from):
+        self.head = self.count = 0
+        self.covered_from = covered_from
+        self._order = None
+        self._in_order = True
+
+    def order(self):
+        """Slot indices oldest first."""
+        if self._order is None:
+            start = (self.head - self.count) % self.capacity
+            order = (start + np.arange(self.count)) % self.capacity
+            if not self._in_order:
+                order = order[np.lexsort((self.ids[order], self.ts[order]))]
+            self._order = order
+        return self._order
+
+    def window(self, since_us):
+        """Slot indices with ts >= since_us, oldest first."""
+        order = self.order()
+        return order[np.searchsorted(self.ts[order], since_us, side="left"):]
+
+
+class HotStore:
+    """Per-device ring buffers plus coverage bookkeeping; thread-safe."""
+
+    def __init__(self, seed=None, window_secs=HOT_WINDOW_SECS, capacity=HOT_CAPACITY,
+                 overrides=HOT_CAPACITY_OVERRIDES, max_devices=HOT_MAX_DEVICES):
+        self.seed = seed  # callable(since datetime) -> live rows (with ids), oldest first
+        self.window_secs = window_secs
+        self.capacity = capacity
+        self.overrides = parse_capacities(overrides) if isinstance(overrides, str) else dict(overrides)
+        self.max_devices = max_devices
+        self.devices = OrderedDict()  # least recently updated first
+        self.reasons = {}
+        self.reason_text = []
+        self.ready = False
+        self.covered_from = None  # store-wide: devices not held are complete from here
+        self._pending = None  # rows received while seeding
+        # Bumped on every change a read could see; history_api's response cache keys on it
+        self.version = 0
+        self._stale = set()  # devices invalidated while seeding
+        self._generation = None
+        self._lock = threading.RLock()
+
+    # Feed (LiveFeed sink)
+    def subscribed(self):
+        """Live subscription acknowledged: seed from the DB in the background."""
+        with self._lock:
+            self.ready = False
+            self._pending = []
+            self.version += 1
+        threading.Thread(target=self._seed, name="hot-seed", daemon=True).start()
+
+    def disconnected(self):
+        with self._lock:
+            self.ready = False
+            self._pending = None
+            self.version += 1
+
+    def extend(self, rows):
+        with self._lock:
+            if self._pending is not None:
+                self._pending.extend(rows)
+            elif self.ready:
+                self._add(rows)
+                self.version += 1
+                self._update_gauges()
+
+    def invalidate(self, device_ids):
+        """Late readings rewrote these devices' recent rows: drop what we hold."""
+        with self._lock:
+            if self._pending is not None:
+                self._stale.update(device_ids)
+                return
+            if not self.ready:
+                return  # the next seed reads them from the DB
+            now = to_micros(datetime.utcnow())
+            for device_id in device_ids:
+                series = self._series(device_id)
+                series.clear(max(now, series.newest[0] + 1 if series.newest else 0))
+            self.version += 1
+
+    def _seed(self):
+        since = datetime.utcnow() - timedelta(seconds=self.window_secs)
+        generation = rewrite_version.current()
+        try:
+            rows = self.seed(since) if self.seed else []
+        except Exception as e:
+            log.error("❌ Hot store seed failed", error=e)
+            self.disconnected()
+            return
+        with self._lock:
+            if self._pending is None:  # disconnected meanwhile
+                return
+            # Rows committed while the seed query ran arrive on both paths
+            seen = {row[7] for row in rows}
+            rows.extend(row for row in self._pending if row[7] not in seen)
+            self._pending = None
+            self.devices.clear()
+            self.covered_from = to_micros(since)
+            self._generation = generation
+            self._add(rows)
+            self.ready = True
+            self.version += 1
+            stale, self._stale = self._stale, set()
+            self.invalidate(stale)
+        self._update_gauges()
+        log.info("🔥 Hot store seeded", rows=len(rows), devices=len(self.devices),
+                 window_secs=self.window_secs)
+
+    def _reason_code(self, text):
+        code = self.reasons.get(text)
+        if code is None:
+            if len(self.reason_text) >= np.iinfo(np.uint16).max:
+                return None
+            code = self.reasons[text] = len(self.reason_text)
+            self.reason_text.append(text)
+        return code
+
+    def _series(self, device_id):
+        series = self.devices.get(device_id)
+        if series is None:
+            if len(self.devices) >= self.max_devices:
+                _, evicted = self.devices.popitem(last=False)
+                if evicted.newest is not None:
+                    self.covered_from = max(self.covered_from, evicted.newest[0] + 1)
+            series = self.devices[device_id] = DeviceSeries(
+                self.overrides.get(device_id, self.capacity), self.covered_from)
+        else:
+            self.devices.move_to_end(device_id)
+        return series
+
+    def _add(self, rows):
+        for row in rows:
+            # LIVE_FIELDS + id; rows without an id come from an older subscriber
+            if len(row) < 8 or row[7] is None:
+                continue
+            device_id, ts_ms, temperature, vibration, rpm, risk, reasons, row_id = row[:8]
+            series = self._series(device_id)
+            reason = self._reason_code(reasons)
+            if reason is None:
+                series.clear(int(round(ts_ms * 1000)) + 1)
+                continue
+            series.append(int(round(ts_ms * 1000)), _number(temperature), _number(vibration),
+                          _number(rpm), _number(risk), reason, row_id)
+
+    def _update_gauges(self):
+        with self._lock:
+            hot_rows.set(sum(s.count for s in self.devices.values()))
+            hot_bytes.set(sum(s.nbytes for s in self.devices.values()))
+
+    # Reads
+    def _usable(self):
+        if not self.ready:
+            return False
+        if rewrite_version.current() != self._generation:
+            # Stored rows were rewritten (rescore.py): serve from the DB until re-seeded
+            self.ready = False
+            self._pending = []
+            self.version += 1
+            threading.Thread(target=self._seed, name="hot-seed", daemon=True).start()
+            return False
+        return True
+
+    def _covered(self, since_us, device_id):
+        if device_id is not None:
+            series = self.devices.get(device_id)
+            return since_us >= (series.covered_from if series else self.covered_from)
+        return all(since_us >= s.covered_from for s in self.devices.values()) \
+            and since_us >= self.covered_from
+
+    def _selected(self, device_id):
+        if device_id is not None:
+            series = self.devices.get(device_id)
+            return [(device_id, series)] if series is not None else []
+        return list(self.devices.items())
+
+    def _row(self, device_id, series, i):
+        return {
+            "id": int(series.ids[i]),
+            "device_id": device_id,
+            "temperature": _value(series.temperature[i]),
+            "vibration": _value(series.vibration[i]),
+            "rpm": _integer(series.rpm[i]),
+            "timestamp": from_micros(series.ts[i]).isoformat(),
+            "risk_probability": _value(series.risk[i]),
+            "risk_reasons": self.reason_text[series.reason[i]],
+        }
+
+    def latest(self, device_id=None):
+        """Newest reading (of the device) as a history row, or None to ask the DB."""
+        with self._lock:
+            if not self._usable():
+                return None
+            newest = None
+            for device, series in self._selected(device_id):
+                if series.count and (newest is None or series.newest > newest[0]):
+                    newest = (series.newest, device, series)
+            if newest is None:
+                return None
+            _, device, series = newest
+            return self._row(device, series, series.order()[-1])
+
+    def history(self, start, device_id=None, limit=1000):
+        """Raw rows since `start`, newest first (like /api/history), or None if not covered."""
+        since_us = to_micros(start)
+        with self._lock:
+            if not self._usable() or not self._covered(since_us, device_id):
+                return None
+            streams = []
+            for device, series in self._selected(device_id):
+                window = series.window(since_us)[::-1]
+                if len(window):
+                    streams.append(zip(series.ts[window].tolist(), series.ids[window].tolist(),
+                                       repeat(device), repeat(series), window.tolist()))
+            newest = heapq.merge(*streams, key=lambda item: item[:2], reverse=True)
+            return [self._row(device, series, i) for _, _, device, series, i in islice(newest, limit)]
+
+    def buckets(self, start, device_id, bucket_secs, agg, limit):
+        """Time-bucket aggregation (bucketed_history's shape), newest first, or None."""
+        since_us = to_micros(start)
+        with self._lock:
+            if not self._usable() or not self._covered(since_us, device_id):
+                return None
+            parts = [(series, series.window(since_us)) for _, series in self._selected(device_id)]
+            if not any(len(window) for _, window in parts):
+                return []
+            ts = np.concatenate([s.ts[w] for s, w in parts])
+            ids = np.concatenate([s.ids[w] for s, w in parts])
+            columns = {
+                "temperature": np.concatenate([s.temperature[w] for s, w in parts]),
+                "vibration": np.concatenate([s.vibration[w] for s, w in parts]),
+                "rpm": np.concatenate([s.rpm[w] for s, w in parts]),
+                "risk_probability": np.concatenate([s.risk[w] for s, w in parts]),
+            }
+            reasons = np.concatenate([s.reason[w] for s, w in parts])
+
+        # Group by bucket (seconds floor, as the SQL does), rows in time order within each
+        bucket = (ts // 1_000_000) // bucket_secs
+        order = np.lexsort((ids, ts, bucket))
+        bucket = bucket[order]
+        starts = np.flatnonzero(np.r_[True, bucket[1:] != bucket[:-1]])
+        ends = np.r_[starts[1:], len(bucket)]
+        keys = bucket[starts]
+        sorted_columns = {name: values[order] for name, values in columns.items()}
+
+        if agg == "last":
+            last = ends - 1
+            result = {name: values[last] for name, values in sorted_columns.items()}
+            result["risk_reasons"] = reasons[order][last]
+        else:
+            # NaN (NULL) values are skipped, as in SQL aggregates
+            if agg == "avg":
+                result = {}
+                for name, values in sorted_columns.items():
+                    present = np.add.reduceat(~np.isnan(values), starts)
+                    total = np.add.reduceat(np.nan_to_num(values), starts)
+                    with np.errstate(invalid="ignore", divide="ignore"):
+                        result[name] = np.where(present > 0, total / present, np.nan)
+            else:
+                reduce = np.fmin.reduceat if agg == "min" else np.fmax.reduceat
+                result = {name: reduce(values, starts) for name, values in sorted_columns.items()}
+            result["count"] = ends - starts
+
+        rows = []
+        for j in range(len(keys) - 1, max(len(keys) - 1 - limit, -1), -1):
+            row = {"timestamp": datetime.utcfromtimestamp(int(keys[j]) * bucket_secs).isoformat()}
+            for name in ("temperature", "vibration"):
+                row[name] = _value(result[name][j])
+            rpm = result["rpm"][j]
+            row["rpm"] = _value(rpm) if agg == "avg" else _integer(rpm)
+            row["risk_probability"] = _value(result["risk_probability"][j])
+            if agg == "last":
+                row["risk_reasons"] = self.reason_text[result["risk_reasons"][j]]
+            else:
+                row["count"] = int(result["count"][j])
+            rows.append(row)
+        return rows
+
+    def stats(self):
+        with self._lock:
+            return {
+                "ready": self.ready,
+                "devices": len(self.devices),
+                "rows": sum(s.count for s in self.devices.values()),
+                "bytes": sum(s.nbytes for s in self.devices.values()),
+                "covered_from": from_micros(self.covered_from).isoformat() if self.covered_from else None,
+            }
@@ -0,0 +1,215 @@
+"""
+Multi-core ingest: one dispatcher process and INGEST_WORKERS subscriber
+workers, each running mqtt_subscriber's pipeline (parse, score, batch
+write, alerts, live stream) for its share of the devices.
+
+    MQTT -> dispatcher (device_id from the topic, crc32 % N)
+         -> worker queue i -> worker i: parse -> BatchWriter -> DB / alerts
+
+All messages of a device go to the same worker through one FIFO queue,
+so the per-device state (excursion durations, late-reading detection,
+alert levels, rollups, compliance, ML window) lives in exactly one
+process and sees the device's readings in arrival order. Workers share
+nothing else: rows, rollups and compliance state are keyed by device.
+
+The dispatcher only reads the topic; payloads are parsed in the workers.
+A full worker queue blocks dispatch, as the single-process queue does. A
+worker that exits is restarted (with backoff) and rebuilds its excursion
+state from SQL and replays its spool (SPOOL_DIR/worker-<i>). It gets a
+new queue, since a process killed inside get() can leave the old one
+locked; readings still queued for the dead worker, or not yet spooled by
+it, are lost, as in a subscriber restart.
+
+MQTT shared subscriptions ($share/group/...) are not used: brokers
+spread them per message, so one device's readings would be scored by
+several workers out of order.
+
+Metrics: the dispatcher serves METRICS_PORT (dispatch counts, queue
+depth, restarts); worker i serves METRICS_PORT + 1 + i.
+
+Usage:
+    python ingest_workers.py [--workers 4]
+"""
+import os
+import sys
+import time
+import zlib
+import queue
+import signal
+import argparse
+import multiprocessing as mp
+from datetime import datetime
+import paho.mqtt.client as mqtt
+from dotenv import load_dotenv
+import mqtt_subscriber as sub
+from db import init_schema
+from spool import Spool, SPOOL_DIR
+from logs import get_logger
+import metrics
+
+load_dotenv()
+
+INGEST_WORKERS = int(os.getenv("INGEST_WORKERS", os.cpu_count() or 1))
+WORKER_QUEUE_SIZE = int(os.getenv("WORKER_QUEUE_SIZE", 10000))
+WORKER_RESTART_BACKOFF_SECS = float(os.getenv("WORKER_RESTART_BACKOFF_SECS", 1))
+WORKER_RESTART_BACKOFF_MAX_SECS = float(os.getenv("WORKER_RESTART_BACKOFF_MAX_SECS", 30))
+# A worker that stayed up this long is healthy again: backoff starts over
+WORKER_STABLE_SECS = 60
+
+log = get_logger("workers")
+
+
+def shard_of(device_id, workers):
+    """Stable across processes and restarts (unlike hash())."""
+    return zlib.crc32(device_id.encode()) % workers
+
+
+def worker_main(index, source):
+    """
+    One ingest worker: mqtt_subscriber's pipeline fed from `source`
+    ((topic, payload, epoch secs) tuples; None stops it after a drain).
+    """
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the supervisor coordinates shutdown
+    sub.client = mqtt.Client()  # publishes alerts and live rows; subscribes to nothing
+    sub.client.connect(sub.MQTT_BROKER, sub.MQTT_PORT, 60)
+    sub.client.loop_start()
+    sub.INIT_SCHEMA = False  # done once by the supervisor, not raced by N workers
+    try:
+        sub.warm_up()
+    except Exception as e:
+        log.error("❌ Worker startup failed", worker=index, error=e,
+                  hint="new database? run `python migrate.py init` or set INIT_SCHEMA=1")
+        sys.exit(1)
+    # Each worker replays its own spool: same index, same devices
+    spool = Spool(os.path.join(SPOOL_DIR, f"worker-{index}")) if SPOOL_DIR else None
+    writer = sub.BatchWriter(sub.ingest_queue, spool=spool)
+    writer.start()
+    if sub.notifier.enabled:
+        sub.notifier.start()
+    metrics.start_metrics_server(port=metrics.METRICS_PORT + 1 + index)
+    log.info("✅ Worker consuming", worker=index, pid=os.getpid(),
+             startup_ms=round((time.perf_counter() - sub.IMPORT_STARTED) * 1000))
+
+    try:
+        while True:
+            item = source.get()
+            if item is None:
+                break
+            topic, payload, received = item
+            sub.enqueue_message(topic, payload, datetime.utcfromtimestamp(received))
+    finally:
+        log.info("🛑 Worker draining", worker=index, queued=sub.ingest_queue.qsize())
+        writer.stop()
+        sub.notifier.stop(timeout=10)
+        sub.client.disconnect()
+        sub.client.loop_stop()
+
+
+class Supervisor:
+    """Dispatches messages by device and keeps the worker processes running."""
+
+    def __init__(self, workers=INGEST_WORKERS, queue_size=WORKER_QUEUE_SIZE):
+        # spawn: workers start from a clean interpreter (no inherited threads or sockets)
+        self.ctx = mp.get_context("spawn")
+        self.queue_size = queue_size
+        self.queues = [self.ctx.Queue(maxsize=queue_size) for _ in range(workers)]
+        self.procs = [None] * workers
+        self.started = [0.0] * workers
+        self.backoff = [WORKER_RESTART_BACKOFF_SECS] * workers
+        self.restart_at = [0.0] * workers
+        self.stopping = False
+
+    def start_worker(self, index):
+        proc = self.ctx.Process(target=worker_main, args=(index, self.queues[index]),
+                                name=f"ingest-worker-{index}", daemon=False)
+        proc.start()
+        self.procs[index] = proc
+        self.started[index] = time.monotonic()
+
+    def check_workers(self):
+        """Restarts exited workers, backing off when one keeps dying."""
+        now = time.monotonic()
+        for index, proc in enumerate(self.procs):
+            metrics.worker_queue_depth.set(self.queues[index].qsize(), worker=str(index))
+            if proc.is_alive():
+                if now - self.started[index] > WORKER_STABLE_SECS:
+                    self.backoff[index] = WORKER_RESTART_BACKOFF_SECS
+                continue
+            if not self.restart_at[index]:
+                self.restart_at[index] = now + self.backoff[index]
+                log.error("❌ Worker exited", worker=index, exitcode=proc.exitcode,
+                          restart_in=self.backoff[index], dropped=self.queues[index].qsize())
+                self.backoff[index] = min(self.backoff[index] * 2, WORKER_RESTART_BACKOFF_MAX_SECS)
+                self.queues[index] = self.ctx.Queue(maxsize=self.queue_size)
+            elif now >= self.restart_at[index]:
+                self.restart_at[index] = 0.0
+                metrics.worker_restarts_total.inc(worker=str(index))
+                self.start_worker(index)
+
+    def dispatch(self, topic, payload):
+        index = shard_of(sub.device_id_from_topic(topic), len(self.queues))
+        item = (topic, payload, time.time())
+        # Blocks while that worker falls behind (backpressure on the network
+        # loop); re-reads the queue in case the worker was replaced meanwhile
+        while True:
+            try:
+                self.queues[index].put(item, timeout=1)
+                break
+            except queue.Full:
+                continue
+        metrics.dispatched_total.inc(worker=str(index))
+
+    def on_connect(self, client, userdata, flags, rc):
+        log.info("📡 Dispatcher connected", rc=rc, workers=len(self.queues))
+        client.subscribe([(sub.MQTT_TOPIC, 0), (sub.MQTT_BINARY_TOPIC, 0), (sub.MQTT_LEGACY_TOPIC, 0)])
+
+    def on_message(self, client, userdata, msg):
+        self.dispatch(msg.topic, msg.payload)
+
+    def stop(self, signum=None, frame=None):
+        self.stopping = True
+
+    def run(self):
+        if sub.INIT_SCHEMA:
+            init_schema()
+        for index in range(len(self.procs)):
+            self.start_worker(index)
+        signal.signal(signal.SIGTERM, self.stop)
+        metrics.start_metrics_server()
+
+        client = mqtt.Client()
+        client.on_connect = self.on_connect
+        client.on_message = self.on_message
+        log.info("🚀 Connecting dispatcher", broker=f"{sub.MQTT_BROKER}:{sub.MQTT_PORT}", workers=len(self.procs),
+                 metrics=f"http://{metrics.METRICS_HOST}:{metrics.METRICS_PORT}/metrics")
+        try:
+            client.connect(sub.MQTT_BROKER, sub.MQTT_PORT, 60)
+            client.loop_start()
+            while not self.stopping:
+                self.check_workers()
+                time.sleep(1)
+        except KeyboardInterrupt:
+            pass
+        except Exception as e:
+            log.error("❌ Connection failed", error=e)
+        finally:
+            client.disconnect()
+            client.loop_stop()
+            self.shutdown()
+
+    def shutdown(self):
+        """Stops dispatching, lets every worker drain its queue and exit."""
+        log.info("🛑 Draining workers", queued=sum(q.qsize() for q in self.queues))
+        for index, proc in enumerate(self.procs):
+            if proc is not None and proc.is_alive():
+                self.queues[index].put(None)
+        for proc in self.procs:
+            if proc is not None:
+                proc.join()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Sharded multi-process MQTT ingest")
+    parser.add_argument("--workers", type=int, default=INGEST_WORKERS)
+    args = parser.parse_args()
+    Supervisor(args.workers).run()
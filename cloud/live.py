@@ -0,0 +1,212 @@
+"""
+Server-push fan-out of scored readings for the dashboard.
+
+The subscriber publishes every committed batch once on MQTT_LIVE_TOPIC.
+history_api holds a single subscription to it (LiveFeed) and appends the
+rows to an in-process ring buffer; each /api/stream client gets a snapshot
+from the buffer followed by deltas, so N viewers cost one upstream
+subscription and no history queries.
+
+Rows are compact lists in LIVE_FIELDS order, timestamps in epoch ms
+(fractional below 1 ms, so they round-trip to the stored microseconds).
+Other consumers of the topic register as sinks (hot.py); the subscriber
+also names devices whose recent rows late readings rewrote on
+LIVE_LATE_TOPIC.
+"""
+import os
+import json
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+import paho.mqtt.client as mqtt
+from logs import get_logger
+import metrics
+
+MQTT_LIVE_TOPIC = os.getenv("MQTT_LIVE_TOPIC", "cargo/coldchain/live")
+LIVE_LATE_TOPIC = MQTT_LIVE_TOPIC + "/late"
+LIVE_BUFFER_SIZE = int(os.getenv("LIVE_BUFFER_SIZE", 5000))
+LIVE_HEARTBEAT_SECS = float(os.getenv("LIVE_HEARTBEAT_SECS", 15))
+
+LIVE_FIELDS = ("device_id", "timestamp", "temperature", "vibration", "rpm",
+               "risk_probability", "risk_reasons", "id")
+EPOCH = datetime(1970, 1, 1)
+
+log = get_logger("live")
+
+stream_clients = metrics.registry.gauge(
+    "coldchain_stream_clients", "Connected /api/stream clients")
+stream_rows_total = metrics.registry.counter(
+    "coldchain_stream_rows_received_total", "Rows received from the live topic")
+
+
+def live_row(device_id, timestamp, temperature, vibration, rpm, risk_probability, risk_reasons, row_id=None):
+    """One reading in LIVE_FIELDS order (naive UTC datetime -> epoch ms)."""
+    epoch_us = (timestamp - EPOCH) // timedelta(microseconds=1)
+    epoch_ms = epoch_us // 1000 if epoch_us % 1000 == 0 else epoch_us / 1000
+    return [device_id, epoch_ms, temperature, vibration, rpm, risk_probability, risk_reasons, row_id]
+
+
+class RingBuffer:
+    """
+    Last `size` rows, each tagged with a monotonically increasing sequence
+    number. Readers block in wait() and pick up everything after the last
+    sequence they saw; a reader that fell behind the buffer is told so
+    (gap) and should resynchronise from a fresh snapshot.
+    """
+
+    def __init__(self, size=LIVE_BUFFER_SIZE):
+        self.rows = deque(maxlen=size)
+        self.seq = 0
+        self._cond = threading.Condition()
+
+    def extend(self, rows):
+        with self._cond:
+            for row in rows:
+                self.seq += 1
+                self.rows.append((self.seq, row))
+            self._cond.notify_all()
+
+    def wait(self, seq, timeout):
+        """Blocks until rows newer than `seq` exist; False on timeout."""
+        with self._cond:
+            return self._cond.wait_for(lambda: self.seq > seq, timeout)
+
+    def snapshot(self, device_id=None, limit=None):
+        """(rows, seq): the newest `limit` rows, oldest first."""
+        with self._cond:
+            rows = [row for _, row in self.rows if device_id is None or row[0] == device_id]
+            seq = self.seq
+        if limit is not None:
+            rows = rows[-limit:] if limit > 0 else []
+        return rows, seq
+
+    def since(self, seq, device_id=None):
+        """(rows, seq, gap): rows after `seq`; gap=True if some were evicted."""
+        with self._cond:
+            first = self.rows[0][0] if self.rows else self.seq + 1
+            # seq ahead of us: the id came from before an API restart
+            gap = seq < first - 1 or seq > self.seq
+            rows = [row for s, row in self.rows
+                    if s > seq and (device_id is None or row[0] == device_id)]
+            return rows, self.seq, gap
+
+
+class LiveFeed:
+    """
+    One MQTT subscription to MQTT_LIVE_TOPIC feeding a RingBuffer. Started
+    once at API startup; `seed` (a callable returning recent rows, oldest
+    first) warms the buffer so the first snapshot is not empty.
+    """
+
+    def __init__(self, broker, port, topic=MQTT_LIVE_TOPIC, size=LIVE_BUFFER_SIZE, seed=None, sinks=()):
+        self.broker = broker
+        self.port = port
+        self.topic = topic
+        self.late_topic = topic + "/late"
+        self.buffer = RingBuffer(size)
+        self.seed = seed
+        # Also fed every row: subscribed(), extend(rows), invalidate(device_ids), disconnected()
+        self.sinks = list(sinks)
+        self.client = None
+        self._lock = threading.Lock()
+
+    def start(self):
+        with self._lock:
+            if self.client is not None:
+                return
+            if self.seed:
+                try:
+                    self.buffer.extend(self.seed(self.buffer.rows.maxlen))
+                except Exception as e:
+                    log.error("❌ Could not seed live buffer", error=e)
+            self.client = mqtt.Client()
+            self.client.on_connect = self.on_connect
+            self.client.on_subscribe = self.on_subscribe
+            self.client.on_disconnect = self.on_disconnect
+            self.client.on_message = self.on_message
+            self.client.connect_async(self.broker, self.port, 60)
+            self.client.loop_start()
+
+    def forked(self):
+        """In a forked child: forgets the parent's client, whose loop thread did not survive."""
+        self._lock = threading.Lock()
+        self.client = None
+
+    @property
+    def running(self):
+        return self.client is not None
+
+    def stop(self):
+        with self._lock:
+            if self.client is not None:
+                self.client.loop_stop()
+                self.client.disconnect()
+                self.client = None
+
+    def on_connect(self, client, userdata, flags, rc):
+        log.info("📡 Live feed connected", topic=self.topic, rc=rc)
+        client.subscribe([(self.topic, 0), (self.late_topic, 0)])
+
+    def on_subscribe(self, client, userdata, mid, granted_qos):
+        # From here on every committed row reaches the sinks
+        for sink in self.sinks:
+            sink.subscribed()
+
+    def on_disconnect(self, client, userdata, rc):
+        log.warning("⚠️ Live feed disconnected", topic=self.topic, rc=rc)
+        for sink in self.sinks:
+            sink.disconnected()
+
+    def on_message(self, client, userdata, msg):
+        try:
+            rows = json.loads(msg.payload)
+        except (json.JSONDecodeError, UnicodeDecodeError):
+            log.warning("⚠️ Malformed live message", topic=msg.topic)
+            return
+        if msg.topic == self.late_topic:
+            for sink in self.sinks:
+                sink.invalidate(rows)
+            return
+        stream_rows_total.inc(len(rows))
+        self.buffer.extend(rows)
+        for sink in self.sinks:
+            sink.extend(rows)
+
+
+def sse_event(event, seq, rows):
+    """Server-Sent Events frame; `id` lets EventSource resume via Last-Event-ID."""
+    return f"event: {event}\nid: {seq}\ndata: {json.dumps(rows, separators=(',', ':'))}\n\n"
+
+
+def stream_events(buffer, device_id=None, snapshot_size=500, last_event_id=None,
+                  heartbeat=LIVE_HEARTBEAT_SECS):
+    """
+    SSE generator: `snapshot` (the newest rows, or the rows missed since
+    Last-Event-ID when still buffered) then `delta` frames as rows arrive,
+    with comment heartbeats to keep proxies from closing idle connections.
+    """
+    stream_clients.inc()
+    try:
+        yield f"retry: 3000\nevent: fields\ndata: {json.dumps(LIVE_FIELDS)}\n\n"
+        rows, seq, gap = [], None, True
+        if last_event_id is not None:
+            rows, seq, gap = buffer.since(last_event_id, device_id)
+        if gap:
+            rows, seq = buffer.snapshot(device_id, snapshot_size)
+            yield sse_event("snapshot", seq, rows)
+        elif rows:
+            yield sse_event("delta", seq, rows)
+
+        while True:
+            if not buffer.wait(seq, heartbeat):
+                yield ": keepalive\n\n"
+                continue
+            rows, new_seq, gap = buffer.since(seq, device_id)
+            if gap:
+                rows, new_seq = buffer.snapshot(device_id, snapshot_size)
+                yield sse_event("snapshot", new_seq, rows)
+            elif rows:
+                yield sse_event("delta", new_seq, rows)
+            seq = new_seq
+    finally:
+        stream_clients.dec()
@@ -0,0 +1,112 @@
+"""
+Leveled, rate-limited structured logging for the cloud services.
+
+    log = get_logger("subscriber")
+    log.info("✅ Batch processed", readings=200, commit_ms=4.1)
+
+Keyword arguments become fields: `key=value` pairs after the message
+(LOG_FORMAT=text, default) or JSON object keys (LOG_FORMAT=json). Each
+call site (logger + message) may emit LOG_RATE_LIMIT records per second
+with bursts up to LOG_RATE_BURST; the excess is dropped and reported as
+`suppressed=N` on the next record that gets through.
+"""
+import os
+import sys
+import json
+import time
+import logging
+import threading
+
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+LOG_FORMAT = os.getenv("LOG_FORMAT", "text")
+LOG_RATE_LIMIT = float(os.getenv("LOG_RATE_LIMIT", 5))
+LOG_RATE_BURST = int(os.getenv("LOG_RATE_BURST", 20))
+
+_RESERVED = {"exc_info", "stack_info", "stacklevel", "extra"}
+
+
+class RateLimitFilter(logging.Filter):
+    """Token bucket per call site (logger name + message template)."""
+
+    def __init__(self, rate=LOG_RATE_LIMIT, burst=LOG_RATE_BURST):
+        super().__init__()
+        self.rate = rate
+        self.burst = burst
+        self._buckets = {}
+        self._lock = threading.Lock()
+
+    def filter(self, record):
+        if self.rate <= 0:
+            return True
+        key = (record.name, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            tokens, last, suppressed = self._buckets.get(key, (self.burst, now, 0))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now, suppressed + 1)
+                return False
+            self._buckets[key] = (tokens - 1, now, 0)
+        if suppressed:
+            record.fields = {**getattr(record, "fields", {}), "suppressed": suppressed}
+        return True
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record):
+        line = (f"{self.formatTime(record, '%Y-%m-%dT%H:%M:%S')} {record.levelname:<7} "
+                f"{record.name}: {record.getMessage()}")
+        fields = getattr(record, "fields", None)
+        if fields:
+            line += " " + " ".join(f"{key}={value}" for key, value in fields.items())
+        if record.exc_info:
+            line += "\n" + self.formatException(record.exc_info)
+        return line
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            "ts": record.created,
+            "level": record.levelname.lower(),
+            "logger": record.name,
+            "msg": record.getMessage(),
+            **getattr(record, "fields", {}),
+        }
+        if record.exc_info:
+            entry["exc"] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class StructuredLogger(logging.LoggerAdapter):
+    """Moves keyword arguments into the record's `fields`."""
+
+    def process(self, msg, kwargs):
+        fields = {key: kwargs.pop(key) for key in list(kwargs) if key not in _RESERVED}
+        kwargs.setdefault("extra", {})["fields"] = fields
+        return msg, kwargs
+
+
+_configured = False
+_configure_lock = threading.Lock()
+
+
+def configure(level=LOG_LEVEL, fmt=LOG_FORMAT, stream=None):
+    """Installs the handler on the "coldchain" logger (once per process)."""
+    global _configured
+    with _configure_lock:
+        if _configured:
+            return
+        handler = logging.StreamHandler(stream or sys.stdout)
+        handler.setFormatter(JsonFormatter() if fmt == "json" else TextFormatter())
+        handler.addFilter(RateLimitFilter())
+        root = logging.getLogger("coldchain")
+        root.addHandler(handler)
+        root.setLevel(level)
+        root.propagate = False
+        _configured = True
+
+
+def get_logger(name):
+    configure()
+    return StructuredLogger(logging.getLogger(f"coldchain.{name}"), {})
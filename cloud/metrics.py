@@ -0,0 +1,266 @@
+"""
+Prometheus-style counters, gauges and histograms for the cloud services.
+
+Rendered in the Prometheus text exposition format (no client library):
+history_api serves them on GET /metrics, mqtt_subscriber and async_ingest
+start a small HTTP listener on METRICS_HOST:METRICS_PORT.
+"""
+import os
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", 9108))
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds; 0.5 ms .. 10 s covers parse (µs) through slow commits
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 5, 10, 25, 50, 100, 200, 500, 1000, 5000, 10000)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=()):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    pairs += [f'{name}="{_escape(value)}"' for name, value in extra]
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self):
+        """[(suffix, label_values, extra_labels, value)] for rendering."""
+        with self._lock:
+            return [("", key, (), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, key, extra, value in self.samples():
+            lines.append(f"{self.name}{suffix}{_format_labels(self.labelnames, key, extra)} "
+                         f"{_format_value(value)}")
+        return "\n".join(lines)
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+
+class Gauge(Metric):
+    kind = "gauge"
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+    def set_function(self, function):
+        """Computes the (unlabelled) value at scrape time, e.g. a queue depth."""
+        self.function = function
+
+    def samples(self):
+        if self.function is not None:
+            return [("", (), (), self.function())]
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                # per-bucket (non-cumulative) counts, +Inf last, then sum
+                state = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][bisect.bisect_left(self.buckets, value)] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def samples(self):
+        with self._lock:
+            snapshot = [(key, list(counts), total) for key, (counts, total) in self._values.items()]
+        samples = []
+        for key, counts, total in snapshot:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                samples.append(("_bucket", key, (("le", _format_value(float(bound))),), cumulative))
+            samples.append(("_sum", key, (), total))
+            samples.append(("_count", key, (), cumulative))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            if metric.name in self._metrics:
+                raise ValueError(f"Duplicate metric {metric.name}")
+            self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=(), function=None):
+        return self.register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return "\n".join(metric.render() for metric in metrics) + "\n"
+
+
+registry = Registry()
+
+# Ingest (mqtt_subscriber / async_ingest)
+messages_total = registry.counter(
+    "coldchain_ingest_messages_total", "MQTT messages received, by outcome", ("result",))
+parse_seconds = registry.histogram(
+    "coldchain_ingest_parse_seconds", "Time to decode one MQTT payload")
+queue_depth = registry.gauge(
+    "coldchain_ingest_queue_depth", "Messages accepted but not yet handed to the batch writer / readings still in flight (async)")
+batch_size = registry.histogram(
+    "coldchain_ingest_batch_size", "Readings per persisted batch", buckets=SIZE_BUCKETS)
+risk_eval_seconds = registry.histogram(
+    "coldchain_risk_eval_seconds", "Risk scoring time per call, batch or single reading (excursion tracking included)")
+db_commit_seconds = registry.histogram(
+    "coldchain_db_commit_seconds", "Batch write latency, first INSERT to COMMIT (scoring excluded)")
+batches_total = registry.counter(
+    "coldchain_ingest_batches_total", "Persisted batches, by outcome", ("result",))
+publish_failures_total = registry.counter(
+    "coldchain_ingest_publish_failures_total", "Committed batches whose alert / live-stream publish failed")
+alert_publish_seconds = registry.histogram(
+    "coldchain_alert_publish_seconds", "Time to hand one alert to the MQTT client")
+duplicate_readings_total = registry.counter(
+    "coldchain_ingest_duplicate_readings_total", "Readings dropped as already stored (same device_id + seq)")
+late_readings_total = registry.counter(
+    "coldchain_ingest_late_readings_total", "Readings older than their device's newest scored reading")
+rescored_rows_total = registry.counter(
+    "coldchain_ingest_rescored_rows_total", "Assessments recomputed because late readings landed before them")
+compliance_recomputed_total = registry.counter(
+    "coldchain_compliance_recomputed_total", "Shipment/device compliance states replayed because of late readings")
+startup_seconds = registry.gauge(
+    "coldchain_startup_seconds", "Time spent in each startup phase (import, warm_up)", ("phase",))
+
+# Sharded ingest supervisor (ingest_workers.py)
+dispatched_total = registry.counter(
+    "coldchain_ingest_dispatched_total", "Messages handed to each ingest worker", ("worker",))
+worker_queue_depth = registry.gauge(
+    "coldchain_ingest_worker_queue_depth", "Messages dispatched but not yet taken by the worker", ("worker",))
+worker_restarts_total = registry.counter(
+    "coldchain_ingest_worker_restarts_total", "Ingest worker processes restarted after exiting", ("worker",))
+
+# Ingest spool (spool.py)
+spool_pending_readings = registry.gauge(
+    "coldchain_spool_pending_readings", "Spooled readings not yet committed to the database")
+spool_replay_lag_seconds = registry.gauge(
+    "coldchain_spool_replay_lag_seconds", "Age of the oldest spooled batch not yet committed (0 when caught up)")
+spool_bytes = registry.gauge(
+    "coldchain_spool_bytes", "Size of the spool segment files")
+spool_fsync_seconds = registry.histogram(
+    "coldchain_spool_fsync_seconds", "Time to fsync one appended batch")
+spool_replayed_readings_total = registry.counter(
+    "coldchain_spool_replayed_readings_total", "Readings committed from the spool after an outage or restart")
+
+# Alerts (alerts.py / notify.py)
+alerts_published_total = registry.counter(
+    "coldchain_alerts_published_total", "Alert topic messages, by level and kind (transition|heartbeat)",
+    ("level", "kind"))
+notifications_total = registry.counter(
+    "coldchain_notifications_total", "Alerts handed to a notification sink, by outcome", ("sink", "result"))
+notify_seconds = registry.histogram(
+    "coldchain_notify_seconds", "Time per notification send attempt", ("sink",))
+notify_queue_depth = registry.gauge(
+    "coldchain_notify_queue_depth", "Alerts waiting for the notification dispatcher")
+
+# API (history_api)
+api_request_seconds = registry.histogram(
+    "coldchain_api_request_seconds", "API request latency", ("endpoint", "method", "status"))
+api_rows_returned = registry.histogram(
+    "coldchain_api_rows_returned", "Rows serialized per API response", ("endpoint",),
+    buckets=SIZE_BUCKETS)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # scrapes are not worth a log line
+
+
+def start_metrics_server(host=METRICS_HOST, port=METRICS_PORT):
+    """Serves GET /metrics from a daemon thread; returns the server."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
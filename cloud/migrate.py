@@ -0,0 +1,283 @@
+"""
+Versioned schema migrations for the cold chain database.
+
+Usage:
+    python migrate.py init                # create missing tables from the models, then upgrade
+    python migrate.py status              # list applied / pending migrations
+    python migrate.py upgrade             # apply all pending migrations
+    python migrate.py partition [--months-ahead 3]
+                                          # (PostgreSQL) convert sensor_data to monthly
+                                          # range partitions / create upcoming ones
+
+Applied versions are recorded in the `schema_migrations` table. Every
+migration is idempotent so it is safe against databases that were created
+by `Base.metadata.create_all` or by schema.sql. The services never create
+tables on import; run `init` once per database (or start them with
+INIT_SCHEMA=1).
+"""
+import os
+import argparse
+from datetime import datetime
+from dotenv import load_dotenv
+from sqlalchemy import create_engine, inspect, text
+from rollups import metadata as rollups_metadata
+from compliance import metadata as compliance_metadata
+
+load_dotenv()
+
+DB_URL = os.getenv("DATABASE_URL", "sqlite:///./coldchain.db")
+
+# The one dedupe key for store-and-forward ingest (INSERT ... ON CONFLICT DO
+# NOTHING), identical on SQLite, plain and partitioned PostgreSQL; db.py
+# declares the same index. timestamp is part of it because device seq
+# counters restart at 0 after a reboot, and because PostgreSQL needs the
+# partition key in every unique index.
+SEQ_DEDUPE_INDEX = (
+    "CREATE UNIQUE INDEX IF NOT EXISTS ux_sensor_data_device_seq "
+    "ON sensor_data (device_id, seq, timestamp) WHERE seq IS NOT NULL"
+)
+
+
+def _create_tables(conn, dialect):
+    pk = "SERIAL PRIMARY KEY" if dialect == "postgresql" else "INTEGER PRIMARY KEY AUTOINCREMENT"
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS sensor_data (
+            id {pk},
+            temperature FLOAT NOT NULL,
+            vibration FLOAT NOT NULL,
+            rpm FLOAT NOT NULL,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+    conn.execute(text(f"""
+        CREATE TABLE IF NOT EXISTS risk_assessments (
+            id {pk},
+            sensor_data_id INTEGER REFERENCES sensor_data(id),
+            risk_probability FLOAT NOT NULL,
+            risk_reasons TEXT,
+            timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """))
+
+
+def _add_device_columns(conn, dialect):
+    columns = {
+        "sensor_data": [("device_id", "VARCHAR NOT NULL DEFAULT 'default'"),
+                        ("shipment_id", "VARCHAR")],
+        "risk_assessments": [("device_id", "VARCHAR NOT NULL DEFAULT 'default'")],
+    }
+    inspector = inspect(conn)
+    for table, additions in columns.items():
+        existing = {col["name"] for col in inspector.get_columns(table)}
+        for name, ddl in additions:
+            if name not in existing:
+                conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {name} {ddl}"))
+
+
+def _add_indexes(conn, dialect):
+    statements = [
+        # History range filters and ORDER BY timestamp
+        "CREATE INDEX IF NOT EXISTS ix_sensor_data_timestamp ON sensor_data (timestamp)",
+        # Per-device history / latest
+        "CREATE INDEX IF NOT EXISTS ix_sensor_data_device_timestamp ON sensor_data (device_id, timestamp)",
+        "CREATE INDEX IF NOT EXISTS ix_risk_assessments_device_timestamp ON risk_assessments (device_id, timestamp)",
+        # JOIN risk_assessments ON sensor_data_id
+        "CREATE INDEX IF NOT EXISTS ix_risk_assessments_sensor_data_id ON risk_assessments (sensor_data_id)",
+        # "Last compliant reading" lookups (excursion rebuild) only touch 2-8 °C rows
+        "CREATE INDEX IF NOT EXISTS ix_sensor_data_compliant ON sensor_data (device_id, timestamp) "
+        "WHERE temperature >= 2.0 AND temperature <= 8.0",
+    ]
+    for statement in statements:
+        conn.execute(text(statement))
+    if dialect == "postgresql":
+        conn.execute(text("ANALYZE sensor_data"))
+        conn.execute(text("ANALYZE risk_assessments"))
+
+
+def _create_rollups(conn, dialect):
+    rollups_metadata.create_all(conn)
+
+
+def _create_compliance(conn, dialect):
+    compliance_metadata.create_all(conn)
+
+
+def _add_seq_dedupe(conn, dialect):
+    existing = {col["name"] for col in inspect(conn).get_columns("sensor_data")}
+    if "seq" not in existing:
+        conn.execute(text("ALTER TABLE sensor_data ADD COLUMN seq BIGINT"))
+    # Idempotent store-and-forward ingest: INSERT ... ON CONFLICT DO NOTHING
+    conn.execute(text(SEQ_DEDUPE_INDEX))
+
+
+def _add_timestamp_to_seq_dedupe(conn, dialect):
+    # Databases migrated before 0007 carry the old (device_id, seq) index,
+    # which dropped every reading after a device reboot as a duplicate
+    conn.execute(text("DROP INDEX IF EXISTS ux_sensor_data_device_seq"))
+    conn.execute(text(SEQ_DEDUPE_INDEX))
+
+
+# (version, description, function(conn, dialect)) - append only, never reorder
+MIGRATIONS = [
+    (1, "baseline tables", _create_tables),
+    (2, "device_id / shipment_id columns", _add_device_columns),
+    (3, "timestamp, foreign key and compliant-reading indexes", _add_indexes),
+    (4, "sensor_rollups (1-minute / 1-hour aggregates)", _create_rollups),
+    (5, "sensor_data.seq + dedupe index", _add_seq_dedupe),
+    (6, "shipment_compliance (per-shipment compliance state)", _create_compliance),
+    (7, "dedupe index on (device_id, seq, timestamp)", _add_timestamp_to_seq_dedupe),
+]
+
+
+def _ensure_version_table(conn):
+    conn.execute(text("""
+        CREATE TABLE IF NOT EXISTS schema_migrations (
+            version INTEGER PRIMARY KEY,
+            description VARCHAR,
+            applied_at TIMESTAMP
+        )
+    """))
+
+
+def applied_versions(engine):
+    with engine.begin() as conn:
+        _ensure_version_table(conn)
+        return {row[0] for row in conn.execute(text("SELECT version FROM schema_migrations"))}
+
+
+def upgrade(engine):
+    """Applies pending migrations in order, each in its own transaction."""
+    done = applied_versions(engine)
+    pending = [m for m in MIGRATIONS if m[0] not in done]
+    for version, description, apply in pending:
+        with engine.begin() as conn:
+            apply(conn, engine.dialect.name)
+            conn.execute(
+                text("INSERT INTO schema_migrations (version, description, applied_at) "
+                     "VALUES (:v, :d, :t)"),
+                {"v": version, "d": description, "t": datetime.utcnow()},
+            )
+        print(f"✅ Applied migration {version:04d}: {description}")
+    if not pending:
+        print("✅ Schema is up to date")
+    return [m[0] for m in pending]
+
+
+def status(engine):
+    done = applied_versions(engine)
+    for version, description, _ in MIGRATIONS:
+        mark = "applied" if version in done else "pending"
+        print(f"{version:04d} [{mark}] {description}")
+
+
+def _month_start(dt):
+    return datetime(dt.year, dt.month, 1)
+
+
+def _next_month(dt):
+    return datetime(dt.year + (dt.month == 12), dt.month % 12 + 1, 1)
+
+
+def ensure_partitions(conn, start, months_ahead):
+    """Creates monthly partitions sensor_data_YYYYMM from `start` until
+    `months_ahead` months past the current month."""
+    month = _month_start(start)
+    last = _month_start(datetime.utcnow())
+    for _ in range(months_ahead):
+        last = _next_month(last)
+    while month <= last:
+        upper = _next_month(month)
+        conn.execute(text(
+            f"CREATE TABLE IF NOT EXISTS sensor_data_{month:%Y%m} PARTITION OF sensor_data "
+            f"FOR VALUES FROM ('{month:%Y-%m-%d}') TO ('{upper:%Y-%m-%d}')"
+        ))
+        month = upper
+
+
+def partition(engine, months_ahead=3):
+    """
+    PostgreSQL: converts sensor_data into a table range-partitioned by month
+    on timestamp (first run), then keeps creating upcoming partitions (run it
+    monthly). Old months can later be detached/dropped in O(1).
+
+    PostgreSQL requires the partition key in every unique constraint, so the
+    primary key becomes (id, timestamp) and the risk_assessments foreign key
+    is dropped; sensor_data_id stays indexed. The seq dedupe index
+    (SEQ_DEDUPE_INDEX) already includes timestamp and is recreated as is, so
+    ingest dedupes identically before and after partitioning.
+
+    SQLite has no native partitioning; the indexes from migration 0003 are the
+    fallback there, so this command is a no-op.
+    """
+    if engine.dialect.name != "postgresql":
+        print("ℹ️ Native partitioning needs PostgreSQL; SQLite relies on the 0003 indexes.")
+        return False
+
+    with engine.begin() as conn:
+        is_partitioned = conn.execute(text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table p "
+            "JOIN pg_class c ON c.oid = p.partrelid WHERE c.relname = 'sensor_data')"
+        )).scalar()
+
+        if is_partitioned:
+            oldest = conn.execute(text("SELECT min(timestamp) FROM sensor_data")).scalar()
+            ensure_partitions(conn, oldest or datetime.utcnow(), months_ahead)
+            print("✅ sensor_data partitions are up to date")
+            return True
+
+        conn.execute(text("ALTER TABLE risk_assessments DROP CONSTRAINT IF EXISTS risk_assessments_sensor_data_id_fkey"))
+        conn.execute(text("ALTER TABLE sensor_data RENAME TO sensor_data_unpartitioned"))
+        conn.execute(text("""
+            CREATE TABLE sensor_data (
+                id INTEGER NOT NULL DEFAULT nextval('sensor_data_id_seq'),
+                device_id VARCHAR NOT NULL DEFAULT 'default',
+                shipment_id VARCHAR,
+                seq BIGINT,
+                temperature FLOAT NOT NULL,
+                vibration FLOAT NOT NULL,
+                rpm FLOAT NOT NULL,
+                timestamp TIMESTAMP NOT NULL DEFAULT CURRENT_TIMESTAMP,
+                PRIMARY KEY (id, timestamp)
+            ) PARTITION BY RANGE (timestamp)
+        """))
+        conn.execute(text("ALTER SEQUENCE sensor_data_id_seq OWNED BY sensor_data.id"))
+
+        oldest = conn.execute(text("SELECT min(timestamp) FROM sensor_data_unpartitioned")).scalar()
+        ensure_partitions(conn, oldest or datetime.utcnow(), months_ahead)
+
+        conn.execute(text(
+            "INSERT INTO sensor_data (id, device_id, shipment_id, seq, temperature, vibration, rpm, timestamp) "
+            "SELECT id, device_id, shipment_id, seq, temperature, vibration, rpm, "
+            "COALESCE(timestamp, CURRENT_TIMESTAMP) FROM sensor_data_unpartitioned"
+        ))
+        conn.execute(text("DROP TABLE sensor_data_unpartitioned"))
+
+        # Partitioned parents propagate these to every partition
+        _add_indexes(conn, engine.dialect.name)
+        conn.execute(text(SEQ_DEDUPE_INDEX))
+    print("✅ sensor_data converted to monthly range partitions")
+    return True
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Cold chain schema migrations")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("init")
+    sub.add_parser("status")
+    sub.add_parser("upgrade")
+    part = sub.add_parser("partition")
+    part.add_argument("--months-ahead", type=int, default=3)
+    args = parser.parse_args()
+
+    engine = create_engine(DB_URL)
+    if args.command == "init":
+        from db import init_schema
+        init_schema(engine)
+        print("✅ Model tables present (existing ones untouched)")
+        upgrade(engine)
+    elif args.command == "status":
+        status(engine)
+    elif args.command == "upgrade":
+        upgrade(engine)
+    else:
+        partition(engine, args.months_ahead)
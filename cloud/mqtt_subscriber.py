@@ -1,180 +1,636 @@
 import os
 import json
 import time
-import requests
-from google.cloud import firestore
-from datetime import datetime
+IMPORT_STARTED = time.perf_counter()
+import queue
+import signal
+import threading
+import numpy as np
+from functools import partial
+import paho.mqtt.client as mqtt
+from datetime import datetime, timedelta
 from dotenv import load_dotenv
-from sqlalchemy import Column, Integer, Float, String, DateTime, ForeignKey, create_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.orm import sessionmaker
+from db import init_schema, SessionLocal, SensorData, RiskAssessment
+from excursion import ExcursionTracker, DEFAULT_DEVICE
+from risk_engine import RiskEngine, reasons_text
+from risk_model import RiskModel, ModelRiskEngine
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DBAPIError, OperationalError, InterfaceError, TimeoutError as PoolTimeoutError
+from rollups import RollupAccumulator, upsert_rollups, rebuild_range as rebuild_rollups
+from rescore import recompute_assessments
+from compliance import ComplianceTracker
+from cache import data_version
+from live import MQTT_LIVE_TOPIC, LIVE_LATE_TOPIC, live_row
+from alerts import AlertEngine
+from notify import NotificationDispatcher
+from spool import Spool, SPOOL_DIR
+import uplink
+import archive
+from logs import get_logger
+import metrics
 
 # Load environment variables
 load_dotenv()
 
-# SQL Configuration
-DB_URL = os.getenv("DATABASE_URL", "sqlite:///./coldchain.db") 
-engine = create_engine(DB_URL)
-SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-Base = declarative_base()
-
-# Define SQL Models
-class SensorData(Base):
-    __tablename__ = "sensor_data"
-    id = Column(Integer, primary_key=True, index=True)
-    temperature = Column(Float)
-    vibration = Column(Float)
-    rpm = Column(Integer)
-    timestamp = Column(DateTime, default=datetime.utcnow)
-
-class RiskAssessment(Base):
-    __tablename__ = "risk_assessments"
-    id = Column(Integer, primary_key=True, index=True)
-    sensor_data_id = Column(Integer, ForeignKey("sensor_data.id"))
-    risk_probability = Column(Float)
-    risk_reasons = Column(String)
-    timestamp = Column(DateTime, default=datetime.utcnow)
-
-# Create tables
-Base.metadata.create_all(bind=engine)
+log = get_logger("subscriber")
+
+# Tables are created by `python migrate.py init`; INIT_SCHEMA=1 also does it
+# at startup (scratch databases, containers). Importing this module never
+# touches the DB or the network.
+INIT_SCHEMA = os.getenv("INIT_SCHEMA", "0") not in ("0", "false", "False")
 
 MQTT_BROKER = os.getenv("MQTT_BROKER", "test.mosquitto.org") 
 MQTT_PORT = int(os.getenv("MQTT_PORT", 1883))
-MQTT_TOPIC = "cargo/coldchain/data"
+# Devices publish on cargo/coldchain/<device_id>/data; the legacy single-unit
+# topic is still accepted and mapped to the "default" device.
+MQTT_TOPIC = os.getenv("MQTT_TOPIC", "cargo/coldchain/+/data")
+# Binary uplink (uplink.py), negotiated per topic: .../<device_id>/bin
+MQTT_BINARY_TOPIC = os.getenv("MQTT_BINARY_TOPIC", "cargo/coldchain/+/bin")
+MQTT_LEGACY_TOPIC = "cargo/coldchain/data"
 MQTT_ALERT_TOPIC = "cargo/coldchain/alert"
+MQTT_DEVICE_ALERT_TOPIC = "cargo/coldchain/{device_id}/alert"
+
+# Ingest batching: on_message only enqueues, a background writer flushes batches
+INGEST_QUEUE_SIZE = int(os.getenv("INGEST_QUEUE_SIZE", 10000))
+BATCH_MAX_SIZE = int(os.getenv("BATCH_MAX_SIZE", 200))
+BATCH_MAX_LATENCY_MS = int(os.getenv("BATCH_MAX_LATENCY_MS", 250))
+# Late readings further behind their device's newest reading than this only
+# get themselves scored instead of re-scoring everything after them
+LATE_WATERMARK_SECS = float(os.getenv("LATE_WATERMARK_SECS", 6 * 3600))
+ingest_queue = queue.Queue(maxsize=INGEST_QUEUE_SIZE)
+metrics.queue_depth.set_function(ingest_queue.qsize)
+
+# Rule thresholds (RISK_RULES_FILE overrides the defaults)
+risk_engine = RiskEngine()
+
+# RISK_SCORER=model: probabilities from ml-model/motor_model.pkl (loaded on
+# first use), reasons still from the rules
+RISK_SCORER = os.getenv("RISK_SCORER", "rules")
+risk_model = RiskModel() if RISK_SCORER == "model" else None
+
+# Per-device excursion state (replaces the per-message "last compliant" query)
+excursions = ExcursionTracker(risk_engine.temp_min, risk_engine.temp_max)
 
-# Initialize Firestore (Keeping for transition/legacy if needed, but SQL is primary)
-db = firestore.Client()
+# Per-device boot times for uptime-stamped uplinks (stable resend dedupe keys)
+boot_clock = uplink.BootClock()
 
+# Debounced alert levels (publish on change / heartbeat) and notifications
+alert_engine = AlertEngine()
+notifier = NotificationDispatcher()
 
-def calculate_rule_based_risk(data, sql_session):
+# Incremental 1-minute / 1-hour rollups
+rollup_accumulator = RollupAccumulator(risk_engine.temp_min, risk_engine.temp_max)
+
+# Per-shipment time out of range / excursions / MKT (shipment_compliance)
+compliance_tracker = ComplianceTracker(risk_engine.temp_min, risk_engine.temp_max)
+
+
+def calculate_rule_based_risk(data, tracker=None):
     """
     Calculates risk probability based on cold chain rules:
     1. Temperature compliance (2-8°C) + duration
     2. Fan health (is RPM > 500?)
     3. Physical handling (vibration)
+
+    Thresholds come from the rule config (risk_engine.py); excursion
+    duration comes from the in-memory tracker, not a SQL lookup.
+    """
+    tracker = tracker or excursions
+    duration_secs = tracker.update(
+        data.get('device_id'), data['temperature'], data.get('received_at', datetime.utcnow())
+    )
+    total_risk, mask = risk_engine.score_one(
+        data['temperature'], data['vibration'], data['rpm'], duration_secs
+    )
+    if risk_model is not None:
+        total_risk = risk_model.score_one(data.get('device_id'), data['temperature'],
+                                          data['vibration'], data['rpm'])
+    return total_risk, reasons_text(mask)
+
+def score_sensor_batch(batch, tracker=None):
+    """
+    Batch form of calculate_rule_based_risk: advances the excursion tracker
+    in arrival order, then scores every reading in one vectorized call
+    (one predict_proba call with RISK_SCORER=model).
+    Returns [(risk_probability, risk_reasons), ...].
+    """
+    tracker = tracker or excursions
+    durations = []
+    for data in batch:
+        duration_secs = tracker.update(
+            data.get('device_id'), data['temperature'], data.get('received_at', datetime.utcnow())
+        )
+        durations.append(np.nan if duration_secs is None else duration_secs)
+
+    temperature = [data['temperature'] for data in batch]
+    vibration = [data['vibration'] for data in batch]
+    rpm = [data['rpm'] for data in batch]
+    risks, masks = risk_engine.score_batch(temperature, vibration, rpm, durations)
+    if risk_model is not None:
+        # One predict_proba call for the whole batch
+        risks = risk_model.score_batch([data.get('device_id') for data in batch], temperature, vibration, rpm)
+    return [(float(risk), reasons_text(int(mask))) for risk, mask in zip(risks, masks)]
+
+def _sensor_key(device_id, seq, timestamp):
+    # The dedupe key (ux_sensor_data_device_seq); seq-less readings are never
+    # deduplicated, only matched back to their batch position
+    return (device_id, seq, timestamp)
+
+def insert_sensor_rows(session, batch):
+    """
+    Writes `batch` to sensor_data with one multi-row
+    INSERT ... ON CONFLICT DO NOTHING RETURNING. Returns the new ids aligned
+    with `batch`; None marks a duplicate (device_id + seq + timestamp already
+    stored, or repeated within the batch), which callers skip entirely.
+    timestamp is part of the key because device seq counters restart at 0
+    after a reboot; uptime-stamped samples get it from boot_clock, so a
+    resend keeps it.
     """
-    total_risk = 0.0
-    risk_reasons = []
-
-    # 1. Temperature Risk
-    temp = data['temperature']
-    temp_risk = 0.0
-    if temp < 2.0 or temp > 8.0:
-        # Check last compliant reading in SQL
-        last_compliant = sql_session.query(SensorData)\
-            .filter(SensorData.temperature >= 2.0, SensorData.temperature <= 8.0)\
-            .order_by(SensorData.timestamp.desc())\
-            .first()
-        
-        if last_compliant:
-            duration_secs = (datetime.utcnow() - last_compliant.timestamp).total_seconds()
-            # Escalate risk based on duration (e.g., 0.1 per minute, max 1.0)
-            temp_risk = min(0.2 + (duration_secs / 60), 1.0) 
+    pending, rows = {}, []
+    for i, data in enumerate(batch):
+        key = _sensor_key(data['device_id'], data.get('seq'), data['received_at'])
+        if data.get('seq') is not None and key in pending:
+            continue
+        pending.setdefault(key, []).append(i)
+        rows.append({
+            "device_id": data['device_id'],
+            "shipment_id": data.get('shipment_id'),
+            "temperature": data['temperature'],
+            "vibration": data['vibration'],
+            "rpm": data['rpm'],
+            "timestamp": data['received_at'],
+            "seq": data.get('seq'),
+        })
+
+    ids = [None] * len(batch)
+    dialect = postgresql if session.get_bind().dialect.name == "postgresql" else sqlite
+    stmt = dialect.insert(SensorData).on_conflict_do_nothing().returning(
+        SensorData.id, SensorData.device_id, SensorData.seq, SensorData.timestamp
+    )
+    for row in session.execute(stmt, rows):
+        ids[pending[_sensor_key(row.device_id, row.seq, row.timestamp)].pop(0)] = row.id
+    duplicates = ids.count(None)
+    if duplicates:
+        metrics.duplicate_readings_total.inc(duplicates)
+    return ids
+
+def is_late(data, tracker=None):
+    """True when the reading is older than its device's newest reading already
+    scored (store-and-forward backlog, reordering in the broker)."""
+    state = (tracker or excursions).get(data['device_id'])
+    return state is not None and state.last_seen is not None and data['received_at'] < state.last_seen
+
+def split_late(batch, ids, tracker=None):
+    """
+    Inserted readings -> (on_time, late), see is_late(). on_time is
+    [(data, sensor_id)], late is {device_id: [(data, sensor_id)]}.
+    """
+    on_time, late = [], {}
+    for data, sensor_id in zip(batch, ids):
+        if sensor_id is None:
+            continue
+        if is_late(data, tracker):
+            late.setdefault(data['device_id'], []).append((data, sensor_id))
         else:
-            temp_risk = 0.3 # High initial risk if no compliant data found
-        risk_reasons.append("Temperature Excursion")
-
-    # 2. Fan Speed Risk
-    rpm = data['rpm']
-    rpm_risk = 0.0
-    if rpm < 500:
-        rpm_risk = 1.0 # Critical failure if fan stops
-        risk_reasons.append("Cooling Fan Failure")
-    elif rpm < 1000:
-        rpm_risk = 0.3 # Warning for low RPM
-        risk_reasons.append("Unstable Cooling")
-
-    # 3. Vibration Risk
-    vib = data['vibration']
-    vib_risk = 0.0
-    if vib > 2.0: # High shock
-        vib_risk = 1.0
-        risk_reasons.append("Vibration/Shock Detected")
-
-    # Final Risk calculation
-    total_risk = max(temp_risk, rpm_risk, vib_risk)
-    
-    return total_risk, ", ".join(risk_reasons)
+            on_time.append((data, sensor_id))
+    if late:
+        metrics.late_readings_total.inc(sum(len(rows) for rows in late.values()))
+    return on_time, late
 
-def process_sensor_data(data):
+def rescore_late_readings(session, late, tracker=None, rebuild=True):
+    """
+    Scores late readings inside the caller's transaction, once the on-time
+    rows are flushed. Within LATE_WATERMARK_SECS of the device's newest
+    reading, everything from the earliest late reading on is recomputed so
+    later excursion durations stay correct; older backlogs only get the
+    late readings themselves scored. Reloads those devices' tracker state
+    (unless `rebuild` is False: the caller folds them in with
+    ExcursionTracker.update_late) and returns {device_id: (since, until)}
+    for the rollup rebuild.
+    """
+    tracker = tracker or excursions
+    # Model probabilities do not depend on earlier readings: only score the late ones
+    scorer = risk_engine if risk_model is None else ModelRiskEngine(risk_engine, risk_model)
+    ranges = {}
+    for device_id, rows in late.items():
+        since = min(data['received_at'] for data, _ in rows)
+        until = max(data['received_at'] for data, _ in rows)
+        newest = tracker.get(device_id).last_seen
+        within_watermark = risk_model is None and since >= newest - timedelta(seconds=LATE_WATERMARK_SECS)
+        count = recompute_assessments(session, scorer, device_id, since,
+                                      None if within_watermark else until)
+        metrics.rescored_rows_total.inc(count)
+        ranges[device_id] = (since, newest if within_watermark else until)
+        log.info("⏪ Late readings scored", device_id=device_id, late=len(rows),
+                 rescored=count, since=since.isoformat(), within_watermark=within_watermark)
+    if rebuild:
+        tracker.rebuild(session, SensorData, list(late))
+    return ranges
+
+def rebuild_late_rollups(session, ranges):
+    """
+    Recomputes the rollup hours touched by late readings, in the batch's
+    transaction, so their counts and risk_max commit together with the
+    re-scored assessments. Archived days are skipped: their raw rows are
+    gone, so retention.py folds late readings into those rollups on its
+    next run.
+    """
+    archived_until = archive.covered_until()
+    for device_id, (since, until) in ranges.items():
+        if archived_until is not None:
+            if until < archived_until:
+                continue
+            since = max(since, archived_until)
+        rebuild_rollups(session, SensorData, RiskAssessment, since, until, device_id,
+                        risk_engine.temp_min, risk_engine.temp_max)
+
+def checkpoint_state(device_ids):
     """
-    Processes received sensor data:
-    1. SQL Write (Sensor Data)
-    2. Rule-based risk calculation
-    3. SQL Write (Risk Assessment)
-    4. Notifications
+    Copies the in-memory state a batch advances before its commit
+    (excursions, rollup gaps, model windows) for `device_ids`. Alert levels
+    are only evaluated after the commit and need no copy.
     """
+    return (excursions.checkpoint(device_ids), rollup_accumulator.checkpoint(device_ids),
+            risk_model.checkpoint(device_ids) if risk_model is not None else None)
+
+def restore_state(saved):
+    """Rolls the in-memory state back to checkpoint_state() after a failed transaction."""
+    excursion_state, rollup_state, model_state = saved
+    excursions.restore(excursion_state)
+    rollup_accumulator.restore(rollup_state)
+    if model_state is not None:
+        risk_model.restore(model_state)
+
+def database_unavailable(error):
+    """Connection-level failures (DB down, failover, pool exhausted): worth retrying the batch."""
+    return (isinstance(error, (OperationalError, InterfaceError, PoolTimeoutError))
+            or (isinstance(error, DBAPIError) and error.connection_invalidated))
+
+def process_sensor_batch(batch):
+    """
+    Processes a batch of received sensor data in a single transaction:
+    1. SQL Write (Sensor Data, one multi-row INSERT; duplicates dropped)
+    2. Rule-based risk calculation, in event-time order
+    3. SQL Write (Risk Assessment, one multi-row INSERT)
+    4. Rollup upsert
+    5. Shipment compliance upsert (late readings: recomputed)
+    6. Late readings: recompute the affected assessments and rollups
+    7. Notifications (debounced per-device alerts + one live-stream
+       message), on-time readings only
+    Returns "ok" once committed (a failed publish is only logged and
+    counted), "unavailable" (database unreachable, see
+    database_unavailable()) or "error".
+    """
+    if not batch:
+        return "ok"
+    metrics.batch_size.observe(len(batch))
+    # Event time, not arrival order: a store-and-forward batch may be unordered
+    batch = sorted(batch, key=lambda data: data['received_at'])
+    saved = checkpoint_state({data['device_id'] for data in batch})
+    committed = False
     session = SessionLocal()
     try:
+        write_start = time.perf_counter()
         # 1. SQL Write (Sensor Data)
-        db_sensor = SensorData(
-            temperature=data['temperature'],
-            vibration=data['vibration'],
-            rpm=data['rpm'],
-            timestamp=datetime.utcnow()
-        )
-        session.add(db_sensor)
-        session.commit()
-        session.refresh(db_sensor)
+        ids = insert_sensor_rows(session, batch)
+        on_time, late = split_late(batch, ids)
 
         # 2. Rule-based Risk
-        mean_prob, risk_type = calculate_rule_based_risk(data, session)
+        eval_start = time.perf_counter()
+        scores = score_sensor_batch([data for data, _ in on_time]) if on_time else []
+        eval_secs = time.perf_counter() - eval_start
+        metrics.risk_eval_seconds.observe(eval_secs)
+        results = [
+            (data, sensor_id, mean_prob, risk_type)
+            for (data, sensor_id), (mean_prob, risk_type) in zip(on_time, scores)
+        ]
 
         # 3. SQL Write (Risk Assessment)
-        db_risk = RiskAssessment(
-            sensor_data_id=db_sensor.id,
-            risk_probability=float(mean_prob),
-            risk_reasons=risk_type,
-            timestamp=datetime.utcnow()
-        )
-        session.add(db_risk)
+        session.add_all([
+            RiskAssessment(
+                device_id=data['device_id'],
+                sensor_data_id=sensor_id,
+                risk_probability=float(mean_prob),
+                risk_reasons=risk_type,
+                timestamp=data['received_at']
+            )
+            for data, sensor_id, mean_prob, risk_type in results
+        ])
+
+        # 4. Rollups (1-minute / 1-hour aggregates, same transaction)
+        for data, sensor_id, mean_prob, risk_type in results:
+            rollup_accumulator.add(data['device_id'], data['received_at'], data['temperature'],
+                                   data['vibration'], data['rpm'], mean_prob)
+        upsert_rollups(session, rollup_accumulator.drain())
+
+        # 5. Compliance (every stored reading, late ones included)
+        stored = [data for data, sensor_id in zip(batch, ids) if sensor_id is not None]
+        metrics.compliance_recomputed_total.inc(compliance_tracker.update(session, SensorData, stored))
+
+        # 6. Late readings (scored against their neighbours in the DB)
+        late_ranges = {}
+        if late:
+            session.flush()
+            late_ranges = rescore_late_readings(session, late)
+            rebuild_late_rollups(session, late_ranges)
         session.commit()
+        committed = True
+        data_version.bump()
+        # DB time only: scoring in the middle of the transaction is excluded
+        commit_secs = time.perf_counter() - write_start - eval_secs
+        metrics.db_commit_seconds.observe(commit_secs)
+        metrics.batches_total.inc(result="ok")
 
+        log.debug("✅ Batch processed (SQL)", readings=len(batch), on_time=len(results),
+                  late=sum(len(rows) for rows in late.values()), commit_ms=round(commit_secs * 1000, 2))
 
-        print(f"✅ Data Processed (SQL): Temp={data['temperature']} Vib={data['vibration']} RPM={data['rpm']} -> Risk={mean_prob:.1%} ({risk_type})")
+        # 7. Publish Result back to MQTT (for ESP32 to react): level changes and heartbeats only
+        publish_alerts(alert_engine.evaluate_batch(
+            (data['device_id'], mean_prob, risk_type, data['received_at'])
+            for data, sensor_id, mean_prob, risk_type in results
+        ))
 
-        # 5. Publish Result back to MQTT (for ESP32 to react)
-        alert_payload = {
-            "probability": float(mean_prob)
-        }
-        client.publish(MQTT_ALERT_TOPIC, json.dumps(alert_payload))
-        print(f"📤 Published result to {MQTT_ALERT_TOPIC}")
+        # 8. One message per batch for the dashboard stream and hot store (history_api)
+        if results:
+            client.publish(MQTT_LIVE_TOPIC, json.dumps([
+                live_row(data['device_id'], data['received_at'], data['temperature'],
+                         data['vibration'], data['rpm'], float(mean_prob), risk_type, sensor_id)
+                for data, sensor_id, mean_prob, risk_type in results
+            ]))
+        if late_ranges:
+            client.publish(LIVE_LATE_TOPIC, json.dumps(sorted(late_ranges)))
+        return "ok"
 
     except Exception as e:
-        print(f"❌ Error processing data: {e}")
-        session.rollback()
+        if committed:
+            # Stored and acknowledged: a retry would process the batch twice
+            metrics.publish_failures_total.inc()
+            log.warning("⚠️ Batch stored but not published", readings=len(batch), error=e)
+            return "ok"
+        result = "unavailable" if database_unavailable(e) else "error"
+        metrics.batches_total.inc(result=result)
+        log.error("❌ Error processing batch", readings=len(batch), result=result, error=e)
+        try:
+            session.rollback()
+        except Exception:
+            pass  # the connection is gone; close() below discards it
+        # Nothing of this batch is stored: a spool replay must score it
+        # from the same state as the first attempt
+        restore_state(saved)
+        compliance_tracker.invalidate()
+        return result
     finally:
         session.close()
 
+def process_sensor_data(data):
+    """Processes a single reading synchronously (batch of one)."""
+    data.setdefault('device_id', DEFAULT_DEVICE)
+    data.setdefault('received_at', datetime.utcnow())
+    process_sensor_batch([data])
+
+class BatchWriter(threading.Thread):
+    """
+    Background writer stage. Drains ingest_queue and flushes a batch when it
+    reaches BATCH_MAX_SIZE readings or the oldest reading has waited
+    BATCH_MAX_LATENCY_MS, whichever comes first. Queue items are the
+    readings of one message; a message is never split across batches, so a
+    store-and-forward burst is written (and any late re-scoring done) once.
+
+    With a `spool` (spool.py) each batch is appended there before its
+    transaction; batches the database could not take are kept and replayed
+    in order, between new batches, once it is back.
+    """
+    _STOP = object()
+
+    def __init__(self, source, max_size=BATCH_MAX_SIZE, max_latency_ms=BATCH_MAX_LATENCY_MS, spool=None):
+        super().__init__(name="batch-writer", daemon=True)
+        self.source = source
+        self.max_size = max_size
+        self.max_latency = max_latency_ms / 1000.0
+        self.spool = spool
+
+    def flush(self, batch):
+        if self.spool is None:
+            process_sensor_batch(batch)
+            return
+        try:
+            self.spool.append(batch)
+        except Exception as e:
+            # Disk full / unwritable spool: fall back to an unspooled write
+            log.error("❌ Spool append failed", readings=len(batch), error=e)
+            process_sensor_batch(batch)
+        self.spool.drain(process_sensor_batch)
+
+    def run(self):
+        stopping = False
+        while not stopping:
+            try:
+                # Wakes up to replay a spooled backlog while no messages arrive
+                item = self.source.get(timeout=self.spool and self.spool.waiting())
+            except queue.Empty:
+                self.flush([])
+                continue
+            if item is self._STOP:
+                break
+            batch = list(item)
+            # While a backlog replays, take what is queued without waiting for more
+            replaying = self.spool is not None and self.spool.waiting() == 0
+            deadline = time.monotonic() + (0 if replaying else self.max_latency)
+            while len(batch) < self.max_size:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.source.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stopping = True
+                    break
+                batch.extend(item)
+            self.flush(batch)
+
+        # Drain whatever arrived before the stop marker
+        leftover = []
+        while True:
+            try:
+                item = self.source.get_nowait()
+            except queue.Empty:
+                break
+            if item is not self._STOP:
+                leftover.append(item)
+        batch = []
+        for item in leftover:
+            batch.extend(item)
+            if len(batch) >= self.max_size:
+                self.flush(batch)
+                batch = []
+        self.flush(batch)
+        if self.spool is not None:
+            # Whatever the database did not take is replayed after the restart
+            self.spool.close()
+
+    def stop(self, timeout=None):
+        """Signals the writer to flush everything queued so far and exit."""
+        self.source.put(self._STOP)
+        self.join(timeout)
+
+def device_id_from_topic(topic):
+    """cargo/coldchain/<device_id>/data|bin -> <device_id>; legacy topic -> default."""
+    parts = topic.split("/")
+    if len(parts) == 4 and parts[3] in ("data", "bin"):
+        return parts[2]
+    return DEFAULT_DEVICE
+
+def is_binary_topic(topic):
+    return topic.endswith("/bin")
+
+def parse_message(topic, payload, received_at=None):
+    """
+    One MQTT message -> list of readings. A single JSON reading is stamped
+    with its arrival time (`received_at`, default now); store-and-forward
+    batches (binary, or a JSON list / {"samples": [...]}) keep each sample's
+    own time and dedupe `seq`. Raises ValueError on bad payloads.
+    """
+    received_at = received_at or datetime.utcnow()
+    device_id = device_id_from_topic(topic)
+    boot = partial(boot_clock.boot, device_id)
+    if is_binary_topic(topic):
+        payload_device, readings = uplink.decode(payload, received_at, boot)
+        if payload_device and payload_device != device_id:
+            raise uplink.PayloadError(f"payload device {payload_device!r} does not match topic")
+    else:
+        data = json.loads(payload)
+        if isinstance(data, list) or (isinstance(data, dict) and 'samples' in data):
+            try:
+                readings = [uplink.validate(reading)
+                            for reading in uplink.expand_json_batch(data, received_at, boot)]
+            except (KeyError, TypeError) as e:
+                raise uplink.PayloadError(f"malformed sample batch: {e!r}")
+        elif isinstance(data, dict):
+            uplink.validate(data)
+            # Ensure timestamp exists or use current
+            if 'timestamp' not in data:
+                data['timestamp'] = int(time.time())
+            data['received_at'] = received_at
+            readings = [data]
+        else:
+            raise uplink.PayloadError("expected a JSON object or list")
+
+    for data in readings:
+        data['device_id'] = device_id
+    # Oldest first, so the tracker sees a batch in event-time order
+    return sorted(uplink.clamp_event_times(readings, received_at), key=lambda data: data['received_at'])
+
+def alert_published(alert):
+    """Bookkeeping after an alert went out on MQTT: metrics, log, notification."""
+    metrics.alerts_published_total.inc(level=alert.level,
+                                       kind="heartbeat" if alert.heartbeat else "transition")
+    if not alert.heartbeat:
+        log.info("🚨 Alert level changed", device_id=alert.device_id, state=alert.level,
+                 previous=alert.previous, probability=round(float(alert.probability), 3))
+    notifier.submit(alert)
+
+def publish_alerts(alerts):
+    """Publishes AlertEngine output on the per-device alert topics."""
+    for alert in alerts:
+        with metrics.alert_publish_seconds.time():
+            client.publish(alert_topic(alert.device_id), json.dumps(alert.payload()))
+        alert_published(alert)
+
+def alert_topic(device_id):
+    if device_id == DEFAULT_DEVICE:
+        return MQTT_ALERT_TOPIC
+    return MQTT_DEVICE_ALERT_TOPIC.format(device_id=device_id)
+
 # MQTT Callbacks
 def on_connect(client, userdata, flags, rc):
-    print(f"📡 Connected to MQTT Broker with result code {rc}")
-    client.subscribe(MQTT_TOPIC)
+    log.info("📡 Connected to MQTT broker", rc=rc)
+    client.subscribe([(MQTT_TOPIC, 0), (MQTT_BINARY_TOPIC, 0), (MQTT_LEGACY_TOPIC, 0)])
 
-def on_message(client, userdata, msg):
+def enqueue_message(topic, payload, received_at=None):
+    """Parses one message onto ingest_queue (also used by ingest_workers.py)."""
     try:
-        payload = msg.payload.decode()
-        data = json.loads(payload)
-        # Ensure timestamp exists or use current
-        if 'timestamp' not in data:
-            data['timestamp'] = int(time.time())
-            
-        process_sensor_data(data)
-    except json.JSONDecodeError:
-        print("⚠️ Received non-JSON message")
+        parse_start = time.perf_counter()
+        readings = parse_message(topic, payload, received_at)
+        metrics.parse_seconds.observe(time.perf_counter() - parse_start)
+
+        # Blocks when the writer falls behind (backpressure on the network loop)
+        if readings:
+            ingest_queue.put(readings)
+        metrics.messages_total.inc(result="ok")
+    except (ValueError, UnicodeDecodeError) as e:
+        # JSONDecodeError and uplink.PayloadError are ValueErrors
+        metrics.messages_total.inc(result="invalid")
+        log.warning("⚠️ Received malformed message", topic=topic, error=e)
     except Exception as e:
-        print(f"❌ Error processing message: {e}")
+        metrics.messages_total.inc(result="error")
+        log.error("❌ Error processing message", topic=topic, error=e)
+
+def on_message(client, userdata, msg):
+    enqueue_message(msg.topic, msg.payload)
+
+def warm_up():
+    """Startup work that needs the DB: optional schema init, excursion state, model."""
+    if INIT_SCHEMA:
+        init_schema()
+    session = SessionLocal()
+    try:
+        excursions.rebuild(session, SensorData)
+    finally:
+        session.close()
+
+    if risk_model is not None:
+        risk_model.model  # load now rather than on the first batch
+        log.info("🧠 ML risk model loaded", path=risk_model.path, window=risk_model.window)
 
 # Main Execution
 if __name__ == "__main__":
+    import_secs = time.perf_counter() - IMPORT_STARTED
+    metrics.startup_seconds.set(import_secs, phase="import")
     client = mqtt.Client()
     client.on_connect = on_connect
     client.on_message = on_message
+    writer = BatchWriter(ingest_queue, spool=Spool() if SPOOL_DIR else None)
+
+    def start_pipeline():
+        # Runs while the network loop connects and subscribes: on_message only
+        # enqueues, so readings received meanwhile wait here for the writer
+        warm_start = time.perf_counter()
+        try:
+            warm_up()
+        except Exception as e:
+            log.error("❌ Startup failed", error=e, hint="new database? run `python migrate.py init` or set INIT_SCHEMA=1")
+            client.disconnect()
+            return
+        warm_secs = time.perf_counter() - warm_start
+        metrics.startup_seconds.set(warm_secs, phase="warm_up")
+        writer.start()
+        if notifier.enabled:
+            notifier.start()
+        metrics.start_metrics_server()
+        log.info("✅ Consuming", startup_ms=round((time.perf_counter() - IMPORT_STARTED) * 1000),
+                 import_ms=round(import_secs * 1000), warm_up_ms=round(warm_secs * 1000))
 
-    print(f"🚀 Connecting to broker: {MQTT_BROKER}:{MQTT_PORT}...")
+    def shutdown(signum, frame):
+        client.disconnect()
+    signal.signal(signal.SIGTERM, shutdown)
+
+    log.info("🚀 Connecting to broker", broker=f"{MQTT_BROKER}:{MQTT_PORT}",
+             metrics=f"http://{metrics.METRICS_HOST}:{metrics.METRICS_PORT}/metrics")
+    starter = threading.Thread(target=start_pipeline, name="warm-up", daemon=True)
     try:
         client.connect(MQTT_BROKER, MQTT_PORT, 60)
+        starter.start()
         client.loop_forever()
+    except KeyboardInterrupt:
+        client.disconnect()
     except Exception as e:
-        print(f"❌ Connection Failed: {e}")
+        log.error("❌ Connection failed", error=e)
+    finally:
+        if starter.is_alive():
+            starter.join()
+        log.info("🛑 Draining queued messages", queued=ingest_queue.qsize())
+        if writer.is_alive():
+            writer.stop()
+        notifier.stop(timeout=10)
@@ -0,0 +1,308 @@
+"""
+Out-of-band notifications (Telegram, webhook) for alert level changes.
+
+The ingest path only calls submit(), which never blocks: alerts go on a
+bounded queue and a background thread delivers them. Alerts arriving
+within NOTIFY_BATCH_WINDOW_SECS of each other go out as one message, each
+sink is rate limited (NOTIFY_RATE_PER_MIN, token bucket) and failed sends
+(connection errors, 429, 5xx) are retried with exponential backoff.
+While a sink is rate limited or backing off, new alerts keep queueing and
+are coalesced into the next message.
+
+Usage (delivers sample alerts to a local HTTP stand-in):
+    python notify.py --alerts 50 --fail-first 2
+"""
+import os
+import time
+import queue
+import argparse
+import threading
+from alerts import RANK, WARNING
+from logs import get_logger
+import metrics
+
+TELEGRAM_BOT_TOKEN = os.getenv("TELEGRAM_BOT_TOKEN")
+TELEGRAM_CHAT_ID = os.getenv("TELEGRAM_CHAT_ID")
+TELEGRAM_API_URL = os.getenv("TELEGRAM_API_URL", "https://api.telegram.org")
+NOTIFY_WEBHOOK_URL = os.getenv("NOTIFY_WEBHOOK_URL")
+
+NOTIFY_MIN_LEVEL = os.getenv("NOTIFY_MIN_LEVEL", WARNING)
+NOTIFY_QUEUE_SIZE = int(os.getenv("NOTIFY_QUEUE_SIZE", 1000))
+NOTIFY_BATCH_WINDOW_SECS = float(os.getenv("NOTIFY_BATCH_WINDOW_SECS", 2))
+NOTIFY_MAX_BATCH = int(os.getenv("NOTIFY_MAX_BATCH", 50))
+NOTIFY_RATE_PER_MIN = float(os.getenv("NOTIFY_RATE_PER_MIN", 20))
+NOTIFY_MAX_RETRIES = int(os.getenv("NOTIFY_MAX_RETRIES", 5))
+NOTIFY_BACKOFF_SECS = float(os.getenv("NOTIFY_BACKOFF_SECS", 1))
+NOTIFY_BACKOFF_MAX_SECS = float(os.getenv("NOTIFY_BACKOFF_MAX_SECS", 60))
+NOTIFY_TIMEOUT_SECS = float(os.getenv("NOTIFY_TIMEOUT_SECS", 5))
+
+log = get_logger("notify")
+
+LEVEL_ICONS = {"ok": "✅", "warning": "⚠️", "critical": "🚨"}
+
+
+def should_notify(alert, min_level=NOTIFY_MIN_LEVEL):
+    """Level changes into or out of `min_level` and above; never heartbeats."""
+    if alert.heartbeat or (alert.previous is None and alert.level == "ok"):
+        return False
+    return max(RANK[alert.level], RANK.get(alert.previous, 0)) >= RANK[min_level]
+
+
+class WebhookSink:
+    name = "webhook"
+
+    def __init__(self, url, timeout=NOTIFY_TIMEOUT_SECS):
+        self.url = url
+        self.timeout = timeout
+
+    def send(self, session, alerts):
+        body = {"alerts": [{"device_id": alert.device_id, **alert.payload()} for alert in alerts]}
+        return session.post(self.url, json=body, timeout=self.timeout)
+
+
+class TelegramSink:
+    name = "telegram"
+
+    def __init__(self, token, chat_id, api_url=TELEGRAM_API_URL, timeout=NOTIFY_TIMEOUT_SECS):
+        self.url = f"{api_url.rstrip('/')}/bot{token}/sendMessage"
+        self.chat_id = chat_id
+        self.timeout = timeout
+
+    @staticmethod
+    def format(alerts):
+        lines = [f"*Cold chain alerts ({len(alerts)})*", ""] if len(alerts) > 1 else []
+        for alert in alerts:
+            lines.append(
+                f"{LEVEL_ICONS[alert.level]} *{alert.device_id}*: {alert.previous or 'new'} → "
+                f"*{alert.level.upper()}* ({alert.probability:.0%}) at "
+                f"{alert.timestamp.strftime('%Y-%m-%d %H:%M:%S')} UTC"
+                + (f"\n    {alert.reasons}" if alert.reasons else "")
+            )
+        return "\n".join(lines)
+
+    def send(self, session, alerts):
+        payload = {"chat_id": self.chat_id, "text": self.format(alerts), "parse_mode": "Markdown"}
+        return session.post(self.url, json=payload, timeout=self.timeout)
+
+
+def default_sinks():
+    """Sinks configured through the environment (none = notifications off)."""
+    sinks = []
+    if TELEGRAM_BOT_TOKEN and TELEGRAM_CHAT_ID:
+        sinks.append(TelegramSink(TELEGRAM_BOT_TOKEN, TELEGRAM_CHAT_ID))
+    if NOTIFY_WEBHOOK_URL:
+        sinks.append(WebhookSink(NOTIFY_WEBHOOK_URL))
+    return sinks
+
+
+class TokenBucket:
+    def __init__(self, rate_per_sec, burst):
+        self.rate = rate_per_sec
+        self.burst = burst
+        self.tokens = burst
+        self.updated = time.monotonic()
+
+    def delay(self):
+        """Seconds until a token is available (0: take it now)."""
+        now = time.monotonic()
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return 0.0
+        return (1 - self.tokens) / self.rate
+
+
+def _retry_after(response):
+    """Seconds from a Retry-After header or Telegram's parameters.retry_after."""
+    try:
+        if "Retry-After" in response.headers:
+            return float(response.headers["Retry-After"])
+        return float(response.json()["parameters"]["retry_after"])
+    except (ValueError, KeyError, TypeError):
+        return None
+
+
+class NotificationDispatcher(threading.Thread):
+    """Background delivery thread; see the module docstring."""
+    _STOP = object()
+
+    def __init__(self, sinks=None, queue_size=NOTIFY_QUEUE_SIZE, batch_window=NOTIFY_BATCH_WINDOW_SECS,
+                 max_batch=NOTIFY_MAX_BATCH, rate_per_min=NOTIFY_RATE_PER_MIN,
+                 max_retries=NOTIFY_MAX_RETRIES, backoff=NOTIFY_BACKOFF_SECS,
+                 backoff_max=NOTIFY_BACKOFF_MAX_SECS, min_level=NOTIFY_MIN_LEVEL):
+        super().__init__(name="notify-dispatcher", daemon=True)
+        self.sinks = default_sinks() if sinks is None else sinks
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.batch_window = batch_window
+        self.max_batch = max_batch
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_max = backoff_max
+        self.min_level = min_level
+        self.buckets = {sink.name: TokenBucket(rate_per_min / 60.0, max(1.0, rate_per_min / 6))
+                        for sink in self.sinks}
+        self.session = None  # requests.Session, created by the delivery thread
+        self._stopping = threading.Event()
+        metrics.notify_queue_depth.set_function(self.queue.qsize)
+
+    @property
+    def enabled(self):
+        return bool(self.sinks)
+
+    def submit(self, alert):
+        """Queues `alert` if it warrants a notification. Never blocks."""
+        if not self.enabled or not should_notify(alert, self.min_level):
+            return False
+        try:
+            self.queue.put_nowait(alert)
+            return True
+        except queue.Full:
+            metrics.notifications_total.inc(sink="queue", result="dropped")
+            log.warning("⚠️ Notification queue full, alert dropped", device_id=alert.device_id,
+                        state=alert.level)
+            return False
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            if item is self._STOP:
+                break
+            batch = [item]
+            deadline = time.monotonic() + self.batch_window
+            stop = False
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    item = self.queue.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if item is self._STOP:
+                    stop = True
+                    break
+                batch.append(item)
+            self.dispatch(batch)
+            if stop:
+                break
+
+        # Best effort for whatever was queued before the stop marker
+        leftover = []
+        while True:
+            try:
+                item = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is not self._STOP:
+                leftover.append(item)
+        for i in range(0, len(leftover), self.max_batch):
+            self.dispatch(leftover[i:i + self.max_batch])
+
+    def dispatch(self, alerts):
+        for sink in self.sinks:
+            self._deliver(sink, alerts)
+
+    def _wait(self, seconds):
+        """Sleeps unless stopping; returns False when the wait was cut short."""
+        return not self._stopping.wait(seconds)
+
+    def _deliver(self, sink, alerts):
+        import requests  # deferred: processes without a sink never load it
+        if self.session is None:
+            self.session = requests.Session()
+        bucket = self.buckets[sink.name]
+        for attempt in range(self.max_retries + 1):
+            delay = bucket.delay()
+            if delay:
+                self._wait(delay)  # cut short when stopping
+
+            retry_after = None
+            try:
+                with metrics.notify_seconds.time(sink=sink.name):
+                    response = sink.send(self.session, alerts)
+                if response.status_code < 400:
+                    metrics.notifications_total.inc(len(alerts), sink=sink.name, result="sent")
+                    log.info("📣 Notification sent", sink=sink.name, alerts=len(alerts))
+                    return True
+                if response.status_code != 429 and response.status_code < 500:
+                    metrics.notifications_total.inc(len(alerts), sink=sink.name, result="failed")
+                    log.error("❌ Notification rejected", sink=sink.name, status=response.status_code,
+                              response=response.text[:200])
+                    return False
+                retry_after = _retry_after(response)
+                error = f"HTTP {response.status_code}"
+            except requests.RequestException as e:
+                error = e
+
+            if attempt == self.max_retries or self._stopping.is_set():
+                break
+            metrics.notifications_total.inc(len(alerts), sink=sink.name, result="retried")
+            delay = retry_after or min(self.backoff * 2 ** attempt, self.backoff_max)
+            log.warning("⚠️ Notification failed, retrying", sink=sink.name, error=error,
+                        attempt=attempt + 1, retry_in=round(delay, 2))
+            self._wait(delay)
+
+        metrics.notifications_total.inc(len(alerts), sink=sink.name, result="failed")
+        log.error("❌ Notification dropped after retries", sink=sink.name, alerts=len(alerts), error=error)
+        return False
+
+    def stop(self, timeout=None):
+        """Delivers what is queued and exits; after `timeout` seconds, pending
+        retries and rate-limit waits are abandoned."""
+        if not self.is_alive():
+            return
+        self.queue.put(self._STOP)
+        self.join(timeout)
+        self._stopping.set()
+        self.join(NOTIFY_TIMEOUT_SECS * len(self.sinks))
+
+
+if __name__ == "__main__":
+    import json
+    from datetime import datetime, timedelta
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+    from alerts import Alert, OK, CRITICAL
+
+    parser = argparse.ArgumentParser(description="Exercise the dispatcher against a local HTTP stand-in")
+    parser.add_argument("--alerts", type=int, default=20)
+    parser.add_argument("--fail-first", type=int, default=1, help="answer the first N posts with 503")
+    parser.add_argument("--rate-per-min", type=float, default=NOTIFY_RATE_PER_MIN)
+    args = parser.parse_args()
+
+    received = []
+
+    class StandIn(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+            if args.fail_first > 0:
+                args.fail_first -= 1
+                self.send_response(503)
+                self.send_header("Retry-After", "0.2")
+                self.end_headers()
+                return
+            received.append(body)
+            self.send_response(200)
+            self.end_headers()
+
+        def log_message(self, format, *args):
+            pass
+
+    server = ThreadingHTTPServer(("127.0.0.1", 0), StandIn)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    url = f"http://127.0.0.1:{server.server_port}/hook"
+
+    dispatcher = NotificationDispatcher([WebhookSink(url)], batch_window=0.2, rate_per_min=args.rate_per_min,
+                                        backoff=0.1)
+    dispatcher.start()
+    t0 = time.perf_counter()
+    now = datetime.utcnow()
+    for i in range(args.alerts):
+        level, previous = (CRITICAL, OK) if i % 2 == 0 else (OK, CRITICAL)
+        dispatcher.submit(Alert(f"demo-{i % 5:02d}", level, previous, 0.9 if level == CRITICAL else 0.1,
+                                "", now + timedelta(seconds=i)))
+    print(f"📤 {args.alerts} alerts submitted in {(time.perf_counter() - t0) * 1000:.2f} ms (non-blocking)")
+    dispatcher.stop(timeout=30)
+    server.shutdown()
+    print(f"📥 stand-in received {sum(len(body['alerts']) for body in received)} alerts "
+          f"in {len(received)} posts after {time.perf_counter() - t0:.2f}s")
@@ -0,0 +1,281 @@
+"""
+Bulk re-scoring / backfill of risk_assessments after a rule change.
+
+Streams sensor_data per device in (timestamp, id) order, replays the
+excursion-duration logic across chunk boundaries, scores each chunk with
+the vectorized RiskEngine and upserts the assessments in bulk. Devices are
+independent, so they are processed in parallel in a process pool. Progress
+is checkpointed per device in the same transaction as each chunk, so an
+interrupted run resumes exactly where it stopped.
+
+Once a device is re-scored, its rollups (risk_max, and excursion_secs if
+the rules moved the temperature band) are rebuilt for the re-scored range
+and its shipment compliance rows are recomputed, before the device is
+marked done. --no-rebuild skips that and prints the commands to run later.
+
+Usage:
+    python rescore.py --run-id rules-v2 [--rules new_rules.json] [--workers 4]
+                      [--chunk-size 50000] [--since 2026-01-01] [--until 2026-02-01]
+                      [--device reefer-042 ...] [--restart] [--no-rebuild]
+"""
+import os
+import time
+import argparse
+from datetime import datetime, timezone
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dotenv import load_dotenv
+from sqlalchemy import (
+    Column, MetaData, Table, String, Integer, DateTime, Float, Boolean,
+    select, insert, update, delete, func, and_, or_,
+)
+from sqlalchemy.orm import Session
+from db import DB_URL, make_engine, SensorData, RiskAssessment
+from excursion import replay_durations
+import archive
+import compliance
+import rollups
+from risk_engine import RiskEngine, load_rules, reasons_text
+from cache import data_version, rewrite_version
+
+load_dotenv()
+
+metadata = MetaData()
+checkpoints = Table(
+    "rescore_checkpoints", metadata,
+    Column("run_id", String, primary_key=True),
+    Column("device_id", String, primary_key=True),
+    Column("last_timestamp", DateTime),
+    Column("last_id", Integer),
+    Column("last_compliant", Float),  # epoch seconds carried across chunks
+    Column("rows_done", Integer, default=0),
+    Column("done", Boolean, default=False),
+    Column("updated_at", DateTime),
+)
+
+
+def _epoch(dt):
+    return dt.replace(tzinfo=timezone.utc).timestamp()
+
+
+def _load_checkpoint(session, run_id, device_id):
+    return session.execute(
+        select(checkpoints).where(checkpoints.c.run_id == run_id, checkpoints.c.device_id == device_id)
+    ).first()
+
+
+def _seed_last_compliant(session, engine, device_id, since):
+    """Last compliant reading before the re-scored window (None = never)."""
+    if since is None:
+        return None
+    last = session.execute(
+        select(func.max(SensorData.timestamp)).where(
+            SensorData.device_id == device_id,
+            SensorData.timestamp < since,
+            SensorData.temperature >= engine.temp_min,
+            SensorData.temperature <= engine.temp_max,
+        )
+    ).scalar()
+    return _epoch(last) if last else None
+
+
+def _chunk_query(device_id, since, until, cursor, chunk_size, until_inclusive=False):
+    """Next chunk of one device's readings (with any assessment id) in (timestamp, id) order."""
+    query = select(
+        SensorData.id, SensorData.timestamp, SensorData.temperature,
+        SensorData.vibration, SensorData.rpm, RiskAssessment.id.label("risk_id"),
+    ).outerjoin(RiskAssessment, RiskAssessment.sensor_data_id == SensorData.id)\
+        .where(SensorData.device_id == device_id)
+    if since:
+        query = query.where(SensorData.timestamp >= since)
+    if until:
+        query = query.where(SensorData.timestamp <= until if until_inclusive else SensorData.timestamp < until)
+    if cursor:
+        query = query.where(or_(
+            SensorData.timestamp > cursor[0],
+            and_(SensorData.timestamp == cursor[0], SensorData.id > cursor[1]),
+        ))
+    return query.order_by(SensorData.timestamp, SensorData.id).limit(chunk_size)
+
+
+def score_chunk(session, engine, device_id, rows, last_compliant):
+    """
+    Replays excursion durations over `rows` (time order), scores them and
+    updates / inserts their risk_assessments in bulk. Returns the
+    last_compliant carry for the next chunk.
+    """
+    durations, last_compliant = replay_durations(
+        [_epoch(row.timestamp) for row in rows],
+        [row.temperature for row in rows],
+        last_compliant, engine.temp_min, engine.temp_max,
+    )
+    risks, masks = engine.score_batch(
+        [row.temperature for row in rows],
+        [row.vibration for row in rows],
+        [row.rpm for row in rows],
+        durations,
+    )
+
+    updates, inserts = [], []
+    for row, risk, mask in zip(rows, risks, masks):
+        values = {"risk_probability": float(risk), "risk_reasons": reasons_text(int(mask))}
+        if row.risk_id is not None:
+            updates.append({"id": row.risk_id, **values})
+        else:
+            inserts.append({"device_id": device_id, "sensor_data_id": row.id,
+                            "timestamp": row.timestamp, **values})
+    if updates:
+        session.execute(update(RiskAssessment), updates)
+    if inserts:
+        session.execute(insert(RiskAssessment), inserts)
+    return last_compliant
+
+
+def recompute_assessments(session, engine, device_id, since, until=None, chunk_size=5000):
+    """
+    Re-scores one device's readings from `since` (through `until`, inclusive,
+    or to the newest) inside the caller's transaction. Used by the ingest
+    path when late readings land before already-scored ones. Returns the
+    number of rows re-scored; the caller rebuilds the rollups of that range
+    (rollups.rebuild_range), whose risk_max these rows feed.
+    """
+    last_compliant = _seed_last_compliant(session, engine, device_id, since)
+    cursor, count = None, 0
+    while True:
+        rows = session.execute(
+            _chunk_query(device_id, since, until, cursor, chunk_size, until_inclusive=True)
+        ).all()
+        if not rows:
+            return count
+        last_compliant = score_chunk(session, engine, device_id, rows, last_compliant)
+        count += len(rows)
+        cursor = (rows[-1].timestamp, rows[-1].id)
+
+
+def rebuild_derived(db, engine, device_id, since=None, until=None):
+    """
+    Brings one device's rollups and shipment compliance in line with its
+    re-scored assessments and the rules' temperature band. Archived days
+    keep their rollups (their raw rows are gone).
+    """
+    with Session(db) as session:
+        first, last = session.execute(
+            select(func.min(SensorData.timestamp), func.max(SensorData.timestamp))
+            .where(SensorData.device_id == device_id)
+        ).one()
+    if first is not None:
+        since = max(since or first, archive.covered_until() or datetime.min)
+        if until is None or since < until:
+            rollups.rebuild(db, SensorData, RiskAssessment, since, until or last, device_id,
+                            engine.temp_min, engine.temp_max)
+    compliance.rebuild(db, SensorData, device_id=device_id,
+                       temp_min=engine.temp_min, temp_max=engine.temp_max)
+
+
+def rescore_device(device_id, run_id, db_url, rules, chunk_size, since=None, until=None, derived=True):
+    """Re-scores one device; runs inside a pool worker. Returns rows processed."""
+    db = make_engine(db_url)
+    engine = RiskEngine(rules)
+    processed = 0
+    try:
+        with Session(db) as session:
+            checkpoint = _load_checkpoint(session, run_id, device_id)
+            if checkpoint and checkpoint.done:
+                return 0
+            if checkpoint:
+                cursor = (checkpoint.last_timestamp, checkpoint.last_id)
+                last_compliant = checkpoint.last_compliant
+                processed = checkpoint.rows_done or 0
+            else:
+                cursor = None
+                last_compliant = _seed_last_compliant(session, engine, device_id, since)
+                session.execute(insert(checkpoints).values(
+                    run_id=run_id, device_id=device_id, rows_done=0, done=False,
+                    last_compliant=last_compliant, updated_at=datetime.utcnow(),
+                ))
+                session.commit()
+
+            while True:
+                rows = session.execute(_chunk_query(device_id, since, until, cursor, chunk_size)).all()
+                if not rows:
+                    break
+
+                last_compliant = score_chunk(session, engine, device_id, rows, last_compliant)
+                processed += len(rows)
+                cursor = (rows[-1].timestamp, rows[-1].id)
+                session.execute(update(checkpoints).where(
+                    checkpoints.c.run_id == run_id, checkpoints.c.device_id == device_id
+                ).values(last_timestamp=cursor[0], last_id=cursor[1], last_compliant=last_compliant,
+                         rows_done=processed, updated_at=datetime.utcnow()))
+                session.commit()
+
+            if derived:
+                rebuild_derived(db, engine, device_id, since, until)
+            session.execute(update(checkpoints).where(
+                checkpoints.c.run_id == run_id, checkpoints.c.device_id == device_id
+            ).values(done=True, updated_at=datetime.utcnow()))
+            session.commit()
+        return processed
+    finally:
+        db.dispose()
+
+
+def run(args):
+    db = make_engine(args.url)
+    metadata.create_all(db)
+    if args.restart:
+        with db.begin() as conn:
+            conn.execute(delete(checkpoints).where(checkpoints.c.run_id == args.run_id))
+
+    devices = args.device
+    if not devices:
+        with Session(db) as session:
+            devices = [d for (d,) in session.execute(select(SensorData.device_id).distinct())]
+    db.dispose()
+
+    rules = load_rules(args.rules)
+    since = datetime.fromisoformat(args.since) if args.since else None
+    until = datetime.fromisoformat(args.until) if args.until else None
+    print(f"🚀 Re-scoring {len(devices)} devices (run '{args.run_id}', {args.workers} workers)...")
+
+    t0 = time.perf_counter()
+    total = 0
+    with ProcessPoolExecutor(max_workers=args.workers) as pool:
+        futures = {
+            pool.submit(rescore_device, device_id, args.run_id, args.url, rules,
+                        args.chunk_size, since, until, not args.no_rebuild): device_id
+            for device_id in devices
+        }
+        for future in as_completed(futures):
+            device_id = futures[future]
+            try:
+                count = future.result()
+                total += count
+                print(f"✅ {device_id}: {count:,} rows")
+            except Exception as e:
+                print(f"❌ {device_id} failed (resume with the same --run-id): {e}")
+
+    data_version.bump()
+    rewrite_version.bump()
+    elapsed = time.perf_counter() - t0
+    print(f"📊 {total:,} rows re-scored in {elapsed:.1f}s ({total / max(elapsed, 1e-9):,.0f} rows/s)")
+    if args.no_rebuild:
+        window = f"--since {args.since or '<oldest reading>'}" + (f" --until {args.until}" if args.until else "")
+        print("ℹ️ Rollups and compliance were not rebuilt; run for each re-scored device:\n"
+              f"   python rollups.py rebuild {window} --device <id>\n"
+              "   python compliance.py rebuild --device <id>")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Bulk re-score risk_assessments")
+    parser.add_argument("--run-id", required=True, help="checkpoint key; reuse it to resume")
+    parser.add_argument("--rules", help="JSON rule overrides (defaults: RISK_RULES_FILE / built-in)")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk-size", type=int, default=50000)
+    parser.add_argument("--since", help="ISO timestamp (UTC), inclusive")
+    parser.add_argument("--until", help="ISO timestamp (UTC), exclusive")
+    parser.add_argument("--device", nargs="*", help="limit to these device ids")
+    parser.add_argument("--restart", action="store_true", help="discard checkpoints for this run")
+    parser.add_argument("--no-rebuild", action="store_true",
+                        help="skip the per-device rollup / compliance rebuild")
+    parser.add_argument("--url", default=DB_URL)
+    run(parser.parse_args())
@@ -0,0 +1,226 @@
+"""
+Retention for the raw tables: sensor_data / risk_assessments keep the last
+RETENTION_DAYS (UTC days); older readings are compacted and archived.
+
+For each day before the cutoff, oldest first, and each device in it:
+1. compact: the device-day's sensor_rollups are checked against all its
+   rows (still in the DB + already archived) and recomputed when the
+   counts differ, so rollups stay exact after the raw rows are gone;
+2. export: the rows are merged into the device-day file (archive.py);
+3. delete: the exported rows are deleted in RETENTION_CHUNK_SIZE chunks,
+   risk_assessments first, one short transaction per chunk.
+Every step is idempotent: an interrupted run is finished by running it
+again, and readings that arrive late for an archived day are folded into
+its file and rollups by the next run.
+
+Schedule it daily, e.g. cron:
+
+    15 3 * * *  cd /opt/coldchain/cloud && python retention.py run
+
+Usage:
+    python retention.py run [--days 30] [--dry-run]
+    python retention.py status
+"""
+import os
+import time
+import argparse
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from sqlalchemy import select, delete, func
+from sqlalchemy.orm import Session
+import archive
+from archive import ArchiveRow, sort_key
+from rollups import RollupAccumulator, ROLLUP_MAX_GAP_SECS, sensor_rollups, upsert_rollups
+
+load_dotenv()
+
+RETENTION_DAYS = int(os.getenv("RETENTION_DAYS", 30))
+RETENTION_CHUNK_SIZE = int(os.getenv("RETENTION_CHUNK_SIZE", 5000))
+
+
+def cutoff(days=RETENTION_DAYS, now=None):
+    """Start of the oldest day kept raw; everything before it is archived."""
+    return archive.day_start(now or datetime.utcnow()) - timedelta(days=days)
+
+
+def next_day(session, sensor_model, since, until):
+    """First day in [since, until) that still has raw rows, or None."""
+    SensorData = sensor_model
+    query = select(func.min(SensorData.timestamp)).where(SensorData.timestamp < until)
+    if since is not None:
+        query = query.where(SensorData.timestamp >= since)
+    first = session.execute(query).scalar()
+    return archive.day_start(first) if first else None
+
+
+def day_devices(session, sensor_model, day):
+    SensorData = sensor_model
+    return session.execute(
+        select(SensorData.device_id, func.count())
+        .where(SensorData.timestamp >= day, SensorData.timestamp < day + timedelta(days=1))
+        .group_by(SensorData.device_id)
+        .order_by(SensorData.device_id)
+    ).all()
+
+
+def device_rows(session, sensor_model, risk_model, device_id, day):
+    """The device-day's raw rows as ArchiveRows (assessment fields None if missing)."""
+    SensorData, RiskAssessment = sensor_model, risk_model
+    result = session.execute(
+        select(
+            SensorData.id, SensorData.device_id, SensorData.shipment_id, SensorData.seq,
+            SensorData.timestamp, SensorData.temperature, SensorData.vibration, SensorData.rpm,
+            RiskAssessment.risk_probability, RiskAssessment.risk_reasons,
+        ).outerjoin(RiskAssessment, RiskAssessment.sensor_data_id == SensorData.id)
+        .where(SensorData.device_id == device_id,
+               SensorData.timestamp >= day, SensorData.timestamp < day + timedelta(days=1))
+        .order_by(SensorData.timestamp, SensorData.id)
+    )
+    return [ArchiveRow(*row) for row in result]
+
+
+def previous_reading(session, sensor_model, device_id, day):
+    """Timestamp of the device's last reading before `day` (DB or archive), for excursion gaps."""
+    SensorData = sensor_model
+    previous = session.execute(
+        select(func.max(SensorData.timestamp))
+        .where(SensorData.device_id == device_id, SensorData.timestamp < day,
+               SensorData.timestamp >= day - timedelta(seconds=ROLLUP_MAX_GAP_SECS))
+    ).scalar()
+    if previous is None:
+        archived = archive.read_device_day(day - timedelta(days=1), device_id)
+        previous = archived[-1].timestamp if archived else None
+    return previous
+
+
+def compact(session, sensor_model, device_id, day, rows, temp_min, temp_max):
+    """
+    Makes the device-day's rollups match `rows` (all of its readings).
+    Returns True if they had to be recomputed.
+    """
+    r = sensor_rollups.c
+    in_day = (r.device_id == device_id, r.bucket_start >= day, r.bucket_start < day + timedelta(days=1))
+    rolled = session.execute(
+        select(func.coalesce(func.sum(r.count), 0)).where(r.resolution == 3600, *in_day)
+    ).scalar()
+    if rolled == len(rows):
+        return False
+
+    session.execute(delete(sensor_rollups).where(*in_day))
+    accumulator = RollupAccumulator(temp_min, temp_max)
+    previous = previous_reading(session, sensor_model, device_id, day)
+    if previous is not None:
+        accumulator.last_seen[device_id] = previous
+    for row in rows:
+        accumulator.add(device_id, row.timestamp, row.temperature, row.vibration, row.rpm,
+                        row.risk_probability or 0.0)
+    upsert_rollups(session, accumulator.drain())
+    return True
+
+
+def delete_rows(engine, sensor_model, risk_model, ids, chunk_size=RETENTION_CHUNK_SIZE):
+    SensorData, RiskAssessment = sensor_model, risk_model
+    for i in range(0, len(ids), chunk_size):
+        chunk = ids[i:i + chunk_size]
+        with engine.begin() as conn:
+            conn.execute(delete(RiskAssessment).where(RiskAssessment.sensor_data_id.in_(chunk)))
+            conn.execute(delete(SensorData).where(SensorData.id.in_(chunk)))
+
+
+def archive_device_day(engine, sensor_model, risk_model, device_id, day, temp_min=2.0, temp_max=8.0):
+    """Compacts, exports and deletes one device-day. Returns (rows_deleted, rollups_recomputed)."""
+    with Session(engine) as session:
+        live = device_rows(session, sensor_model, risk_model, device_id, day)
+    if not live:
+        return 0, False
+
+    # Rows already in the file (an interrupted run) are replaced by their DB version
+    rows = {row.id: row for row in archive.read_device_day(day, device_id)}
+    rows.update((row.id, row) for row in live)
+    rows = sorted(rows.values(), key=sort_key)
+
+    with Session(engine) as session, session.begin():
+        recomputed = compact(session, sensor_model, device_id, day, rows, temp_min, temp_max)
+    archive.write_partition(day, device_id, rows)
+    delete_rows(engine, sensor_model, risk_model, [row.id for row in live])
+    return len(live), recomputed
+
+
+def run(engine, sensor_model, risk_model, days=RETENTION_DAYS, dry_run=False,
+        temp_min=2.0, temp_max=8.0, now=None):
+    """Archives every raw day before cutoff(days). Returns totals."""
+    until = cutoff(days, now)
+    totals = {"cutoff": until.isoformat(), "days": 0, "devices": 0, "rows": 0, "recomputed": 0}
+    with Session(engine) as session:
+        day = next_day(session, sensor_model, None, until)
+    while day is not None:
+        started = time.perf_counter()
+        with Session(engine) as session:
+            devices = day_devices(session, sensor_model, day)
+        day_rows = 0
+        for device_id, count in devices:
+            if dry_run:
+                day_rows += count
+                continue
+            deleted, recomputed = archive_device_day(engine, sensor_model, risk_model,
+                                                     device_id, day, temp_min, temp_max)
+            day_rows += deleted
+            totals["recomputed"] += recomputed
+        totals["days"] += 1
+        totals["devices"] += len(devices)
+        totals["rows"] += day_rows
+        verb = "would archive" if dry_run else "archived"
+        print(f"📦 {day:%Y-%m-%d}: {verb} {day_rows:,} rows from {len(devices)} devices "
+              f"({time.perf_counter() - started:.1f}s)")
+        with Session(engine) as session:
+            day = next_day(session, sensor_model, day + timedelta(days=1), until)
+    return totals
+
+
+def status(engine, sensor_model, days=RETENTION_DAYS, now=None):
+    until = cutoff(days, now)
+    SensorData = sensor_model
+    with Session(engine) as session:
+        rows, oldest = session.execute(select(func.count(), func.min(SensorData.timestamp))).one()
+        expired = session.execute(
+            select(func.count()).where(SensorData.timestamp < until)
+        ).scalar()
+    return {
+        "retention_days": days,
+        "cutoff": until.isoformat(),
+        "raw_rows": rows,
+        "oldest_raw": oldest.isoformat() if oldest else None,
+        "rows_past_cutoff": expired,
+        "archive": archive.summary(),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Archive and compact raw readings older than the retention window")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rn = sub.add_parser("run", help="archive every day before the cutoff")
+    rn.add_argument("--days", type=int, default=RETENTION_DAYS, help="days of raw rows to keep")
+    rn.add_argument("--dry-run", action="store_true", help="only report what would be archived")
+    st = sub.add_parser("status", help="raw table and archive sizes")
+    st.add_argument("--days", type=int, default=RETENTION_DAYS)
+    args = parser.parse_args()
+
+    from db import engine as db, SensorData, RiskAssessment
+    from risk_engine import RiskEngine
+    from cache import data_version
+    from rollups import metadata
+
+    if args.command == "status":
+        for key, value in status(db, SensorData, args.days).items():
+            print(f"{key}: {value}")
+    else:
+        metadata.create_all(db)
+        rules = RiskEngine()
+        start = time.perf_counter()
+        totals = run(db, SensorData, RiskAssessment, args.days, args.dry_run,
+                     rules.temp_min, rules.temp_max)
+        if totals["rows"] and not args.dry_run:
+            data_version.bump()
+        print(f"✅ {totals['rows']:,} rows over {totals['days']} days before {totals['cutoff']} "
+              f"{'would be archived' if args.dry_run else 'archived'}, "
+              f"{totals['recomputed']} device-days re-compacted ({time.perf_counter() - start:.1f}s)")
@@ -0,0 +1,145 @@
+"""
+Vectorized cold chain risk rules.
+
+Thresholds live in a declarative rule config (DEFAULT_RULES, overridable
+with a JSON file named by RISK_RULES_FILE) instead of literals, and the
+same RiskEngine scores one live reading or millions of historical ones.
+"""
+import os
+import json
+import copy
+import numpy as np
+
+DEFAULT_RULES = {
+    # 1. Temperature compliance (2-8°C) + duration
+    "temperature": {
+        "min": 2.0,
+        "max": 8.0,
+        "base_risk": 0.2,            # risk as soon as an excursion starts
+        "risk_per_minute": 1.0,      # added per minute since the last compliant reading
+        "unknown_duration_risk": 0.3,  # excursion with no compliant reading on record
+    },
+    # 2. Fan health
+    "rpm": {
+        "critical_below": 500,
+        "critical_risk": 1.0,
+        "warning_below": 1000,
+        "warning_risk": 0.3,
+    },
+    # 3. Physical handling
+    "vibration": {
+        "shock_above": 2.0,
+        "shock_risk": 1.0,
+    },
+}
+
+# Reason bitmask; labels are listed in the order they are reported
+REASON_TEMPERATURE = 1
+REASON_FAN_FAILURE = 2
+REASON_UNSTABLE_COOLING = 4
+REASON_SHOCK = 8
+REASON_LABELS = (
+    (REASON_TEMPERATURE, "Temperature Excursion"),
+    (REASON_FAN_FAILURE, "Cooling Fan Failure"),
+    (REASON_UNSTABLE_COOLING, "Unstable Cooling"),
+    (REASON_SHOCK, "Vibration/Shock Detected"),
+)
+
+
+def load_rules(path=None):
+    """DEFAULT_RULES deep-merged with the JSON file at `path` (or RISK_RULES_FILE)."""
+    rules = copy.deepcopy(DEFAULT_RULES)
+    path = path or os.getenv("RISK_RULES_FILE")
+    if path:
+        with open(path) as f:
+            for section, values in json.load(f).items():
+                rules.setdefault(section, {}).update(values)
+    return rules
+
+
+def reasons_text(mask):
+    """Bitmask -> the comma separated reason string stored in risk_reasons."""
+    return ", ".join(label for bit, label in REASON_LABELS if mask & bit)
+
+
+class RiskEngine:
+    def __init__(self, rules=None):
+        self.rules = rules or load_rules()
+        temp, rpm, vib = self.rules["temperature"], self.rules["rpm"], self.rules["vibration"]
+        self.temp_min = float(temp["min"])
+        self.temp_max = float(temp["max"])
+        self.base_risk = float(temp["base_risk"])
+        self.risk_per_minute = float(temp["risk_per_minute"])
+        self.unknown_duration_risk = float(temp["unknown_duration_risk"])
+        self.rpm_critical = float(rpm["critical_below"])
+        self.rpm_critical_risk = float(rpm["critical_risk"])
+        self.rpm_warning = float(rpm["warning_below"])
+        self.rpm_warning_risk = float(rpm["warning_risk"])
+        self.shock_above = float(vib["shock_above"])
+        self.shock_risk = float(vib["shock_risk"])
+
+    def is_compliant(self, temperature):
+        return self.temp_min <= temperature <= self.temp_max
+
+    def score_batch(self, temperature, vibration, rpm, duration_secs):
+        """
+        Scores N readings at once.
+
+        `duration_secs` is the time since the device's last compliant reading
+        (NaN when there is none). Returns (risk_probability float64[N],
+        reason_mask uint8[N]).
+        """
+        temperature = np.asarray(temperature, dtype=np.float64)
+        vibration = np.asarray(vibration, dtype=np.float64)
+        rpm = np.asarray(rpm, dtype=np.float64)
+        duration = np.asarray(duration_secs, dtype=np.float64)
+
+        excursion = (temperature < self.temp_min) | (temperature > self.temp_max)
+        temp_risk = np.where(
+            np.isnan(duration),
+            self.unknown_duration_risk,
+            np.minimum(self.base_risk + np.nan_to_num(duration) / 60.0 * self.risk_per_minute, 1.0),
+        )
+        temp_risk = np.where(excursion, temp_risk, 0.0)
+
+        fan_failure = rpm < self.rpm_critical
+        unstable = ~fan_failure & (rpm < self.rpm_warning)
+        rpm_risk = np.where(fan_failure, self.rpm_critical_risk,
+                            np.where(unstable, self.rpm_warning_risk, 0.0))
+
+        shock = vibration > self.shock_above
+        vib_risk = np.where(shock, self.shock_risk, 0.0)
+
+        risk = np.maximum(np.maximum(temp_risk, rpm_risk), vib_risk)
+        mask = (excursion * REASON_TEMPERATURE
+                | fan_failure * REASON_FAN_FAILURE
+                | unstable * REASON_UNSTABLE_COOLING
+                | shock * REASON_SHOCK).astype(np.uint8)
+        return risk, mask
+
+    def score_one(self, temperature, vibration, rpm, duration_secs):
+        """Scalar path with identical rules, for single live readings
+        (avoids NumPy call overhead). Returns (risk_probability, reason_mask)."""
+        mask = 0
+        temp_risk = 0.0
+        if not self.is_compliant(temperature):
+            mask |= REASON_TEMPERATURE
+            if duration_secs is None:
+                temp_risk = self.unknown_duration_risk
+            else:
+                temp_risk = min(self.base_risk + duration_secs / 60.0 * self.risk_per_minute, 1.0)
+
+        rpm_risk = 0.0
+        if rpm < self.rpm_critical:
+            rpm_risk = self.rpm_critical_risk
+            mask |= REASON_FAN_FAILURE
+        elif rpm < self.rpm_warning:
+            rpm_risk = self.rpm_warning_risk
+            mask |= REASON_UNSTABLE_COOLING
+
+        vib_risk = 0.0
+        if vibration > self.shock_above:
+            vib_risk = self.shock_risk
+            mask |= REASON_SHOCK
+
+        return max(temp_risk, rpm_risk, vib_risk), mask
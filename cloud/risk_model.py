@@ -0,0 +1,143 @@
+"""
+ML risk scoring with ml-model/motor_model.pkl (optional, RISK_SCORER=model).
+
+Port of the legacy /predict endpoint (htpp_old_code/main.py) to the SQL /
+MQTT pipeline: the failure probability is the model's predict_proba,
+smoothed as the mean over the device's last ML_WINDOW raw predictions.
+Differences from the legacy endpoint:
+- whole ingest batches go through one predict_proba call instead of one
+  1x3 array per reading (a 300-tree forest costs about the same for 1 row
+  as for 1000);
+- the rolling window is kept in memory per device instead of re-reading
+  the last 4 predictions from Firestore (it starts empty after a restart);
+- the model (and scikit-learn, the slow part) is loaded on first use, once
+  per process. Call preload() before forking workers so they share it.
+"""
+import os
+import time
+import pickle
+import threading
+from collections import deque
+import numpy as np
+
+ML_MODEL_PATH = os.getenv(
+    "ML_MODEL_PATH", os.path.join(os.path.dirname(os.path.abspath(__file__)), "ml-model", "motor_model.pkl")
+)
+ML_WINDOW = int(os.getenv("ML_WINDOW", 5))
+# Trees are evaluated sequentially by default: thread fan-out costs more than it saves at ingest batch sizes
+ML_N_JOBS = int(os.getenv("ML_N_JOBS", 1))
+
+_models = {}
+_models_lock = threading.Lock()
+
+
+def load_model(path=ML_MODEL_PATH, n_jobs=ML_N_JOBS):
+    """Unpickles the model once per process and path; returns (model, load_secs)."""
+    with _models_lock:
+        if path not in _models:
+            start = time.perf_counter()
+            with open(path, "rb") as f:
+                model = pickle.load(f)
+            if hasattr(model, "n_jobs"):
+                model.n_jobs = n_jobs
+            _models[path] = (model, time.perf_counter() - start)
+        return _models[path]
+
+
+def preload(path=ML_MODEL_PATH):
+    """Loads the model in the parent so forked workers inherit it (copy-on-write)."""
+    return load_model(path)[0]
+
+
+class RiskModel:
+    """Micro-batched predict_proba + per-device rolling mean."""
+
+    def __init__(self, path=ML_MODEL_PATH, window=ML_WINDOW):
+        self.path = path
+        self.window = window
+        self._windows = {}
+        self._lock = threading.Lock()
+        self._model = None
+        self._positive = None
+
+    @property
+    def model(self):
+        if self._model is None:
+            model, _ = load_model(self.path)
+            classes = list(getattr(model, "classes_", []))
+            # Failure class: 1 when labelled so, else the last column (legacy [0][1])
+            self._positive = classes.index(1) if 1 in classes else -1
+            self._model = model
+        return self._model
+
+    def predict(self, temperature, vibration, rpm):
+        """Raw failure probabilities for equally long sequences, one model call."""
+        features = np.column_stack((
+            np.asarray(temperature, dtype=np.float64),
+            np.asarray(vibration, dtype=np.float64),
+            np.asarray(rpm, dtype=np.float64),
+        ))
+        if not len(features):
+            return np.empty(0)
+        return self.model.predict_proba(features)[:, self._positive]
+
+    def score_batch(self, device_ids, temperature, vibration, rpm):
+        """
+        Smoothed probabilities for readings in arrival order. Each device's
+        window advances reading by reading, so a batch scores the same as
+        the readings one at a time.
+        """
+        raw = self.predict(temperature, vibration, rpm).tolist()
+        smoothed = []
+        with self._lock:
+            for device_id, probability in zip(device_ids, raw):
+                window = self._windows.get(device_id)
+                if window is None:
+                    window = self._windows[device_id] = deque(maxlen=self.window)
+                window.append(probability)
+                smoothed.append(sum(window) / len(window))
+        return np.asarray(smoothed)
+
+    def score_one(self, device_id, temperature, vibration, rpm):
+        return float(self.score_batch([device_id], [temperature], [vibration], [rpm])[0])
+
+    def checkpoint(self, device_ids):
+        """Copies the smoothing windows of `device_ids`, see restore()."""
+        with self._lock:
+            return {device_id: None if device_id not in self._windows else
+                    deque(self._windows[device_id], maxlen=self.window)
+                    for device_id in device_ids}
+
+    def restore(self, checkpoint):
+        with self._lock:
+            for device_id, window in checkpoint.items():
+                if window is None:
+                    self._windows.pop(device_id, None)
+                else:
+                    self._windows[device_id] = window
+
+    def reset(self, device_id=None):
+        with self._lock:
+            if device_id is None:
+                self._windows.clear()
+            else:
+                self._windows.pop(device_id, None)
+
+
+class ModelRiskEngine:
+    """
+    RiskEngine-compatible wrapper for the batch paths (late readings,
+    re-scoring): model probabilities with the rule engine's reason masks.
+    Readings scored this way are not smoothed, since they do not arrive
+    in device order.
+    """
+
+    def __init__(self, engine, model):
+        self.engine = engine
+        self.model = model
+        self.temp_min = engine.temp_min
+        self.temp_max = engine.temp_max
+
+    def score_batch(self, temperature, vibration, rpm, duration_secs):
+        _, masks = self.engine.score_batch(temperature, vibration, rpm, duration_secs)
+        return self.model.predict(temperature, vibration, rpm), masks
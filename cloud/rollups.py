@@ -0,0 +1,225 @@
+"""
+Pre-aggregated 1-minute / 1-hour rollups of sensor_data.
+
+The subscriber folds every ingest batch into `sensor_rollups` in the same
+transaction as the raw rows; history_api reads rollups for long windows.
+Gaps (e.g. data ingested before rollups existed) are filled with:
+
+    python rollups.py rebuild --since 2026-01-01 [--until 2026-02-01] [--device reefer-042]
+"""
+import os
+import argparse
+from datetime import datetime, timedelta, timezone
+from dotenv import load_dotenv
+from sqlalchemy import (
+    Column, MetaData, Table, String, Integer, DateTime, Float,
+    select, delete, func,
+)
+from sqlalchemy.dialects import postgresql, sqlite
+import archive
+
+load_dotenv()
+
+RESOLUTIONS = (60, 3600)
+# Gaps longer than this (e.g. device offline) are not counted as excursion time
+ROLLUP_MAX_GAP_SECS = float(os.getenv("ROLLUP_MAX_GAP_SECS", 300))
+
+metadata = MetaData()
+sensor_rollups = Table(
+    "sensor_rollups", metadata,
+    Column("device_id", String, primary_key=True),
+    Column("resolution", Integer, primary_key=True),  # bucket width in seconds
+    Column("bucket_start", DateTime, primary_key=True),
+    Column("count", Integer, nullable=False),
+    Column("temp_min", Float),
+    Column("temp_max", Float),
+    Column("temp_sum", Float),
+    Column("vib_max", Float),
+    Column("rpm_min", Float),
+    Column("excursion_secs", Float),
+    Column("risk_max", Float),
+)
+
+
+def bucket_start(ts, resolution):
+    epoch = int(ts.replace(tzinfo=timezone.utc).timestamp())
+    return datetime.utcfromtimestamp(epoch - epoch % resolution)
+
+
+class RollupAccumulator:
+    """
+    Folds readings into per-(device, resolution, bucket) partial aggregates.
+    Excursion seconds are the gaps between consecutive readings of a device
+    that end in an out-of-range reading, so it keeps each device's last
+    reading time across batches.
+    """
+
+    def __init__(self, temp_min=2.0, temp_max=8.0):
+        self.temp_min = temp_min
+        self.temp_max = temp_max
+        self.last_seen = {}
+        self.pending = {}
+
+    def add(self, device_id, timestamp, temperature, vibration, rpm, risk):
+        previous = self.last_seen.get(device_id)
+        self.last_seen[device_id] = timestamp
+        excursion = 0.0
+        if previous is not None and not (self.temp_min <= temperature <= self.temp_max):
+            gap = (timestamp - previous).total_seconds()
+            if 0 < gap <= ROLLUP_MAX_GAP_SECS:
+                excursion = gap
+
+        for resolution in RESOLUTIONS:
+            key = (device_id, resolution, bucket_start(timestamp, resolution))
+            row = self.pending.get(key)
+            if row is None:
+                self.pending[key] = {
+                    "device_id": device_id, "resolution": resolution, "bucket_start": key[2],
+                    "count": 1, "temp_min": temperature, "temp_max": temperature,
+                    "temp_sum": temperature, "vib_max": vibration, "rpm_min": rpm,
+                    "excursion_secs": excursion, "risk_max": risk,
+                }
+            else:
+                row["count"] += 1
+                row["temp_min"] = min(row["temp_min"], temperature)
+                row["temp_max"] = max(row["temp_max"], temperature)
+                row["temp_sum"] += temperature
+                row["vib_max"] = max(row["vib_max"], vibration)
+                row["rpm_min"] = min(row["rpm_min"], rpm)
+                row["excursion_secs"] += excursion
+                row["risk_max"] = max(row["risk_max"], risk)
+
+    def drain(self):
+        rows = list(self.pending.values())
+        self.pending = {}
+        return rows
+
+    def checkpoint(self, device_ids):
+        """Last reading times of `device_ids`, see restore()."""
+        return {device_id: self.last_seen.get(device_id) for device_id in device_ids}
+
+    def restore(self, checkpoint):
+        """Undoes a failed batch: its partial aggregates are dropped."""
+        self.pending = {}
+        for device_id, timestamp in checkpoint.items():
+            if timestamp is None:
+                self.last_seen.pop(device_id, None)
+            else:
+                self.last_seen[device_id] = timestamp
+
+
+def upsert_rollups(conn, rows):
+    """Merges partial aggregates into sensor_rollups (INSERT ... ON CONFLICT)."""
+    if not rows:
+        return
+    bind = conn.get_bind() if hasattr(conn, "get_bind") else conn
+    if bind.dialect.name == "postgresql":
+        stmt = postgresql.insert(sensor_rollups)
+        least, greatest = func.least, func.greatest
+    else:
+        stmt = sqlite.insert(sensor_rollups)
+        least, greatest = func.min, func.max  # scalar min()/max() with two args
+
+    current, new = sensor_rollups.c, stmt.excluded
+    stmt = stmt.on_conflict_do_update(
+        index_elements=["device_id", "resolution", "bucket_start"],
+        set_={
+            "count": current.count + new.count,
+            "temp_min": least(current.temp_min, new.temp_min),
+            "temp_max": greatest(current.temp_max, new.temp_max),
+            "temp_sum": current.temp_sum + new.temp_sum,
+            "vib_max": greatest(current.vib_max, new.vib_max),
+            "rpm_min": least(current.rpm_min, new.rpm_min),
+            "excursion_secs": current.excursion_secs + new.excursion_secs,
+            "risk_max": greatest(current.risk_max, new.risk_max),
+        },
+    )
+    conn.execute(stmt, rows)
+
+
+def last_readings(conn, sensor_model, since, device_id=None):
+    """{device_id: time of its last reading in the ROLLUP_MAX_GAP_SECS before `since`}."""
+    SensorData = sensor_model
+    query = select(SensorData.device_id, func.max(SensorData.timestamp))\
+        .where(SensorData.timestamp < since,
+               SensorData.timestamp >= since - timedelta(seconds=ROLLUP_MAX_GAP_SECS))\
+        .group_by(SensorData.device_id)
+    if device_id:
+        query = query.where(SensorData.device_id == device_id)
+    return dict(conn.execute(query).all())
+
+
+def rebuild(engine, sensor_model, risk_model, since, until=None, device_id=None,
+            temp_min=2.0, temp_max=8.0, chunk_size=10000):
+    """
+    Recomputes rollups for [since, until) from raw rows. The window is widened
+    to whole hours so every affected bucket is replaced, not merged into.
+    """
+    with engine.begin() as conn:
+        return rebuild_range(conn, sensor_model, risk_model, since, until, device_id,
+                             temp_min, temp_max, chunk_size)
+
+
+def rebuild_range(conn, sensor_model, risk_model, since, until=None, device_id=None,
+                  temp_min=2.0, temp_max=8.0, chunk_size=10000):
+    """rebuild() inside the caller's transaction (a Connection or Session)."""
+    SensorData, RiskAssessment = sensor_model, risk_model
+    since = bucket_start(since, 3600)
+    until = bucket_start(until or datetime.utcnow(), 3600) + timedelta(hours=1)
+
+    clear = delete(sensor_rollups).where(
+        sensor_rollups.c.bucket_start >= since, sensor_rollups.c.bucket_start < until
+    )
+    if device_id:
+        clear = clear.where(sensor_rollups.c.device_id == device_id)
+    conn.execute(clear)
+
+    query = select(
+        SensorData.device_id, SensorData.timestamp, SensorData.temperature,
+        SensorData.vibration, SensorData.rpm, RiskAssessment.risk_probability,
+    ).join(RiskAssessment, RiskAssessment.sensor_data_id == SensorData.id)\
+        .where(SensorData.timestamp >= since, SensorData.timestamp < until)
+    if device_id:
+        query = query.where(SensorData.device_id == device_id)
+    query = query.order_by(SensorData.device_id, SensorData.timestamp)
+
+    # Seeded like incremental ingest, so the first rebuilt reading gets its gap
+    accumulator = RollupAccumulator(temp_min, temp_max)
+    accumulator.last_seen.update(last_readings(conn, SensorData, since, device_id))
+    result = conn.execute(query, execution_options={"stream_results": True, "yield_per": chunk_size})
+    count = 0
+    for partition in result.partitions():
+        for row in partition:
+            if row.device_id not in accumulator.last_seen and since == bucket_start(since, 86400):
+                # The day before may be archived (retention.previous_reading)
+                archived = archive.read_device_day(since - timedelta(days=1), row.device_id)
+                if archived:
+                    accumulator.last_seen[row.device_id] = archived[-1].timestamp
+            accumulator.add(row.device_id, row.timestamp, row.temperature,
+                            row.vibration, row.rpm, row.risk_probability or 0.0)
+        count += len(partition)
+        # Buckets still open at the chunk edge are merged by the upsert
+        upsert_rollups(conn, accumulator.drain())
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Maintain sensor_rollups")
+    sub = parser.add_subparsers(dest="command", required=True)
+    rb = sub.add_parser("rebuild", help="recompute rollups from raw rows for a time range")
+    rb.add_argument("--since", required=True, help="ISO timestamp (UTC)")
+    rb.add_argument("--until", help="ISO timestamp (UTC), default now")
+    rb.add_argument("--device")
+    args = parser.parse_args()
+
+    from db import engine as db, SensorData, RiskAssessment
+    from risk_engine import RiskEngine
+    from cache import data_version
+
+    metadata.create_all(db)
+    rules = RiskEngine()
+    count = rebuild(db, SensorData, RiskAssessment, datetime.fromisoformat(args.since),
+                    datetime.fromisoformat(args.until) if args.until else None,
+                    args.device, rules.temp_min, rules.temp_max)
+    data_version.bump()
+    print(f"✅ Rebuilt rollups from {count:,} readings")
@@ -1,6 +1,9 @@
 -- Sensor Data Table
 CREATE TABLE sensor_data (
     id SERIAL PRIMARY KEY,
+    device_id VARCHAR NOT NULL DEFAULT 'default',
+    shipment_id VARCHAR,
+    seq BIGINT, -- device sequence number / sample epoch ms (store-and-forward dedupe)
     temperature FLOAT NOT NULL,
     vibration FLOAT NOT NULL,
     rpm FLOAT NOT NULL,
@@ -10,8 +13,69 @@ CREATE TABLE sensor_data (
 -- Risk Assessments Table
 CREATE TABLE risk_assessments (
     id SERIAL PRIMARY KEY,
+    device_id VARCHAR NOT NULL DEFAULT 'default',
     sensor_data_id INTEGER REFERENCES sensor_data(id),
     risk_probability FLOAT NOT NULL,
     risk_reasons TEXT,
     timestamp TIMESTAMP DEFAULT CURRENT_TIMESTAMP
 );
+
+-- Per-device lookups (history, latest, excursion rebuild)
+CREATE INDEX ix_sensor_data_device_timestamp ON sensor_data (device_id, timestamp);
+CREATE INDEX ix_risk_assessments_device_timestamp ON risk_assessments (device_id, timestamp);
+
+-- Range filters / ORDER BY timestamp and the history JOIN
+CREATE INDEX ix_sensor_data_timestamp ON sensor_data (timestamp);
+CREATE INDEX ix_risk_assessments_sensor_data_id ON risk_assessments (sensor_data_id);
+
+-- "Last compliant reading" lookups only touch 2-8 °C rows
+CREATE INDEX ix_sensor_data_compliant ON sensor_data (device_id, timestamp)
+    WHERE temperature >= 2.0 AND temperature <= 8.0;
+
+-- Duplicate uplink samples are skipped (INSERT ... ON CONFLICT DO NOTHING).
+-- timestamp is part of the key: device seq counters restart at 0 on reboot
+CREATE UNIQUE INDEX ux_sensor_data_device_seq ON sensor_data (device_id, seq, timestamp)
+    WHERE seq IS NOT NULL;
+
+-- 1-minute / 1-hour aggregates maintained at ingest (resolution in seconds)
+CREATE TABLE sensor_rollups (
+    device_id VARCHAR NOT NULL,
+    resolution INTEGER NOT NULL,
+    bucket_start TIMESTAMP NOT NULL,
+    count INTEGER NOT NULL,
+    temp_min FLOAT,
+    temp_max FLOAT,
+    temp_sum FLOAT,
+    vib_max FLOAT,
+    rpm_min FLOAT,
+    excursion_secs FLOAT,
+    risk_max FLOAT,
+    PRIMARY KEY (device_id, resolution, bucket_start)
+);
+
+-- Per-shipment compliance state maintained at ingest ('' = no shipment)
+CREATE TABLE shipment_compliance (
+    shipment_id VARCHAR NOT NULL,
+    device_id VARCHAR NOT NULL,
+    first_seen TIMESTAMP,
+    last_seen TIMESTAMP,
+    last_temperature FLOAT,
+    readings INTEGER NOT NULL,
+    out_of_range_readings INTEGER NOT NULL,
+    secs_below FLOAT NOT NULL,
+    secs_above FLOAT NOT NULL,
+    secs_unmonitored FLOAT NOT NULL,
+    excursions INTEGER NOT NULL,
+    in_excursion BOOLEAN NOT NULL,
+    excursion_start TIMESTAMP,
+    excursion_secs FLOAT NOT NULL,
+    longest_excursion_start TIMESTAMP,
+    longest_excursion_secs FLOAT NOT NULL,
+    temp_min FLOAT,
+    temp_max FLOAT,
+    mkt_sum FLOAT NOT NULL,
+    mkt_comp FLOAT NOT NULL,
+    PRIMARY KEY (shipment_id, device_id)
+);
+
+-- Existing databases: run `python migrate.py upgrade` instead of this file.
@@ -1,13 +1,22 @@
+import os
+import sys
 import json
 import time
 import random
 import paho.mqtt.client as mqtt
 from paho.mqtt.enums import CallbackAPIVersion
+import uplink
 
 # Configuration
 BROKER = "34.29.164.71"  # Your GCP VM IP
 PORT = 1883
-TOPIC = "cargo/coldchain/data"
+DEVICE_ID = os.getenv("DEVICE_ID")  # e.g. "reefer-042"; unset = legacy single-unit topic
+TOPIC = f"cargo/coldchain/{DEVICE_ID}/data" if DEVICE_ID else "cargo/coldchain/data"
+# PAYLOAD_FORMAT=bin sends the compact binary format (needs DEVICE_ID), buffering
+# BINARY_BATCH readings per message like a cellular unit would
+PAYLOAD_FORMAT = os.getenv("PAYLOAD_FORMAT", "json")
+BINARY_BATCH = int(os.getenv("BINARY_BATCH", 12))
+BINARY_TOPIC = f"cargo/coldchain/{DEVICE_ID}/bin"
 
 def on_connect(client, userdata, flags, rc, properties=None):
     if rc == 0:
@@ -15,7 +24,29 @@ def on_connect(client, userdata, flags, rc, properties=None):
     else:
         print(f"❌ Connection failed with code {rc}")
 
+def make_reading(failure_rate=0.1):
+    """One reading: "Normal" conditions with random noise, or an occasional failure event."""
+    temp = round(random.uniform(3.0, 7.0), 1)
+    vib = round(random.uniform(0.1, 0.5), 2)
+    rpm = int(random.uniform(1400, 1600))
+
+    # Occasional "Issues" (10% chance)
+    if random.random() < failure_rate:
+        temp = round(random.uniform(9.0, 15.0), 1)  # High Temp
+        rpm = int(random.uniform(0, 400))           # Fan Stopped
+        vib = round(random.uniform(2.0, 5.0), 2)    # Shock
+
+    return {
+        "temperature": temp,
+        "vibration": vib,
+        "rpm": rpm,
+        # Timestamp is added by backend if missing, or we can add it here
+        "timestamp": int(time.time())
+    }
+
 def simulate_data():
+    if PAYLOAD_FORMAT == "bin" and not DEVICE_ID:
+        sys.exit("❌ PAYLOAD_FORMAT=bin needs DEVICE_ID (binary is only accepted on per-device topics)")
     client = mqtt.Client(callback_api_version=CallbackAPIVersion.VERSION2)
     client.on_connect = on_connect
 
@@ -28,32 +59,27 @@ def simulate_data():
         return
 
     print("📤 Starting data simulation (Ctrl+C to stop)...")
+    buffered = []
+    seq = 0
     
     # Simulation loop
     try:
         while True:
-            # Simulate "Normal" conditions with some random noise
-            temp = round(random.uniform(3.0, 7.0), 1)
-            vib = round(random.uniform(0.1, 0.5), 2)
-            rpm = int(random.uniform(1400, 1600))
-
-            # Occasional "Issues" (10% chance)
-            if random.random() < 0.1:
+            payload = make_reading()
+            if payload["rpm"] < 500:
                 print("⚠️ Simulating FAILURE event...")
-                temp = round(random.uniform(9.0, 15.0), 1)  # High Temp
-                rpm = int(random.uniform(0, 400))           # Fan Stopped
-                vib = round(random.uniform(2.0, 5.0), 2)    # Shock
-
-            payload = {
-                "temperature": temp,
-                "vibration": vib,
-                "rpm": rpm,
-                # Timestamp is added by backend if missing, or we can add it here
-                "timestamp": int(time.time())
-            }
 
-            client.publish(TOPIC, json.dumps(payload))
-            print(f"Published: {json.dumps(payload)}")
+            if PAYLOAD_FORMAT == "bin":
+                buffered.append(payload)
+                if len(buffered) >= BINARY_BATCH:
+                    message = uplink.encode(buffered, DEVICE_ID, seq=seq)
+                    client.publish(BINARY_TOPIC, message)
+                    print(f"Published: {len(buffered)} readings in {len(message)} bytes (binary)")
+                    seq += len(buffered)
+                    buffered = []
+            else:
+                client.publish(TOPIC, json.dumps(payload))
+                print(f"Published: {json.dumps(payload)}")
             
             time.sleep(5) # Send data every 5 seconds
 
@@ -0,0 +1,459 @@
+"""
+Write-ahead spool for the ingest writer (BatchWriter in mqtt_subscriber.py).
+
+Every batch is appended to a local segment file and fsynced before its DB
+transaction, and acknowledged after the commit. When a transaction fails
+because the database is unavailable the batch stays pending. Later batches
+are only appended (no DB attempt) until SPOOL_RETRY_SECS have passed. Pending
+batches are then replayed oldest first, merged into chunks of up to
+SPOOL_REPLAY_BATCH readings, while new batches keep being appended behind them.
+
+    SPOOL_DIR/00000001.seg  00000002.seg  ...
+
+Segment: 8-byte MAGIC, then records (little-endian)
+
+    u32 length | u32 crc32(type + body) | u8 type | body
+
+    BATCH body: u64 appended_at (epoch µs) | u32 count | count readings:
+        i64 received_at µs | f64 temperature | f64 vibration | f64 rpm |
+        i64 seq | u8 flags | u16 len, device_id | [u16 len, shipment_id]
+    ACK body:   u32 count | count x (u32 segment, u32 offset of a BATCH record)
+
+A segment is closed at SPOOL_SEGMENT_BYTES. The oldest segment is deleted
+once all of its batches are acknowledged, so a healthy spool holds about
+one segment. ACKs are not fsynced themselves (the next append syncs
+them). After a machine crash a committed batch can therefore be replayed:
+readings with a seq are deduplicated by the insert, and readings without
+one are stored twice. A record torn by a crash mid-append is cut off when
+the spool is opened.
+
+Usage:
+    python spool.py status [--dir cloud/spool]
+"""
+import os
+import time
+import zlib
+import struct
+import argparse
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timedelta
+from dotenv import load_dotenv
+from logs import get_logger
+import metrics
+
+load_dotenv()
+
+# Empty SPOOL_DIR disables the spool (a failed batch is then dropped)
+SPOOL_DIR = os.getenv("SPOOL_DIR", os.path.join(os.path.dirname(os.path.abspath(__file__)), "spool"))
+SPOOL_SEGMENT_BYTES = int(os.getenv("SPOOL_SEGMENT_BYTES", 16 * 1024 * 1024))
+SPOOL_FSYNC = os.getenv("SPOOL_FSYNC", "1") not in ("0", "false", "False")
+SPOOL_RETRY_SECS = float(os.getenv("SPOOL_RETRY_SECS", 5))
+SPOOL_REPLAY_BATCH = int(os.getenv("SPOOL_REPLAY_BATCH", 5000))
+# Pending readings kept decoded in memory; older backlog is read back from disk
+SPOOL_MEMORY_READINGS = int(os.getenv("SPOOL_MEMORY_READINGS", 50000))
+
+MAGIC = b"CCSPOOL1"
+RECORD = struct.Struct("<IIB")
+BATCH_HEADER = struct.Struct("<QI")
+READING = struct.Struct("<qdddqBH")
+ACK_ENTRY = struct.Struct("<II")
+COUNT = struct.Struct("<I")
+LENGTH = struct.Struct("<H")
+
+BATCH, ACK = 1, 2
+HAS_SEQ, HAS_SHIPMENT, INT_RPM = 0x01, 0x02, 0x04
+
+EPOCH = datetime(1970, 1, 1)
+
+log = get_logger("spool")
+
+# A batch not yet committed: `readings` is None when it is only on disk
+Pending = namedtuple("Pending", ("count", "appended_at", "readings"))
+
+
+class SpoolError(Exception):
+    """Unreadable spool record (bad magic, checksum or length)."""
+
+
+def _micros(ts):
+    return (ts - EPOCH) // timedelta(microseconds=1)
+
+
+def encode_batch(readings, appended_at):
+    parts = [BATCH_HEADER.pack(appended_at, len(readings))]
+    for data in readings:
+        seq, shipment, rpm = data.get('seq'), data.get('shipment_id'), data['rpm']
+        flags = ((HAS_SEQ if seq is not None else 0) | (HAS_SHIPMENT if shipment is not None else 0)
+                 | (INT_RPM if isinstance(rpm, int) else 0))
+        device = data['device_id'].encode()
+        parts.append(READING.pack(_micros(data['received_at']), data['temperature'], data['vibration'],
+                                  rpm, seq or 0, flags, len(device)))
+        parts.append(device)
+        if shipment is not None:
+            shipment = str(shipment).encode()
+            parts.append(LENGTH.pack(len(shipment)))
+            parts.append(shipment)
+    return b"".join(parts)
+
+
+def decode_batch(body):
+    """BATCH body -> (appended_at µs, [reading dicts as parse_message makes them])."""
+    appended_at, count = BATCH_HEADER.unpack_from(body)
+    pos = BATCH_HEADER.size
+    readings = []
+    for _ in range(count):
+        received, temperature, vibration, rpm, seq, flags, length = READING.unpack_from(body, pos)
+        pos += READING.size
+        device = body[pos:pos + length].decode()
+        pos += length
+        shipment = None
+        if flags & HAS_SHIPMENT:
+            (length,) = LENGTH.unpack_from(body, pos)
+            pos += LENGTH.size
+            shipment = body[pos:pos + length].decode()
+            pos += length
+        readings.append({
+            'device_id': device,
+            'shipment_id': shipment,
+            'seq': seq if flags & HAS_SEQ else None,
+            'received_at': EPOCH + timedelta(microseconds=received),
+            'temperature': temperature,
+            'vibration': vibration,
+            'rpm': int(rpm) if flags & INT_RPM else rpm,
+        })
+    return appended_at, readings
+
+
+def encode_record(kind, body):
+    payload = bytes([kind]) + body
+    return RECORD.pack(len(body), zlib.crc32(payload), kind) + body
+
+
+def read_records(path):
+    """
+    Yields (offset, type, body) for every intact record of a segment,
+    stopping at the end of the file or at the first torn / corrupt record.
+    """
+    with open(path, "rb") as f:
+        if f.read(len(MAGIC)) != MAGIC:
+            raise SpoolError(f"{path}: not a spool segment")
+        offset = len(MAGIC)
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            length, crc, kind = RECORD.unpack(header)
+            body = f.read(length)
+            if len(body) < length or zlib.crc32(bytes([kind]) + body) != crc:
+                return
+            yield offset, kind, body
+            offset += RECORD.size + length
+
+
+def segment_path(directory, segment):
+    return os.path.join(directory, f"{segment:08d}.seg")
+
+
+def segments(directory):
+    """Segment numbers in `directory`, oldest first."""
+    try:
+        names = os.listdir(directory)
+    except FileNotFoundError:
+        return []
+    return sorted(int(name[:-4]) for name in names if name.endswith(".seg") and name[:-4].isdigit())
+
+
+def _fsync_dir(directory):
+    fd = os.open(directory, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class Spool:
+    """
+    Append-only log of writer batches, keyed by (segment, offset). Used by
+    one writer thread; the metrics getters may run on other threads.
+    """
+
+    def __init__(self, directory=SPOOL_DIR, segment_bytes=SPOOL_SEGMENT_BYTES, fsync=SPOOL_FSYNC,
+                 retry_secs=SPOOL_RETRY_SECS, replay_batch=SPOOL_REPLAY_BATCH,
+                 memory_readings=SPOOL_MEMORY_READINGS):
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.fsync = fsync
+        self.retry_secs = retry_secs
+        self.replay_batch = replay_batch
+        self.memory_readings = memory_readings
+        self.pending = OrderedDict()    # (segment, offset) -> Pending, oldest first
+        self.unacked = {}               # segment -> pending batches in it
+        self.pending_readings = 0
+        self.memory = 0                 # readings held in Pending.readings
+        self.retry_at = 0.0
+        self.replaying = False          # draining a backlog (outage or restart)
+        self.replayed = 0
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+        self._recover()
+        self._open_segment((segments(directory) or [0])[-1] + 1)
+        metrics.spool_pending_readings.set_function(lambda: self.pending_readings)
+        metrics.spool_replay_lag_seconds.set_function(self.replay_lag)
+        metrics.spool_bytes.set_function(self.size)
+
+    def _recover(self):
+        """Rebuilds the pending set from the segments left by a previous run."""
+        for segment in segments(self.directory):
+            path = segment_path(self.directory, segment)
+            end = len(MAGIC)
+            try:
+                for offset, kind, body in read_records(path):
+                    end = offset + RECORD.size + len(body)
+                    if kind == BATCH:
+                        appended_at, count = BATCH_HEADER.unpack_from(body)
+                        self._add_pending((segment, offset), Pending(count, appended_at, None))
+                    elif kind == ACK:
+                        (count,) = COUNT.unpack_from(body)
+                        for i in range(count):
+                            key = ACK_ENTRY.unpack_from(body, COUNT.size + i * ACK_ENTRY.size)
+                            if key in self.pending:
+                                self._remove_pending(key)
+            except SpoolError as e:
+                log.error("❌ Skipping unreadable spool segment", path=path, error=e)
+                continue
+            if os.path.getsize(path) > end:
+                # Torn tail of a crashed append: later records cannot be trusted
+                log.warning("⚠️ Truncating spool segment", path=path, kept=end,
+                            dropped_bytes=os.path.getsize(path) - end)
+                with open(path, "r+b") as f:
+                    f.truncate(end)
+                    os.fsync(f.fileno())
+            self.unacked.setdefault(segment, 0)
+        self._delete_acked_segments(keep=None)
+        if self.pending:
+            self.replaying = True
+            log.info("📼 Spool has pending readings", batches=len(self.pending),
+                     readings=self.pending_readings, dir=self.directory)
+
+    def _open_segment(self, segment):
+        self.segment = segment
+        self.file = open(segment_path(self.directory, segment), "ab")
+        self.file.write(MAGIC)
+        self.file.flush()
+        self.offset = len(MAGIC)
+        self.unacked[segment] = 0
+        if self.fsync:
+            os.fsync(self.file.fileno())
+            _fsync_dir(self.directory)
+
+    def _write(self, record, sync):
+        offset = self.offset
+        self.file.write(record)
+        self.file.flush()
+        self.offset += len(record)
+        if sync and self.fsync:
+            started = time.perf_counter()
+            os.fsync(self.file.fileno())
+            metrics.spool_fsync_seconds.observe(time.perf_counter() - started)
+        return offset
+
+    def _add_pending(self, key, entry):
+        with self._lock:
+            self.pending[key] = entry
+            self.pending_readings += entry.count
+        self.unacked[key[0]] = self.unacked.get(key[0], 0) + 1
+        if entry.readings is not None:
+            self.memory += entry.count
+
+    def _remove_pending(self, key):
+        with self._lock:
+            entry = self.pending.pop(key)
+            self.pending_readings -= entry.count
+        self.unacked[key[0]] -= 1
+        if entry.readings is not None:
+            self.memory -= entry.count
+
+    def _delete_acked_segments(self, keep):
+        """Deletes fully acknowledged segments from the oldest on (never `keep`)."""
+        for segment in sorted(self.unacked):
+            if segment == keep or self.unacked[segment]:
+                return
+            os.remove(segment_path(self.directory, segment))
+            del self.unacked[segment]
+
+    def append(self, readings):
+        """Appends one batch durably (fsync) and marks it pending."""
+        if not readings:
+            return None
+        appended_at = _micros(datetime.utcnow())
+        offset = self._write(encode_record(BATCH, encode_batch(readings, appended_at)), sync=True)
+        key = (self.segment, offset)
+        keep = readings if self.memory + len(readings) <= self.memory_readings else None
+        self._add_pending(key, Pending(len(readings), appended_at, keep))
+        if self.offset >= self.segment_bytes:
+            self.file.close()
+            self._open_segment(self.segment + 1)
+        return key
+
+    def ack(self, keys):
+        """Marks batches committed: one ACK record, synced with the next append."""
+        body = COUNT.pack(len(keys)) + b"".join(ACK_ENTRY.pack(*key) for key in keys)
+        self._write(encode_record(ACK, body), sync=False)
+        for key in keys:
+            self._remove_pending(key)
+        self._delete_acked_segments(keep=self.segment)
+
+    def load(self, key):
+        """Readings of one pending batch (from memory, else from its segment)."""
+        entry = self.pending[key]
+        if entry.readings is not None:
+            return entry.readings
+        segment, offset = key
+        with open(segment_path(self.directory, segment), "rb") as f:
+            f.seek(offset)
+            length, crc, kind = RECORD.unpack(f.read(RECORD.size))
+            body = f.read(length)
+        if kind != BATCH or zlib.crc32(bytes([kind]) + body) != crc:
+            raise SpoolError(f"segment {segment} offset {offset}: corrupt batch record")
+        return decode_batch(body)[1]
+
+    def next_chunk(self):
+        """Oldest pending batches, whole, up to replay_batch readings (at least one batch)."""
+        keys, readings, corrupt = [], [], []
+        for key, entry in self.pending.items():
+            if keys and len(readings) + entry.count > self.replay_batch:
+                break
+            try:
+                readings.extend(self.load(key))
+            except SpoolError as e:
+                log.error("❌ Dropping unreadable spooled batch", readings=entry.count, error=e)
+                corrupt.append(key)
+                continue
+            keys.append(key)
+        if corrupt:
+            self.ack(corrupt)
+        return keys, readings
+
+    def waiting(self):
+        """Seconds until pending batches may be retried (0: now, None: nothing pending)."""
+        if not self.pending:
+            return None
+        return max(0.0, self.retry_at - time.monotonic())
+
+    def drain(self, process):
+        """
+        Feeds the oldest pending chunk to process(readings), which returns
+        "ok", "error" (unprocessable, dropped as before the spool) or
+        "unavailable" (database down: keep it and retry in retry_secs). A
+        chunk that fails with "error" is retried batch by batch, so one bad
+        batch does not take the rest of a replay chunk with it.
+        """
+        if not self.pending or time.monotonic() < self.retry_at:
+            return
+        keys, readings = self.next_chunk()
+        if not keys:
+            return
+        result = process(readings)
+        if result == "error" and len(keys) > 1:
+            done = []
+            for key in keys:
+                result = process(self.load(key))
+                if result == "unavailable":
+                    break
+                done.append(key)
+            if done:
+                self._acked(done)
+        elif result != "unavailable":
+            self._acked(keys)
+        if result == "unavailable":
+            self.retry_at = time.monotonic() + self.retry_secs
+            if not self.replaying:
+                log.warning("🛑 Database unavailable, spooling readings", dir=self.directory,
+                            retry_in=self.retry_secs)
+            self.replaying = True
+
+    def _acked(self, keys):
+        count = sum(self.pending[key].count for key in keys)
+        self.ack(keys)
+        if self.replaying:
+            self.replayed += count
+            metrics.spool_replayed_readings_total.inc(count)
+            if not self.pending:
+                log.info("✅ Spool drained", replayed=self.replayed)
+                self.replaying = False
+                self.replayed = 0
+
+    def replay_lag(self):
+        """Age in seconds of the oldest pending batch (0 when caught up)."""
+        with self._lock:
+            oldest = next(iter(self.pending.values()), None)
+        if oldest is None:
+            return 0.0
+        return max(0.0, _micros(datetime.utcnow()) - oldest.appended_at) / 1e6
+
+    def size(self):
+        total = 0
+        for segment in segments(self.directory):
+            try:
+                total += os.path.getsize(segment_path(self.directory, segment))
+            except FileNotFoundError:
+                continue
+        return total
+
+    def close(self):
+        if self.fsync:
+            os.fsync(self.file.fileno())
+        self.file.close()
+        # An idle spool leaves nothing behind
+        if not self.unacked.get(self.segment):
+            self._delete_acked_segments(keep=None)
+
+
+def status(directory):
+    """Pending batches / readings and on-disk size of a spool, without opening it for writing."""
+    pending, readings, acked, oldest = {}, 0, set(), None
+    for segment in segments(directory):
+        try:
+            for offset, kind, body in read_records(segment_path(directory, segment)):
+                if kind == BATCH:
+                    pending[(segment, offset)] = BATCH_HEADER.unpack_from(body)
+                elif kind == ACK:
+                    (count,) = COUNT.unpack_from(body)
+                    acked.update(ACK_ENTRY.unpack_from(body, COUNT.size + i * ACK_ENTRY.size)
+                                 for i in range(count))
+        except SpoolError:
+            continue
+    for key in acked:
+        pending.pop(key, None)
+    for appended_at, count in pending.values():
+        readings += count
+        oldest = appended_at if oldest is None else min(oldest, appended_at)
+    return {
+        "dir": directory,
+        "segments": len(segments(directory)),
+        "bytes": sum(os.path.getsize(segment_path(directory, s)) for s in segments(directory)),
+        "pending_batches": len(pending),
+        "pending_readings": readings,
+        "oldest_pending": (EPOCH + timedelta(microseconds=oldest)).isoformat() if oldest else None,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Inspect the ingest spool")
+    sub = parser.add_subparsers(dest="command", required=True)
+    status_cmd = sub.add_parser("status", help="pending readings and size (per worker directory too)")
+    status_cmd.add_argument("--dir", default=SPOOL_DIR)
+    args = parser.parse_args()
+
+    directories = [args.dir] + sorted(
+        os.path.join(args.dir, name) for name in (os.listdir(args.dir) if os.path.isdir(args.dir) else [])
+        if name.startswith("worker-")
+    )
+    for directory in directories:
+        info = status(directory)
+        if directory != args.dir and not info["segments"]:
+            continue
+        print(f"📼 {info['dir']}: {info['pending_readings']:,} pending readings in "
+              f"{info['pending_batches']:,} batches, {info['segments']} segments, "
+              f"{info['bytes'] / 1e6:.1f} MB, oldest {info['oldest_pending'] or '-'}")
@@ -0,0 +1,79 @@
+from datetime import datetime, timedelta
+import pytest
+from alerts import AlertEngine, OK, WARNING, CRITICAL
+
+T0 = datetime(2026, 5, 1)
+
+
+def engine():
+    return AlertEngine(warning_at=0.5, critical_at=0.8, hysteresis=0.1, min_hold_secs=60, heartbeat_secs=300)
+
+
+@pytest.mark.parametrize("probability, current, level", [
+    (0.85, OK, CRITICAL),
+    (0.55, OK, WARNING),
+    (0.45, OK, OK),
+    (0.75, CRITICAL, CRITICAL),   # within the hysteresis band
+    (0.65, CRITICAL, WARNING),
+    (0.45, CRITICAL, WARNING),    # warning's band keeps it from dropping to ok
+    (0.45, WARNING, WARNING),
+    (0.35, WARNING, OK),
+])
+def test_classify_hysteresis(probability, current, level):
+    assert engine().classify(probability, current) == level
+
+
+def test_first_reading_publishes_then_only_changes_and_heartbeats():
+    alerts = engine()
+    first = alerts.evaluate("reefer-042", 0.1, "", T0)
+    assert (first.level, first.previous, first.heartbeat) == (OK, None, False)
+    assert alerts.evaluate("reefer-042", 0.2, "", T0 + timedelta(seconds=299)) is None
+    heartbeat = alerts.evaluate("reefer-042", 0.2, "", T0 + timedelta(seconds=300))
+    assert (heartbeat.level, heartbeat.previous, heartbeat.heartbeat) == (OK, OK, True)
+
+
+def test_escalation_is_immediate_and_stepping_down_waits_for_min_hold():
+    alerts = engine()
+    alerts.evaluate("reefer-042", 0.1, "", T0)
+    critical = alerts.evaluate("reefer-042", 0.9, "High Temp", T0 + timedelta(seconds=1))
+    assert (critical.level, critical.previous) == (CRITICAL, OK)
+
+    assert alerts.evaluate("reefer-042", 0.1, "", T0 + timedelta(seconds=30)) is None
+    assert alerts.snapshot()["reefer-042"]["level"] == CRITICAL
+    recovered = alerts.evaluate("reefer-042", 0.1, "", T0 + timedelta(seconds=61))
+    assert (recovered.level, recovered.previous) == (OK, CRITICAL)
+
+
+def test_flapping_around_a_threshold_publishes_once():
+    alerts = engine()
+    alerts.evaluate("reefer-042", 0.1, "", T0)
+    published = [alerts.evaluate("reefer-042", p, "", T0 + timedelta(seconds=5 * i))
+                 for i, p in enumerate([0.52, 0.48, 0.51, 0.45, 0.53, 0.49], start=1)]
+    assert [alert.level for alert in published if alert is not None] == [WARNING]
+
+
+def test_evaluate_batch_publishes_every_level_change():
+    # ok -> critical -> ok inside one store-and-forward batch, 10 s apart
+    probabilities = [0.0] + [0.95] * 12 + [0.0] * 5
+    readings = [("reefer-042", p, "", T0 + timedelta(seconds=10 * i)) for i, p in enumerate(probabilities)]
+    batch = engine().evaluate_batch(readings)
+    assert [(alert.level, alert.previous, alert.heartbeat) for alert in batch] == \
+        [(OK, None, False), (CRITICAL, OK, False), (OK, CRITICAL, False)]
+
+    warm = engine()
+    warm.evaluate("reefer-042", 0.0, "", T0 - timedelta(seconds=10))
+    assert [(alert.level, alert.previous) for alert in warm.evaluate_batch(readings)] == \
+        [(CRITICAL, OK), (OK, CRITICAL)]
+
+
+def test_evaluate_batch_collapses_heartbeats():
+    alerts = engine()
+    alerts.evaluate("reefer-042", 0.1, "", T0)
+    alerts.evaluate("reefer-7", 0.1, "", T0)
+    batch = alerts.evaluate_batch(
+        [("reefer-042", 0.1, "", T0 + timedelta(seconds=300 * i)) for i in range(1, 4)]
+        + [("reefer-7", 0.1, "", T0 + timedelta(seconds=300)), ("reefer-7", 0.9, "", T0 + timedelta(seconds=301))]
+    )
+    assert [(alert.device_id, alert.level, alert.heartbeat) for alert in batch] == \
+        [("reefer-7", CRITICAL, False), ("reefer-042", OK, True)]
+    assert batch[1].timestamp == T0 + timedelta(seconds=900)
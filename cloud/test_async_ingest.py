@@ -0,0 +1,76 @@
+import asyncio
+from datetime import datetime
+from async_ingest import AsyncBatchWriter, AsyncIngestService, make_engine
+
+
+class RecordingWriter(AsyncBatchWriter):
+    """Flushes only record when each batch ran; the first one is slow."""
+
+    def __init__(self, **kwargs):
+        super().__init__(session_factory=None, **kwargs)
+        self.events = []
+
+    async def _flush(self, batch, earlier=()):
+        if earlier:
+            await asyncio.wait(earlier)
+        name = batch[0][0][0]["name"]
+        self.events.append(("start", name))
+        await asyncio.sleep(0.05 if name == "first" else 0)
+        self.events.append(("done", name))
+        for _, future in batch:
+            future.set_result(True)
+        self.slots.release()
+
+
+def scored(name, device_id, late=False):
+    data = {"name": name, "device_id": device_id, "received_at": datetime(2026, 5, 1)}
+    return (data, None if late else 0.1, None if late else "")
+
+
+async def write(*batches):
+    writer = RecordingWriter(max_size=1, max_latency_ms=0, concurrency=4)
+    writer.start()
+    futures = [await writer.submit(item) for item in batches]
+    await asyncio.gather(*futures)
+    await writer.stop()
+    return writer.events
+
+
+def test_late_batch_waits_for_earlier_batches_of_its_device():
+    events = asyncio.run(write(scored("first", "reefer-042"), scored("late", "reefer-042", late=True)))
+    assert events.index(("done", "first")) < events.index(("start", "late"))
+
+
+def test_other_devices_still_flush_concurrently():
+    events = asyncio.run(write(scored("first", "reefer-042"), scored("late", "reefer-7", late=True)))
+    assert events.index(("start", "late")) < events.index(("done", "first"))
+
+
+def test_batches_of_one_device_flush_in_order():
+    events = asyncio.run(write(scored("first", "reefer-042"), scored("second", "reefer-042")))
+    assert events.index(("done", "first")) < events.index(("start", "second"))
+
+
+def test_failed_flush_rolls_back_device_state(subscriber, monkeypatch):
+    def unavailable(*args, **kwargs):
+        raise RuntimeError("database gone")
+
+    monkeypatch.setattr(subscriber.compliance_tracker, "update", unavailable)
+    reading = {"device_id": "reefer-042", "seq": 0, "received_at": datetime(2026, 5, 1),
+               "temperature": 9.5, "vibration": 0.1, "rpm": 1500}
+
+    async def ingest():
+        service = AsyncIngestService(make_engine())
+        service.writer.start()
+        await service.pending.put(dict(reading))
+        await service.pending.put(None)
+        await service.score()
+        await asyncio.gather(*list(service.tasks))
+        await service.writer.stop()
+        await service.engine.dispose()
+        return service
+
+    service = asyncio.run(ingest())
+    assert subscriber.excursions.get("reefer-042") is None
+    assert "reefer-042" not in subscriber.rollup_accumulator.last_seen
+    assert not service.uncommitted and not service.saved
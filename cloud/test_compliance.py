@@ -0,0 +1,94 @@
+from datetime import datetime, timedelta
+import pytest
+from compliance import ComplianceState, ComplianceTracker, STATE_FIELDS, mkt_celsius, report
+from db import SessionLocal, SensorData
+
+T0 = datetime(2026, 5, 1)
+# Minute readings over 5 h with two excursions (one above, one below the band)
+TEMPERATURES = [5.0] * 60 + [9.5] * 30 + [6.0] * 90 + [1.0] * 20 + [4.0] * 100
+
+
+def readings(indexes, device_id="reefer-042", shipment_id=None):
+    return [{"device_id": device_id, "shipment_id": shipment_id, "seq": i, "vibration": 0.1, "rpm": 1500,
+             "received_at": T0 + timedelta(minutes=i), "temperature": TEMPERATURES[i]} for i in indexes]
+
+
+def full_recompute(key=("", "reefer-042")):
+    session = SessionLocal()
+    try:
+        return ComplianceTracker().recompute(session, SensorData, key)
+    finally:
+        session.close()
+
+
+def assert_same(state, expected):
+    for field in STATE_FIELDS:
+        got, want = getattr(state, field), getattr(expected, field)
+        if isinstance(want, float):
+            assert got == pytest.approx(want, rel=1e-12, abs=1e-9), field
+        else:
+            assert got == want, field
+
+
+def test_mkt_of_a_constant_temperature_is_that_temperature():
+    state = ComplianceState()
+    for i in range(1000):
+        state.add(T0 + timedelta(minutes=i), 5.0)
+    assert report(state)["mkt_c"] == pytest.approx(5.0, abs=1e-9)
+    assert mkt_celsius(0.0, 0) is None
+
+
+def test_excursion_figures():
+    state = ComplianceState()
+    for data in readings(range(len(TEMPERATURES))):
+        state.add(data["received_at"], data["temperature"])
+    assert state.excursions == 2
+    assert state.out_of_range_readings == 50
+    assert state.secs_above == 30 * 60 and state.secs_below == 20 * 60
+    assert state.longest_excursion_secs == 30 * 60
+    assert state.longest_excursion_start == T0 + timedelta(minutes=59)
+    assert not state.in_excursion
+
+
+def test_incremental_updates_match_a_full_recompute(subscriber):
+    for start in range(0, len(TEMPERATURES), 37):
+        subscriber.process_sensor_batch(readings(range(start, min(start + 37, len(TEMPERATURES)))))
+    assert_same(subscriber.compliance_tracker._states[("", "reefer-042")], full_recompute())
+
+
+def test_late_readings_replay_from_the_checkpoint_before_them(subscriber, monkeypatch):
+    missing = set(range(200, 215))  # inside the below-band excursion
+    on_time = [i for i in range(len(TEMPERATURES)) if i not in missing]
+    for start in range(0, len(on_time), 50):
+        subscriber.process_sensor_batch(readings(on_time[start:start + 50]))
+
+    tracker = subscriber.compliance_tracker
+    replayed_from = []
+    recompute = tracker.recompute
+    monkeypatch.setattr(tracker, "recompute",
+                        lambda session, model, key, since=None, *args: replayed_from.append(since)
+                        or recompute(session, model, key, since, *args))
+    subscriber.process_sensor_batch(readings(sorted(missing)))
+
+    assert replayed_from == [T0 + timedelta(hours=3)]
+    assert_same(tracker._states[("", "reefer-042")], full_recompute())
+
+
+def test_late_reading_older_than_every_checkpoint_replays_everything(subscriber, monkeypatch):
+    monkeypatch.setattr(subscriber.compliance_tracker, "max_checkpoints", 1)
+    subscriber.process_sensor_batch(readings(range(1, len(TEMPERATURES))))
+    subscriber.process_sensor_batch(readings([0]))
+    assert_same(subscriber.compliance_tracker._states[("", "reefer-042")], full_recompute())
+
+
+def test_idle_states_are_evicted_and_reloaded(subscriber, monkeypatch):
+    tracker = subscriber.compliance_tracker
+    monkeypatch.setattr(tracker, "max_states", 2)
+    for shipment_id in ("SHP-1", "SHP-2", "SHP-3"):
+        subscriber.process_sensor_batch(readings(range(10), shipment_id=shipment_id,
+                                                 device_id=f"logger-{shipment_id}"))
+    assert list(tracker._states) == [("SHP-2", "logger-SHP-2"), ("SHP-3", "logger-SHP-3")]
+
+    subscriber.process_sensor_batch(readings(range(10, 20), shipment_id="SHP-1", device_id="logger-SHP-1"))
+    assert_same(tracker._states[("SHP-1", "logger-SHP-1")], full_recompute(("SHP-1", "logger-SHP-1")))
+    assert ("SHP-2", "logger-SHP-2") not in tracker._states
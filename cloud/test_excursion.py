@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta
+import numpy as np
+import pytest
+from excursion import ExcursionTracker, replay_durations
+
+T0 = datetime(2026, 5, 1)
+TEMPERATURES = [9.0, 10.0, 5.0, 5.5, 9.0, 12.0, 1.0, 6.0, 8.0, 8.5, 2.0, -1.0]
+
+
+def tracker_durations(tracker, temperatures, start=0):
+    return [tracker.update("reefer-042", temperature, T0 + timedelta(seconds=30 * (start + i)))
+            for i, temperature in enumerate(temperatures)]
+
+
+def epochs(count, start=0):
+    return [(T0 + timedelta(seconds=30 * (start + i)) - datetime(1970, 1, 1)).total_seconds()
+            for i in range(count)]
+
+
+def as_nan(durations):
+    return np.array([np.nan if d is None else d for d in durations], dtype=np.float64)
+
+
+def test_replay_matches_the_tracker():
+    expected = tracker_durations(ExcursionTracker(), TEMPERATURES)
+    durations, _ = replay_durations(epochs(len(TEMPERATURES)), TEMPERATURES)
+    np.testing.assert_array_equal(durations, as_nan(expected))
+
+
+@pytest.mark.parametrize("split", [1, 2, 5, 9])
+def test_replay_carries_state_across_chunks(split):
+    expected = tracker_durations(ExcursionTracker(), TEMPERATURES)
+    first, carry = replay_durations(epochs(split), TEMPERATURES[:split])
+    second, _ = replay_durations(epochs(len(TEMPERATURES) - split, split), TEMPERATURES[split:], carry)
+    np.testing.assert_array_equal(np.concatenate([first, second]), as_nan(expected))
+
+
+def test_never_compliant_device_has_no_duration():
+    durations, carry = replay_durations(epochs(3), [9.0, 10.0, 11.0])
+    assert np.isnan(durations).all() and carry is None
+    assert tracker_durations(ExcursionTracker(), [9.0, 10.0, 11.0]) == [None, None, None]
+
+
+def test_tracker_checkpoint_restore():
+    tracker = ExcursionTracker()
+    tracker_durations(tracker, [5.0, 9.0])
+    saved = tracker.checkpoint(["reefer-042", "reefer-7"])
+    tracker.update("reefer-7", 5.0, T0)
+    tracker_durations(tracker, [5.0], start=2)
+    tracker.restore(saved)
+    assert tracker.get("reefer-7") is None
+    state = tracker.get("reefer-042")
+    assert (state.last_compliant, state.excursion_start, state.last_seen) == \
+        (T0, T0 + timedelta(seconds=30), T0 + timedelta(seconds=30))
+
+
+@pytest.mark.parametrize("late", [[3], [6, 7], [2, 3, 4, 5], [0, 1]])
+def test_update_late_matches_a_rebuild(subscriber, late):
+    temperatures = [5.0, 9.0, 4.0, 10.0, 11.0, 6.0, 12.0, 13.0, 14.0]
+    rows = [{"device_id": "reefer-042", "seq": i, "temperature": temperature, "vibration": 0.1, "rpm": 1500,
+             "received_at": T0 + timedelta(seconds=30 * i)} for i, temperature in enumerate(temperatures)]
+    subscriber.process_sensor_batch([data for i, data in enumerate(rows) if i not in late])
+
+    tracker = ExcursionTracker()
+    session = subscriber.SessionLocal()
+    try:
+        tracker.rebuild(session, subscriber.SensorData)
+        for i in late:
+            tracker.update_late("reefer-042", temperatures[i], rows[i]["received_at"])
+        subscriber.insert_sensor_rows(session, [rows[i] for i in late])
+        rebuilt = ExcursionTracker()
+        rebuilt.rebuild(session, subscriber.SensorData)
+    finally:
+        session.rollback()
+        session.close()
+    merged, expected = tracker.get("reefer-042"), rebuilt.get("reefer-042")
+    assert (merged.last_compliant, merged.last_seen) == (expected.last_compliant, expected.last_seen)
+    assert tracker.snapshot()["reefer-042"]["duration_secs"] == rebuilt.snapshot()["reefer-042"]["duration_secs"]
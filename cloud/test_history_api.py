@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta
+import pytest
+import history_api
+from cache import data_version
+
+
+@pytest.fixture
+def api(subscriber):
+    history_api.response_cache.clear()
+    subscriber.process_sensor_batch([{"device_id": "reefer-042", "seq": 0, "temperature": 5.0, "vibration": 0.1,
+                                      "rpm": 1500, "received_at": datetime(2026, 5, 1)}])
+    return history_api
+
+
+def cached_entries(api):
+    return len(api.response_cache._entries)
+
+
+@pytest.mark.parametrize("commit_meanwhile, cached", [(False, 1), (True, 0)])
+def test_response_is_cached_only_if_its_data_did_not_move(api, commit_meanwhile, cached):
+    def latest():
+        response = api.get_latest.__wrapped__()
+        if commit_meanwhile:
+            data_version.bump()
+        return response
+
+    with api.app.test_request_context("/api/latest"):
+        assert api.cached_response()(latest)().json["temperature"] == 5.0
+    assert cached_entries(api) == cached
+
+
+def test_hot_store_changes_move_the_cache_version(api):
+    client = api.app.test_client()
+    first = client.get("/api/latest")
+    assert client.get("/api/latest", headers={"If-None-Match": first.headers["ETag"]}).status_code == 304
+    version = api.current_version()
+    api.hot_store.disconnected()
+    assert api.current_version() != version
+
+
+@pytest.mark.parametrize("env, argv, watcher", [
+    ({}, ["gunicorn"], False),
+    ({"FLASK_RUN_FROM_CLI": "true"}, ["flask", "run"], False),
+    ({"FLASK_RUN_FROM_CLI": "true", "FLASK_DEBUG": "1"}, ["flask", "run"], True),
+    ({"FLASK_RUN_FROM_CLI": "true", "FLASK_DEBUG": "1"}, ["flask", "run", "--no-reload"], False),
+    ({"FLASK_RUN_FROM_CLI": "true", "FLASK_DEBUG": "1", "WERKZEUG_RUN_MAIN": "true"}, ["flask", "run"], False),
+])
+def test_live_feed_starts_in_serving_processes_only(api, monkeypatch, env, argv, watcher):
+    for name in ("FLASK_RUN_FROM_CLI", "FLASK_DEBUG", "WERKZEUG_RUN_MAIN"):
+        monkeypatch.delenv(name, raising=False)
+    for name, value in env.items():
+        monkeypatch.setenv(name, value)
+    monkeypatch.setattr("sys.argv", argv)
+    assert api.reloader_watcher() is watcher
+
+
+def test_forked_worker_restarts_the_live_feed(api, monkeypatch):
+    started = []
+    monkeypatch.setattr(api, "LIVE_FEED", True)
+    monkeypatch.setattr(api.live_feed, "start", lambda: started.append(api.live_feed.client))
+    api.live_feed.client = object()  # the parent's, without its thread
+    api.restart_live_feed()
+    assert started == [None]
+
+
+def test_requests_never_start_the_live_feed(api, monkeypatch):
+    def start():
+        raise AssertionError("live feed started by a request")
+
+    monkeypatch.setattr(api.live_feed, "start", start)
+    client = api.app.test_client()
+    assert client.get("/api/latest").json["temperature"] == 5.0
+    assert client.get("/api/stream").status_code == 503
+
+
+# Wide enough to reach the fixture's reading from today
+ALL = "minutes=10000000&device_id=reefer-042"
+
+
+@pytest.mark.parametrize("query", [
+    f"/api/history?{ALL}&bucket=1h&agg=max&source=raw",
+    f"/api/history?{ALL}&bucket=1h&agg=max&source=rollup",
+    f"/api/history?{ALL}&downsample=lttb&points=100",
+])
+def test_history_reductions(api, query):
+    rows = api.app.test_client().get(query).json
+    assert len(rows) == 1
+    assert rows[0].get("temperature", rows[0].get("temp_max")) == 5.0
+
+
+@pytest.mark.parametrize("query", [
+    "/api/history?bucket=", "/api/history?bucket=%20", "/api/history?bucket=5x",
+    "/api/history?minutes=abc", "/api/history?downsample=lttb&points=many", "/api/history?limit=1.5",
+    "/api/history/page?limit=ten", "/api/compliance?limit=x", "/api/stream?snapshot=all",
+])
+def test_bad_parameters_are_400(api, query):
+    response = api.app.test_client().get(query)
+    assert response.status_code == 400
+    assert "Invalid" in response.json["error"]
@@ -0,0 +1,34 @@
+from sqlalchemy import create_engine, inspect, text
+import migrate
+from db import Base
+
+
+def dedupe_index(engine):
+    (index,) = [ix for ix in inspect(engine).get_indexes("sensor_data") if ix["name"] == "ux_sensor_data_device_seq"]
+    return index["column_names"], bool(index["unique"])
+
+
+def test_upgrade_and_models_share_the_dedupe_key(tmp_path):
+    migrated = create_engine(f"sqlite:///{tmp_path / 'migrated.db'}")
+    migrate.upgrade(migrated)
+    created = create_engine(f"sqlite:///{tmp_path / 'created.db'}")
+    Base.metadata.create_all(created)
+    assert dedupe_index(migrated) == dedupe_index(created) == (["device_id", "seq", "timestamp"], True)
+
+
+def test_upgrade_replaces_the_pre_reboot_fix_index(tmp_path):
+    engine = create_engine(f"sqlite:///{tmp_path / 'legacy.db'}")
+    with engine.begin() as conn:
+        migrate._ensure_version_table(conn)
+    for version, description, apply in migrate.MIGRATIONS[:4]:
+        with engine.begin() as conn:
+            apply(conn, "sqlite")
+            conn.execute(text("INSERT INTO schema_migrations (version, description) VALUES (:v, :d)"),
+                         {"v": version, "d": description})
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE sensor_data ADD COLUMN seq BIGINT"))
+        conn.execute(text("CREATE UNIQUE INDEX ux_sensor_data_device_seq ON sensor_data (device_id, seq) "
+                          "WHERE seq IS NOT NULL"))
+        conn.execute(text("INSERT INTO schema_migrations (version, description) VALUES (5, 'old')"))
+    assert migrate.upgrade(engine) == [6, 7]
+    assert dedupe_index(engine) == (["device_id", "seq", "timestamp"], True)
@@ -0,0 +1,138 @@
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from sqlalchemy.exc import OperationalError
+import uplink
+from db import get_engine, SessionLocal, SensorData, RiskAssessment
+from rollups import sensor_rollups, rebuild_range
+
+BINARY_TOPIC = "cargo/coldchain/reefer-042/bin"
+T0 = datetime(2026, 5, 1)
+
+
+def binary_batch(subscriber, seq, uptime, arrival, count=12):
+    """One firmware-style message: `count` uptime-stamped samples, 5 s apart."""
+    message = uplink.encode(
+        [{"temperature": 5.0, "vibration": 0.1, "rpm": 1500, "timestamp": uptime + 5 * i} for i in range(count)],
+        "reefer-042", seq=seq, relative_time=True,
+    )
+    return subscriber.parse_message(BINARY_TOPIC, message, arrival)
+
+
+def stored(device_id="reefer-042"):
+    session = SessionLocal()
+    try:
+        return session.query(SensorData).filter(SensorData.device_id == device_id).count()
+    finally:
+        session.close()
+
+
+def test_resent_batch_is_deduplicated(subscriber):
+    readings = subscriber.uplink.expand_json_batch(
+        [{"temperature": 5, "vibration": 0.1, "rpm": 1500, "timestamp": 1_780_000_000 + i} for i in range(10)],
+        T0,
+    )
+    for data in readings:
+        data["device_id"] = "reefer-042"
+    assert subscriber.process_sensor_batch([dict(data) for data in readings]) == "ok"
+    assert subscriber.process_sensor_batch([dict(data) for data in readings]) == "ok"
+    assert stored() == 10
+
+
+def test_reboot_restarting_seq_keeps_new_readings(subscriber):
+    # Boot 1: seq 0..23 in two messages; the device reboots, seq restarts at 0
+    subscriber.process_sensor_batch(binary_batch(subscriber, 0, 0, T0 + timedelta(minutes=1)))
+    subscriber.process_sensor_batch(binary_batch(subscriber, 12, 60, T0 + timedelta(minutes=2)))
+    subscriber.process_sensor_batch(binary_batch(subscriber, 0, 0, T0 + timedelta(minutes=10)))
+    assert stored() == 36
+
+
+def test_resent_binary_batch_is_deduplicated(subscriber):
+    # The same uptime-stamped message twice, the copy 40 ms later
+    assert subscriber.process_sensor_batch(binary_batch(subscriber, 0, 0, T0)) == "ok"
+    resent = binary_batch(subscriber, 0, 0, T0 + timedelta(milliseconds=40))
+    assert subscriber.process_sensor_batch(resent) == "ok"
+    assert stored() == 12
+    # The next message of the same boot lines up with the first
+    later = binary_batch(subscriber, 12, 60, T0 + timedelta(minutes=1, milliseconds=700))
+    assert later[0]["received_at"] == resent[-1]["received_at"] + timedelta(seconds=5)
+
+
+def test_duplicates_within_one_batch_are_stored_once(subscriber):
+    batch = binary_batch(subscriber, 0, 0, T0)
+    assert subscriber.process_sensor_batch(batch + [dict(data) for data in batch]) == "ok"
+    assert stored() == 12
+
+
+def readings(device_id, start, temperatures):
+    return [{"device_id": device_id, "seq": start + i, "received_at": T0 + timedelta(seconds=10 * (start + i)),
+             "temperature": temperature, "vibration": 0.1, "rpm": 1500}
+            for i, temperature in enumerate(temperatures)]
+
+
+def assessments(device_id):
+    session = SessionLocal()
+    try:
+        return [(row.timestamp, row.risk_probability, row.risk_reasons) for row in
+                session.query(RiskAssessment).filter(RiskAssessment.device_id == device_id)
+                .order_by(RiskAssessment.timestamp)]
+    finally:
+        session.close()
+
+
+def rollups(device_id):
+    with get_engine().connect() as conn:
+        return [(row.bucket_start, row.count, row.excursion_secs, row.risk_max) for row in conn.execute(
+            select(sensor_rollups).where(sensor_rollups.c.device_id == device_id)
+            .order_by(sensor_rollups.c.resolution, sensor_rollups.c.bucket_start))]
+
+
+def test_failed_batch_replays_like_the_first_attempt(subscriber, monkeypatch):
+    first = [5.0, 5.0, 9.5]
+    second = [10.0, 11.0, 5.0, 9.0]
+    for device_id in ("control", "failed"):
+        assert subscriber.process_sensor_batch(readings(device_id, 0, first)) == "ok"
+    assert subscriber.process_sensor_batch(readings("control", 3, second)) == "ok"
+
+    state = subscriber.excursions.get("failed")
+    before = (state.last_compliant, state.excursion_start, state.last_seen)
+
+    def unavailable(*args, **kwargs):
+        raise OperationalError("UPDATE shipment_compliance", {}, Exception("server closed the connection"))
+
+    with monkeypatch.context() as patch:
+        patch.setattr(subscriber.compliance_tracker, "update", unavailable)
+        assert subscriber.process_sensor_batch(readings("failed", 3, second)) == "unavailable"
+    state = subscriber.excursions.get("failed")
+    assert (state.last_compliant, state.excursion_start, state.last_seen) == before
+    assert stored("failed") == len(first)
+
+    # The spool replays the batch: not late, scored from the pre-failure state
+    assert subscriber.process_sensor_batch(readings("failed", 3, second)) == "ok"
+    assert assessments("failed") == assessments("control")
+    assert rollups("failed") == rollups("control")
+
+
+def test_late_readings_rebuild_rollups_in_the_same_transaction(subscriber):
+    late = set(range(20, 30))
+    temperatures = [5.0] * 20 + [9.5] * 10 + [5.0] * 30
+    batch = [dict(data, temperature=temperature) for data, temperature in
+             zip(readings("reefer-042", 0, temperatures), temperatures)]
+    assert subscriber.process_sensor_batch([data for i, data in enumerate(batch) if i not in late]) == "ok"
+    assert subscriber.process_sensor_batch([data for i, data in enumerate(batch) if i in late]) == "ok"
+
+    incremental = rollups("reefer-042")
+    with get_engine().begin() as conn:
+        rebuild_range(conn, SensorData, RiskAssessment, T0, T0 + timedelta(hours=1), "reefer-042")
+    assert incremental == rollups("reefer-042")
+    assert max(risk for _, _, _, risk in incremental) == max(p for _, p, _ in assessments("reefer-042"))
+
+
+def test_rebuild_matches_incremental_across_the_range_start(subscriber):
+    # An excursion from 0:59:00 to 1:01:00, rebuilt from 1:00 only
+    temperatures = [5.0] * 6 + [9.5] * 12 + [5.0] * 6
+    assert subscriber.process_sensor_batch(readings("reefer-042", 348, temperatures)) == "ok"
+    incremental = rollups("reefer-042")
+    with get_engine().begin() as conn:
+        rebuild_range(conn, SensorData, RiskAssessment, T0 + timedelta(hours=1), T0 + timedelta(hours=2))
+    assert rollups("reefer-042") == incremental
+    assert sum(secs for _, _, secs, _ in incremental[:-2]) == 120
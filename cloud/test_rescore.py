@@ -0,0 +1,35 @@
+import copy
+from datetime import datetime, timedelta
+from sqlalchemy import select, func
+import compliance
+import rescore
+from db import get_engine, DB_URL, SessionLocal, RiskAssessment
+from risk_engine import DEFAULT_RULES
+from rollups import sensor_rollups
+
+T0 = datetime(2026, 5, 1)
+
+
+def test_rescore_rebuilds_rollups_and_compliance(subscriber):
+    subscriber.process_sensor_batch([
+        {"device_id": "reefer-042", "shipment_id": "SHP-1", "seq": i, "vibration": 0.1, "rpm": 1500,
+         "received_at": T0 + timedelta(minutes=i), "temperature": 8.5 if 30 <= i < 40 else 5.0}
+        for i in range(120)
+    ])
+    rules = copy.deepcopy(DEFAULT_RULES)
+    rules["temperature"]["max"] = 9.0  # 8.5 °C is compliant now
+    rescore.metadata.create_all(get_engine())
+
+    assert rescore.rescore_device("reefer-042", "rules-v2", DB_URL, rules, 50) == 120
+
+    session = SessionLocal()
+    try:
+        risk_max = session.execute(select(func.max(RiskAssessment.risk_probability))).scalar()
+        hours = session.execute(select(sensor_rollups.c.risk_max, sensor_rollups.c.excursion_secs)
+                                .where(sensor_rollups.c.resolution == 3600)).all()
+        state = session.execute(select(compliance.shipment_compliance)).mappings().one()
+    finally:
+        session.close()
+    assert max(row.risk_max for row in hours) == risk_max
+    assert sum(row.excursion_secs for row in hours) == 0
+    assert state["readings"] == 120 and state["excursions"] == 0 and state["secs_above"] == 0
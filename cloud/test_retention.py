@@ -0,0 +1,66 @@
+import shutil
+from datetime import datetime, timedelta
+import pytest
+import archive
+import retention
+from db import get_engine, SessionLocal, SensorData, RiskAssessment
+
+T0 = datetime(2026, 5, 1)
+
+
+@pytest.fixture
+def archive_dir():
+    yield archive.ARCHIVE_DIR
+    shutil.rmtree(archive.ARCHIVE_DIR, ignore_errors=True)
+
+
+def readings(day, temperatures, device_id="reefer-042"):
+    start = T0 + timedelta(days=day, hours=23, minutes=58)
+    return [{"device_id": device_id, "seq": day * 1000 + i, "shipment_id": "SHP-1" if i % 2 else None,
+             "received_at": start + timedelta(seconds=10 * i), "temperature": temperature,
+             "vibration": 0.1, "rpm": 1500} for i, temperature in enumerate(temperatures)]
+
+
+def raw_rows(day):
+    session = SessionLocal()
+    try:
+        return retention.device_rows(session, SensorData, RiskAssessment, "reefer-042", T0 + timedelta(days=day))
+    finally:
+        session.close()
+
+
+@pytest.mark.parametrize("fmt", archive.FORMATS)
+def test_partition_roundtrip(tmp_path, fmt):
+    if fmt == "parquet" and not archive.HAS_PYARROW:
+        pytest.skip("pyarrow not installed")
+    rows = [archive.ArchiveRow(2, "reefer-042", None, None, T0 + timedelta(seconds=1.5), -1.25, 0.0, 0, None, ""),
+            archive.ArchiveRow(1, "reefer-042", "SHP-1", 7, T0, 5.0, 0.1, 1500, 0.2, "Temperature Excursion")]
+    archive.write_partition(T0, "reefer-042", rows, fmt=fmt, root=str(tmp_path))
+    assert archive.read_device_day(T0, "reefer-042", root=str(tmp_path)) == sorted(rows, key=archive.sort_key)
+
+
+def test_run_archives_then_deletes_expired_days(subscriber, archive_dir):
+    # Excursions run across midnight, so the rollups depend on the day before
+    for day in range(3):
+        batch = readings(day, [5.0] * 6 + [9.5] * 12 + [5.0] * 6)
+        assert subscriber.process_sensor_batch(batch) == "ok"
+    before = {day: raw_rows(day) for day in range(4)}
+    with get_engine().connect() as conn:
+        rollups = conn.execute(retention.sensor_rollups.select().order_by("resolution", "bucket_start")).all()
+
+    totals = retention.run(get_engine(), SensorData, RiskAssessment, days=1, now=T0 + timedelta(days=4, hours=1))
+    assert (totals["days"], totals["rows"], totals["recomputed"]) == (3, 60, 0)
+
+    # Day 3 (from 00:00) is inside the window and stays raw
+    assert raw_rows(3) == before[3] and len(before[3]) == 12
+    for day in range(3):
+        assert raw_rows(day) == []
+        assert archive.read_device_day(T0 + timedelta(days=day), "reefer-042") == before[day]
+    archived = list(archive.read_range(T0, T0 + timedelta(days=3), "reefer-042"))
+    assert archived == [row for day in range(3) for row in before[day]]
+    with get_engine().connect() as conn:
+        assert conn.execute(retention.sensor_rollups.select().order_by("resolution", "bucket_start")).all() == rollups
+
+    # Idempotent: nothing left to archive
+    again = retention.run(get_engine(), SensorData, RiskAssessment, days=1, now=T0 + timedelta(days=4, hours=1))
+    assert again["rows"] == 0
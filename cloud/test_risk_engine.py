@@ -0,0 +1,38 @@
+import itertools
+import json
+import math
+import pytest
+from risk_engine import RiskEngine, load_rules, reasons_text, REASON_TEMPERATURE, REASON_SHOCK
+
+# Every rule boundary and both sides of it, plus an unknown excursion duration
+TEMPERATURES = [-5.0, 1.99, 2.0, 5.0, 8.0, 8.01, 30.0]
+VIBRATIONS = [0.0, 2.0, 2.01, 9.0]
+RPMS = [0, 499, 500, 999, 1000, 3000]
+DURATIONS = [None, 0.0, 30.0, 47.9, 48.0, 600.0]
+
+
+def test_batch_matches_scalar_scorer():
+    engine = RiskEngine(load_rules())
+    cases = list(itertools.product(TEMPERATURES, VIBRATIONS, RPMS, DURATIONS))
+    temperature, vibration, rpm, duration = zip(*cases)
+    risks, masks = engine.score_batch(temperature, vibration, rpm,
+                                      [math.nan if d is None else d for d in duration])
+    assert masks.dtype.name == "uint8"
+    for case, risk, mask in zip(cases, risks, masks):
+        want_risk, want_mask = engine.score_one(*case)
+        assert (float(risk), int(mask)) == (pytest.approx(want_risk), want_mask), case
+        assert reasons_text(int(mask)) == reasons_text(want_mask)
+
+
+def test_reason_text_order():
+    assert reasons_text(0) == ""
+    assert reasons_text(REASON_SHOCK | REASON_TEMPERATURE) == "Temperature Excursion, Vibration/Shock Detected"
+    assert reasons_text(15).split(", ")[1:3] == ["Cooling Fan Failure", "Unstable Cooling"]
+
+
+def test_rules_file_overrides_one_threshold(tmp_path):
+    path = tmp_path / "rules.json"
+    path.write_text(json.dumps({"temperature": {"max": 25.0}}))
+    engine = RiskEngine(load_rules(str(path)))
+    assert (engine.temp_min, engine.temp_max) == (2.0, 25.0)
+    assert engine.score_one(20.0, 0.1, 1500, None) == (0.0, 0)
@@ -0,0 +1,130 @@
+import os
+from datetime import datetime, timedelta
+import pytest
+import spool as spool_module
+from spool import Spool, segments, segment_path, SpoolError
+
+T0 = datetime(2026, 5, 1)
+
+
+def batch(count, device_id="reefer-042", start=0):
+    return [{"device_id": device_id, "shipment_id": "SHP-1" if i % 2 else None, "seq": start + i,
+             "received_at": T0 + timedelta(seconds=start + i), "temperature": 4.0 + i,
+             "vibration": 0.1, "rpm": 1500} for i in range(count)]
+
+
+def open_spool(path, **kwargs):
+    kwargs.setdefault("fsync", False)
+    kwargs.setdefault("retry_secs", 0)
+    return Spool(str(path), **kwargs)
+
+
+def test_batch_encoding_roundtrip():
+    readings = batch(3) + [dict(batch(1)[0], seq=None, rpm=1499.5)]
+    assert spool_module.decode_batch(spool_module.encode_batch(readings, 7)) == (7, readings)
+
+
+def test_pending_batches_survive_a_restart(tmp_path):
+    spool = open_spool(tmp_path)
+    first, second = spool.append(batch(3)), spool.append(batch(2, start=3))
+    spool.ack([first])
+    spool.close()
+
+    reopened = open_spool(tmp_path, memory_readings=0)
+    assert list(reopened.pending) == [second]
+    assert reopened.replaying
+    assert reopened.load(second) == batch(2, start=3)
+
+
+def test_torn_tail_is_truncated_on_open(tmp_path):
+    spool = open_spool(tmp_path)
+    kept = spool.append(batch(3))
+    torn = spool.append(batch(3, start=3))
+    spool.close()
+    path = segment_path(str(tmp_path), kept[0])
+    intact = torn[1]
+    with open(path, "r+b") as f:
+        f.truncate(os.path.getsize(path) - 5)
+
+    reopened = open_spool(tmp_path)
+    assert list(reopened.pending) == [kept]
+    assert os.path.getsize(path) == intact
+    # Appends after recovery go to a fresh segment and are readable again
+    added = reopened.append(batch(1, start=9))
+    reopened.close()
+    assert list(open_spool(tmp_path).pending) == [kept, added]
+
+
+def test_corrupt_record_stops_recovery_at_that_record(tmp_path):
+    spool = open_spool(tmp_path)
+    kept = spool.append(batch(2))
+    corrupt = spool.append(batch(2, start=2))
+    spool.append(batch(2, start=4))
+    spool.close()
+    with open(segment_path(str(tmp_path), kept[0]), "r+b") as f:
+        f.seek(corrupt[1] + spool_module.RECORD.size + 4)
+        f.write(b"\xff")
+    assert list(open_spool(tmp_path).pending) == [kept]
+
+
+def test_not_a_segment_is_skipped(tmp_path):
+    with open(segment_path(str(tmp_path), 1), "wb") as f:
+        f.write(b"garbage!")
+    with pytest.raises(SpoolError):
+        list(spool_module.read_records(segment_path(str(tmp_path), 1)))
+    assert not open_spool(tmp_path).pending
+
+
+def test_drain_keeps_batches_while_unavailable_then_replays_in_order(tmp_path):
+    spool = open_spool(tmp_path)
+    spool.append(batch(2))
+    spool.append(batch(2, start=2))
+    seen = []
+    spool.drain(lambda readings: "unavailable")
+    assert spool.pending_readings == 4 and spool.replaying
+
+    spool.drain(lambda readings: seen.append([data["seq"] for data in readings]) or "ok")
+    assert seen == [[0, 1, 2, 3]]
+    assert not spool.pending and not spool.replaying
+
+
+def test_error_chunk_is_retried_batch_by_batch(tmp_path):
+    spool = open_spool(tmp_path)
+    spool.append(batch(2))
+    spool.append(batch(2, start=2))
+    calls = []
+
+    def process(readings):
+        calls.append(len(readings))
+        return "error" if len(readings) > 2 else "ok"
+
+    spool.drain(process)
+    assert calls == [4, 2, 2]
+    assert not spool.pending
+
+
+def test_publish_failure_after_commit_is_not_retried(tmp_path, subscriber):
+    class BrokenClient:
+        def publish(self, topic, payload, *args, **kwargs):
+            raise ConnectionError("broker gone")
+
+    subscriber.client = BrokenClient()
+    spool = open_spool(tmp_path)
+    # seq-less readings: a second attempt would store them again
+    spool.append([dict(data, seq=None) for data in batch(2)])
+    spool.append([dict(data, seq=None) for data in batch(2, start=2)])
+    spool.drain(subscriber.process_sensor_batch)
+    assert not spool.pending
+    session = subscriber.SessionLocal()
+    try:
+        assert session.query(subscriber.SensorData).count() == 4
+    finally:
+        session.close()
+
+
+def test_acknowledged_segments_are_deleted(tmp_path):
+    spool = open_spool(tmp_path, segment_bytes=1)
+    keys = [spool.append(batch(1, start=i)) for i in range(3)]
+    assert len(segments(str(tmp_path))) == 4
+    spool.ack(keys[:2])
+    assert segments(str(tmp_path)) == [keys[2][0], spool.segment]
@@ -0,0 +1,100 @@
+from datetime import datetime, timedelta
+import pytest
+import uplink
+
+
+def readings(count, start=1_780_000_000, step=5, temperature=4.0):
+    return [{"temperature": temperature + i * 0.01, "vibration": 0.2 + i * 0.001, "rpm": 1500 + i,
+             "timestamp": start + i * step} for i in range(count)]
+
+
+@pytest.mark.parametrize("delta", [False, True])
+def test_roundtrip_absolute_time(delta):
+    sent = readings(12)
+    device_id, decoded = uplink.decode(uplink.encode(sent, "reefer-042", seq=100, delta=delta))
+    assert device_id == "reefer-042"
+    assert [d["seq"] for d in decoded] == list(range(100, 112))
+    assert [d["timestamp"] for d in decoded] == [r["timestamp"] for r in sent]
+    assert [d["received_at"] for d in decoded] == [datetime.utcfromtimestamp(r["timestamp"]) for r in sent]
+    for got, want in zip(decoded, sent):
+        assert got["temperature"] == pytest.approx(want["temperature"])
+        assert got["vibration"] == pytest.approx(want["vibration"])
+        assert got["rpm"] == want["rpm"]
+
+
+@pytest.mark.parametrize("delta, relative_time", [(False, False), (True, False), (False, True), (True, True)])
+def test_decode_each_flag_combination(delta, relative_time):
+    arrival = datetime(2026, 5, 1, 12, 0, 0)
+    sent = readings(5, start=300 if relative_time else 1_780_000_000, step=7, temperature=-3.0)
+    message = uplink.encode(sent, "reefer-042", seq=7, relative_time=relative_time, delta=delta)
+    flags = (uplink.FLAG_DELTA if delta else 0) | (uplink.FLAG_RELATIVE_TIME if relative_time else 0)
+    assert message[1] == flags
+
+    device_id, decoded = uplink.decode(message, arrival)
+    assert device_id == "reefer-042"
+    assert [d["seq"] for d in decoded] == list(range(7, 12))
+    assert [d["timestamp"] for d in decoded] == [r["timestamp"] for r in sent]
+    if relative_time:
+        want = [arrival - timedelta(seconds=sent[-1]["timestamp"] - r["timestamp"]) for r in sent]
+    else:
+        want = [datetime.utcfromtimestamp(r["timestamp"]) for r in sent]
+    assert [d["received_at"] for d in decoded] == want
+    for got, expected in zip(decoded, sent):
+        assert got["temperature"] == pytest.approx(expected["temperature"])
+        assert got["vibration"] == pytest.approx(expected["vibration"])
+        assert got["rpm"] == expected["rpm"]
+
+
+def test_relative_time_reuses_the_known_boot():
+    clock = uplink.BootClock(jitter_secs=30)
+    message = uplink.encode(readings(3, start=500, step=10), relative_time=True)
+    first = uplink.decode(message, datetime(2026, 5, 1, 12, 0, 0), lambda boot: clock.boot("reefer-042", boot))[1]
+    resent = uplink.decode(message, datetime(2026, 5, 1, 12, 0, 20), lambda boot: clock.boot("reefer-042", boot))[1]
+    assert [d["received_at"] for d in resent] == [d["received_at"] for d in first]
+    rebooted = uplink.decode(message, datetime(2026, 5, 1, 13, 0, 0), lambda boot: clock.boot("reefer-042", boot))[1]
+    assert rebooted[-1]["received_at"] == datetime(2026, 5, 1, 13, 0, 0)
+
+
+def test_delta_is_smaller_and_picked_automatically():
+    sent = readings(60)
+    assert len(uplink.encode(sent, delta=True)) == uplink.HEADER.size + 8 + 59 * 6
+    assert uplink.encode(sent) == uplink.encode(sent, delta=True)
+    assert len(uplink.encode(sent, delta=False)) == uplink.HEADER.size + 60 * 8
+
+
+def test_relative_time_is_anchored_to_arrival():
+    arrival = datetime(2026, 5, 1, 12, 0, 0)
+    message = uplink.encode(readings(3, start=500, step=10), relative_time=True)
+    device_id, decoded = uplink.decode(message, arrival)
+    assert device_id is None
+    assert [d["received_at"] for d in decoded] == [arrival - timedelta(seconds=20),
+                                                   arrival - timedelta(seconds=10), arrival]
+
+
+@pytest.mark.parametrize("payload, error", [
+    (b"\x01\x00", "shorter"),
+    (b"\x07" + bytes(27), "version"),
+])
+def test_decode_rejects_bad_headers(payload, error):
+    with pytest.raises(uplink.PayloadError, match=error):
+        uplink.decode(payload)
+
+
+def test_decode_rejects_truncated_samples():
+    message = uplink.encode(readings(4), delta=False)
+    with pytest.raises(uplink.PayloadError, match="need"):
+        uplink.decode(message[:-1])
+
+
+def test_json_batch_defaults_seq_to_epoch_ms():
+    arrival = datetime(2026, 5, 1)
+    samples = [{"temperature": 5, "vibration": 0.1, "rpm": 1500, "timestamp": 1_780_000_000.5}]
+    (data,) = uplink.expand_json_batch({"samples": samples}, arrival)
+    assert data["seq"] == 1_780_000_000_500
+    assert data["received_at"] == datetime.utcfromtimestamp(1_780_000_000.5)
+
+
+def test_clamp_event_times_moves_future_samples_to_arrival():
+    arrival = datetime(2026, 5, 1)
+    future = [{"received_at": arrival + timedelta(seconds=uplink.MAX_CLOCK_SKEW_SECS + 1)}]
+    assert uplink.clamp_event_times(future, arrival)[0]["received_at"] == arrival
@@ -0,0 +1,237 @@
+"""
+Compact binary uplink format (v1) for device readings.
+
+Devices that publish on cargo/coldchain/<device_id>/bin send this format;
+cargo/coldchain/<device_id>/data stays JSON. One message carries 1..65535
+buffered samples. All fields are little-endian.
+
+Header (28 bytes):
+    u8   version        1
+    u8   flags          FLAG_DELTA | FLAG_RELATIVE_TIME
+    u16  count          number of samples
+    u32  seq            sequence number of the first sample (+1 per sample)
+    u32  base_ts        epoch seconds (or device uptime with FLAG_RELATIVE_TIME)
+    16s  device_id      ASCII, NUL-padded; empty = take it from the topic
+
+Absolute sample (8 bytes), or the first sample in delta mode:
+    u16  dt             seconds since base_ts
+    i16  temperature    0.01 °C
+    u16  vibration      0.001 m/s²
+    u16  rpm
+
+Delta sample (6 bytes, FLAG_DELTA, every sample after the first):
+    u8   dt             seconds since the previous sample
+    i8   temperature    0.01 °C change
+    i16  vibration      0.001 m/s² change
+    i16  rpm            change
+
+A JSON reading is ~75 bytes; a 60-sample delta batch is 28 + 8 + 59 * 6 = 390.
+
+JSON store-and-forward batches on .../data are a list of samples (or
+{"samples": [...]}) each with its own `timestamp` and optional `seq`; see
+expand_json_batch().
+"""
+import os
+import struct
+import threading
+from datetime import datetime, timedelta
+import numpy as np
+
+VERSION = 1
+FLAG_DELTA = 0x01
+FLAG_RELATIVE_TIME = 0x02  # base_ts is device uptime: anchor the last sample to arrival
+
+HEADER = struct.Struct("<BBHII16s")
+ABSOLUTE = np.dtype([("dt", "<u2"), ("temperature", "<i2"), ("vibration", "<u2"), ("rpm", "<u2")])
+DELTA = np.dtype([("dt", "u1"), ("temperature", "i1"), ("vibration", "<i2"), ("rpm", "<i2")])
+
+TEMP_SCALE = 100
+VIB_SCALE = 1000
+
+# JSON batch timestamps below this are device uptime seconds, not epoch
+RELATIVE_TS_BELOW = 1_000_000_000
+# Event times further ahead of arrival than this are clamped to arrival
+MAX_CLOCK_SKEW_SECS = float(os.getenv("MAX_CLOCK_SKEW_SECS", 300))
+# Boot times estimated this close to a device's current one are the same boot
+BOOT_JITTER_SECS = float(os.getenv("BOOT_JITTER_SECS", 30))
+
+
+class PayloadError(ValueError):
+    pass
+
+
+class BootClock:
+    """
+    Per-device boot time for uptime-stamped samples. Each batch estimates the
+    boot as arrival minus the newest sample's uptime; an estimate within
+    BOOT_JITTER_SECS of the device's current boot reuses it, so every copy of
+    a resent batch gets the same sample times (and dedupe key), while a
+    reboot, with uptime back near 0, starts a new boot.
+    """
+
+    def __init__(self, jitter_secs=BOOT_JITTER_SECS):
+        self.jitter = timedelta(seconds=jitter_secs)
+        self.boots = {}
+        self.lock = threading.Lock()
+
+    def boot(self, device_id, estimate):
+        with self.lock:
+            known = self.boots.get(device_id)
+            if known is not None and abs(estimate - known) <= self.jitter:
+                return known
+            self.boots[device_id] = estimate
+            return estimate
+
+
+def decode(payload, received_at=None, boot=None):
+    """
+    Binary message -> (device_id or None, [reading dicts]).
+
+    Readings have temperature/vibration/rpm, `timestamp` (device clock) and
+    `seq`, plus `received_at` (naive UTC): the sample time itself, or for
+    FLAG_RELATIVE_TIME boot time + uptime, the boot being the arrival time
+    minus the newest uptime, passed through `boot` (e.g. a BootClock.boot
+    bound to the device) when given. Sample arrays are read in place from
+    the message buffer.
+    """
+    view = memoryview(payload)
+    if len(view) < HEADER.size:
+        raise PayloadError(f"message shorter than the {HEADER.size}-byte header")
+    version, flags, count, seq, base_ts, raw_id = HEADER.unpack_from(view)
+    if version != VERSION:
+        raise PayloadError(f"unsupported payload version {version}")
+    if count == 0:
+        return None, []
+
+    if flags & FLAG_DELTA:
+        expected = HEADER.size + ABSOLUTE.itemsize + (count - 1) * DELTA.itemsize
+    else:
+        expected = HEADER.size + count * ABSOLUTE.itemsize
+    if len(view) != expected:
+        raise PayloadError(f"{count} samples need {expected} bytes, got {len(view)}")
+
+    first = np.frombuffer(view, ABSOLUTE, count=1, offset=HEADER.size)
+    if flags & FLAG_DELTA:
+        rest = np.frombuffer(view, DELTA, count=count - 1, offset=HEADER.size + ABSOLUTE.itemsize)
+        columns = {
+            name: np.cumsum(np.concatenate((first[name].astype(np.int64), rest[name].astype(np.int64))))
+            for name in ABSOLUTE.names
+        }
+    else:
+        samples = np.frombuffer(view, ABSOLUTE, count=count, offset=HEADER.size)
+        columns = {name: samples[name].astype(np.int64) for name in ABSOLUTE.names}
+
+    offsets = columns["dt"].tolist()
+    temperatures = (columns["temperature"] / TEMP_SCALE).tolist()
+    vibrations = (columns["vibration"] / VIB_SCALE).tolist()
+    rpms = columns["rpm"].tolist()
+
+    if flags & FLAG_RELATIVE_TIME:
+        booted = (received_at or datetime.utcnow()) - timedelta(seconds=base_ts + offsets[-1])
+        anchor = (boot(booted) if boot else booted) + timedelta(seconds=base_ts)
+    else:
+        anchor = datetime.utcfromtimestamp(base_ts)
+
+    device_id = raw_id.rstrip(b"\0").decode("ascii") or None
+    return device_id, [
+        {
+            "temperature": temperatures[i],
+            "vibration": vibrations[i],
+            "rpm": rpms[i],
+            "timestamp": base_ts + offsets[i],
+            "seq": seq + i,
+            "received_at": anchor + timedelta(seconds=offsets[i]),
+        }
+        for i in range(count)
+    ]
+
+
+def _fits(values, dtype):
+    info = np.iinfo(dtype)
+    return all(info.min <= v <= info.max for v in values)
+
+
+def encode(readings, device_id="", seq=0, base_ts=None, relative_time=False, delta=None):
+    """
+    Readings (dicts with temperature, vibration, rpm and an integer
+    `timestamp`, oldest first) -> bytes. `delta=None` picks delta encoding
+    whenever every change fits its field. Used by simulate_device.py and as
+    the reference for the firmware encoder.
+    """
+    if not readings:
+        raise PayloadError("nothing to encode")
+    base_ts = readings[0]["timestamp"] if base_ts is None else base_ts
+    rows = [
+        (int(r["timestamp"]) - base_ts, round(r["temperature"] * TEMP_SCALE),
+         round(r["vibration"] * VIB_SCALE), int(r["rpm"]))
+        for r in readings
+    ]
+    for i, name in enumerate(ABSOLUTE.names):
+        if not _fits([row[i] for row in rows], ABSOLUTE[i]):
+            raise PayloadError(f"{name} out of range for the binary format"
+                               + (" (samples span > 65535 s, split the batch)" if name == "dt" else ""))
+
+    changes = [tuple(b - a for a, b in zip(prev, cur)) for prev, cur in zip(rows, rows[1:])]
+    can_delta = all(
+        _fits([change[i] for change in changes], DELTA[i]) for i in range(len(DELTA))
+    )
+    use_delta = can_delta if delta is None else delta
+    if use_delta and not can_delta:
+        raise PayloadError("changes too large for delta encoding")
+
+    flags = (FLAG_DELTA if use_delta else 0) | (FLAG_RELATIVE_TIME if relative_time else 0)
+    header = HEADER.pack(VERSION, flags, len(rows), seq, base_ts, device_id.encode("ascii")[:16])
+    if use_delta:
+        body = np.array(rows[:1], ABSOLUTE).tobytes() + np.array(changes, DELTA).tobytes()
+    else:
+        body = np.array(rows, ABSOLUTE).tobytes()
+    return header + body
+
+
+def expand_json_batch(message, received_at, boot=None):
+    """
+    JSON batch (list of samples or {"samples": [...]}) -> reading dicts with
+    event-time `received_at` and a dedupe `seq` (the sample's own, else its
+    epoch ms; uptime-stamped samples without seq are not deduplicated since
+    uptime restarts at reboot). Uptime-stamped samples are placed like
+    FLAG_RELATIVE_TIME ones, see decode().
+    """
+    samples = message["samples"] if isinstance(message, dict) else message
+    if not samples:
+        return []
+    timestamps = [float(sample["timestamp"]) for sample in samples]
+    newest = max(timestamps)
+    relative = newest < RELATIVE_TS_BELOW
+    if relative:
+        booted = received_at - timedelta(seconds=newest)
+        booted = boot(booted) if boot else booted
+
+    readings = []
+    for sample, ts in zip(samples, timestamps):
+        data = dict(sample)
+        if relative:
+            data["received_at"] = booted + timedelta(seconds=ts)
+            data.setdefault("seq", None)
+        else:
+            data["received_at"] = datetime.utcfromtimestamp(ts)
+            data.setdefault("seq", int(ts * 1000))
+        readings.append(data)
+    return readings
+
+
+def clamp_event_times(readings, received_at):
+    """Readings stamped in the future (device clock ahead) are moved to arrival time."""
+    limit = received_at + timedelta(seconds=MAX_CLOCK_SKEW_SECS)
+    for data in readings:
+        if data["received_at"] > limit:
+            data["received_at"] = received_at
+    return readings
+
+
+def validate(data):
+    """Raises PayloadError unless temperature / vibration / rpm are numbers."""
+    for field in ("temperature", "vibration", "rpm"):
+        value = data.get(field)
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            raise PayloadError(f"{field} must be a number, got {value!r}")
+    return data
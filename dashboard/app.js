@@ -1,66 +1,41 @@
-// MQTT Configuration
-const MQTT_CONFIG = {
-    host: "34.29.164.71.sslip.io", // SSL Magic Domain
-    port: 443, // HTTPS/WSS Port
-    path: "/mqtt",
-    clientId: "coldchain_dash_" + Math.random().toString(16).substr(2, 8)
-};
-
 // API Configuration
 const API_BASE_URL = "https://34.29.164.71.sslip.io"; // Secured History API
 
-let mqttClient;
-let currentLatestRisk = 0;
-
-function initMQTT() {
-    mqttClient = new Paho.MQTT.Client(MQTT_CONFIG.host, Number(MQTT_CONFIG.port), MQTT_CONFIG.path, MQTT_CONFIG.clientId);
-
-    mqttClient.onConnectionLost = onConnectionLost;
-    mqttClient.onMessageArrived = onMessageArrived;
-
-    const options = {
-        useSSL: true, // Secure Connection
-        onSuccess: onConnect,
-        onFailure: onConnectFailure
-    };
+// Live data: one Server-Sent Events stream from the history API (snapshot + deltas)
+// instead of a per-browser MQTT subscription.
+let liveStream;
+let liveFields = [];
+let loadedMinutes = 0; // widest range currently held in chartData
 
-    mqttClient.connect(options);
-}
-
-function onConnect() {
-    console.log("✅ Connected to MQTT Broker via WebSockets");
-    mqttClient.subscribe("cargo/coldchain/data");
-    mqttClient.subscribe("cargo/coldchain/alert");
-}
-
-function onConnectFailure(err) {
-    console.error("❌ MQTT Connection Failed:", err);
-    setTimeout(initMQTT, 5000); // Retry
-}
+function initLiveStream() {
+    liveStream = new EventSource(`${API_BASE_URL}/api/stream?snapshot=500`);
 
-function onConnectionLost(responseObject) {
-    if (responseObject.errorCode !== 0) {
-        console.log("⚠️ MQTT Connection Lost: " + responseObject.errorMessage);
-        setTimeout(initMQTT, 5000);
-    }
+    liveStream.addEventListener('open', () => console.log("✅ Connected to live stream"));
+    liveStream.addEventListener('fields', (event) => {
+        liveFields = JSON.parse(event.data);
+    });
+    // Snapshots (initial, or after a reconnect gap) only add points newer than what we hold
+    liveStream.addEventListener('snapshot', (event) => onLiveRows(JSON.parse(event.data)));
+    liveStream.addEventListener('delta', (event) => onLiveRows(JSON.parse(event.data)));
+    liveStream.onerror = () => console.log("⚠️ Live stream interrupted, reconnecting..."); // EventSource retries itself
 }
 
-function onMessageArrived(message) {
-    if (isPaused) return;
-
-    try {
-        const payload = JSON.parse(message.payloadString);
+function onLiveRows(rows) {
+    if (isPaused || rows.length === 0) return;
+
+    const newest = chartData.timestamps.length ? chartData.timestamps[chartData.timestamps.length - 1] : 0;
+    let latest = null;
+    rows.forEach(values => {
+        const row = {};
+        liveFields.forEach((field, i) => row[field] = values[i]);
+        if (row.timestamp <= newest) return;
+        updateCharts(row, row.timestamp, row.risk_probability || 0);
+        latest = row;
+    });
 
-        if (message.destinationName === "cargo/coldchain/data") {
-            const timestamp = new Date(); // Use current time for live arrivals
-            updateCharts(payload, timestamp.getTime(), currentLatestRisk);
-            updateLatestReading(payload, { failure_probability: currentLatestRisk });
-            lastUpdateEl.textContent = timestamp.toLocaleString();
-        } else if (message.destinationName === "cargo/coldchain/alert") {
-            currentLatestRisk = payload.probability;
-        }
-    } catch (e) {
-        console.error("Error parsing MQTT message:", e);
+    if (latest) {
+        updateLatestReading(latest, { failure_probability: latest.risk_probability || 0 });
+        lastUpdateEl.textContent = new Date(latest.timestamp).toLocaleString();
     }
 }
 
@@ -493,8 +468,8 @@ setInterval(() => {
     }
 }, 1000);
 
-// Removed Firebase Listeners. Real-time now handled by onMessageArrived.
-initMQTT();
+// Removed Firebase Listeners. Real-time now handled by the live stream (onLiveRows).
+initLiveStream();
 
 // Function to update the latest reading box
 function updateLatestReading(sensorData, predictionData) {
@@ -545,7 +520,11 @@ function loadHistoricalData() {
 
     const minutes = currentTimeValue * (currentTimeUnit === 'hours' ? 60 : currentTimeUnit === 'days' ? 1440 : 1);
 
-    fetch(`${API_BASE_URL}/api/history?minutes=${minutes}`)
+    // Long ranges: hourly rollups beyond a day, otherwise ~1000 visually faithful points (LTTB)
+    const reduce = minutes > 1440 ? '&bucket=1h&agg=avg'
+        : minutes > 60 ? '&downsample=lttb&points=1000' : '';
+
+    fetch(`${API_BASE_URL}/api/history?minutes=${minutes}${reduce}`)
         .then(response => response.json())
         .then(history => {
             if (history.error) throw new Error(history.error);
@@ -567,6 +546,7 @@ function loadHistoricalData() {
             });
 
             updateAllCharts();
+            loadedMinutes = minutes;
 
             if (history.length > 0) {
                 const latest = history[history.length - 1];
@@ -681,7 +661,17 @@ applyTimeFilterBtn.addEventListener('click', () => {
     if (val && val > 0) {
         currentTimeValue = val;
         currentTimeUnit = timeUnitSelect.value;
-        loadHistoricalData();
+        const minutes = getDurationInMillis() / 60000;
+        if (minutes <= loadedMinutes && minutes <= 60) {
+            // Narrowing a raw (non-reduced) range: trim locally, no history query
+            loadedMinutes = minutes;
+            chartData.labels.splice(0, chartData.labels.length,
+                ...chartData.timestamps.map(ts => formatTimeLabel(new Date(ts))));
+            enforceRollingWindow();
+            updateAllCharts();
+        } else {
+            loadHistoricalData();
+        }
     } else {
         alert('Please enter a valid time value.');
     }
@@ -695,7 +685,7 @@ loadHistoricalData();
 // Store all predictions for filtering
 let allPredictions = [];
 
-// Real-time updates and historical sync now handled by loadHistoricalData and onMessageArrived.
+// Real-time updates and historical sync now handled by loadHistoricalData and onLiveRows.
 
 // Display predictions
 function displayPredictions(predictions) {
@@ -811,7 +801,7 @@ function createPredictionItem(item) {
     return div;
 }
 
-// Connection health handled by initMQTT()
+// Connection health handled by EventSource (automatic reconnect + Last-Event-ID resume)
 
 // Clear all data functionality
 const clearAllBtn = document.getElementById('clear-all-btn');
@@ -5,6 +5,13 @@
 #include <Adafruit_Sensor.h>
 // Networking helpers (renamed to avoid collision with core Network.h)
 #include "iot_net.h"
+// Compact binary uplink: -DUSE_BINARY_UPLINK=1 batches readings (see uplink.h)
+#ifndef USE_BINARY_UPLINK
+#define USE_BINARY_UPLINK 0
+#endif
+#if USE_BINARY_UPLINK
+#include "uplink.h"
+#endif
 
 // ================== PIN DEFINITIONS ==================
 #define TEMP_PIN 17
@@ -201,7 +208,11 @@ void loop()
 
     // ----- POST TO API (MQTT) -----
     unsigned long ts = (unsigned long)(millis() / 1000);
+#if USE_BINARY_UPLINK
+    queueBinaryReading(tempC, vibRMS, (int)rpm, ts);
+#else
     publishData(tempC, vibRMS, (int)rpm, ts);
+#endif
 
     // Note: With MQTT we don't get immediate failure probability back synchronously IN THE SAME Call
     // But we expect the callback to update 'latestRisk' and 'isDanger' soon.
@@ -0,0 +1,114 @@
+#pragma once
+
+// Compact binary uplink (format v1, see cloud/uplink.py).
+// Buffers UPLINK_BATCH readings and publishes them in one message on
+// cargo/coldchain/<UPLINK_DEVICE_ID>/bin: 28-byte header + 8 bytes per
+// reading, instead of ~75 bytes of JSON per reading.
+// Enable with -DUSE_BINARY_UPLINK=1.
+
+#include <string.h>
+
+#ifndef UPLINK_DEVICE_ID
+#define UPLINK_DEVICE_ID "esp32-01"
+#endif
+#ifndef UPLINK_BATCH
+#define UPLINK_BATCH 12 // 12 x 5 s = one message per minute
+#endif
+
+#define UPLINK_VERSION 1
+#define UPLINK_FLAG_RELATIVE_TIME 0x02 // timestamps are uptime seconds (no RTC/NTP)
+#define UPLINK_HEADER_SIZE 28
+#define UPLINK_SAMPLE_SIZE 8
+
+static const char *UPLINK_TOPIC = "cargo/coldchain/" UPLINK_DEVICE_ID "/bin";
+
+struct UplinkSample
+{
+    uint32_t ts;
+    int16_t temperature; // 0.01 °C
+    uint16_t vibration;  // 0.001 m/s^2
+    uint16_t rpm;
+};
+
+static UplinkSample uplinkBuffer[UPLINK_BATCH];
+static uint8_t uplinkCount = 0;
+// RAM only: restarts at 0 on every boot. The backend dedupes on
+// (device, seq, timestamp), timestamp = its estimate of boot time + uptime,
+// so resends are dropped and post-reboot readings are not.
+static uint32_t uplinkSeq = 0;
+
+// Little-endian writers (the ESP32 is little-endian, but keep it explicit)
+inline void putU16(uint8_t *p, uint16_t v)
+{
+    p[0] = v & 0xFF;
+    p[1] = v >> 8;
+}
+
+inline void putU32(uint8_t *p, uint32_t v)
+{
+    putU16(p, v & 0xFFFF);
+    putU16(p + 2, v >> 16);
+}
+
+inline size_t encodeUplink(uint8_t *out)
+{
+    uint32_t base = uplinkBuffer[0].ts;
+    out[0] = UPLINK_VERSION;
+    out[1] = UPLINK_FLAG_RELATIVE_TIME;
+    putU16(out + 2, uplinkCount);
+    putU32(out + 4, uplinkSeq);
+    putU32(out + 8, base);
+    memset(out + 12, 0, 16);
+    strncpy((char *)(out + 12), UPLINK_DEVICE_ID, 16);
+
+    uint8_t *p = out + UPLINK_HEADER_SIZE;
+    for (uint8_t i = 0; i < uplinkCount; i++, p += UPLINK_SAMPLE_SIZE)
+    {
+        putU16(p, (uint16_t)(uplinkBuffer[i].ts - base));
+        putU16(p + 2, (uint16_t)uplinkBuffer[i].temperature);
+        putU16(p + 4, uplinkBuffer[i].vibration);
+        putU16(p + 6, uplinkBuffer[i].rpm);
+    }
+    return p - out;
+}
+
+// Queues one reading; publishes when the batch is full. On a failed
+// publish the batch is kept and retried with the next reading (oldest
+// readings are dropped once the buffer is full).
+inline void queueBinaryReading(float temperature, float vibration, int rpm, unsigned long timestamp)
+{
+    if (uplinkCount == UPLINK_BATCH)
+    {
+        memmove(uplinkBuffer, uplinkBuffer + 1, sizeof(UplinkSample) * (UPLINK_BATCH - 1));
+        uplinkCount--;
+        uplinkSeq++;
+    }
+    UplinkSample &s = uplinkBuffer[uplinkCount++];
+    s.ts = timestamp;
+    s.temperature = (int16_t)lroundf(temperature * 100.0f);
+    s.vibration = (uint16_t)constrain(lroundf(vibration * 1000.0f), 0L, 65535L);
+    s.rpm = (uint16_t)constrain(rpm, 0, 65535);
+
+    if (uplinkCount < UPLINK_BATCH)
+        return;
+    if (WiFi.status() != WL_CONNECTED)
+        return;
+    if (!client.connected())
+        connectMQTT();
+
+    uint8_t message[UPLINK_HEADER_SIZE + UPLINK_BATCH * UPLINK_SAMPLE_SIZE];
+    size_t length = encodeUplink(message);
+    Serial.print("📤 Publishing binary batch (");
+    Serial.print(length);
+    Serial.print(" bytes)... ");
+    if (client.publish(UPLINK_TOPIC, message, length))
+    {
+        Serial.println("✓ Success!");
+        uplinkSeq += uplinkCount;
+        uplinkCount = 0;
+    }
+    else
+    {
+        Serial.println("✗ Failed! Keeping batch for retry.");
+    }
+}